@@ -0,0 +1,54 @@
+# bench_async_engine.py
+#
+# Runs a small playbook through AsyncPlaybookEngine against simulated hosts.
+# Usage: python3 -m benchmarks.bench_async_engine --hosts 10000 --latency 0.005
+
+import argparse
+import asyncio
+import logging
+import time
+from deploymate.async_executor import AsyncPlaybookEngine, DEFAULT_HANDLER_WORKERS
+from deploymate.utils.async_ssh import FakeAsyncSSHConnection
+
+PLAYBOOK = {
+    'tasks': [
+        {'name': 'Create app directory', 'type': 'directory', 'action': 'create', 'directory_path': '/opt/app'},
+        {'name': 'Install nginx', 'type': 'package', 'action': 'install', 'package_name': 'nginx'},
+        {'name': 'Start nginx', 'type': 'service', 'action': 'start', 'service_name': 'nginx'},
+        {'name': 'Touch marker', 'type': 'command', 'command': 'touch /opt/app/.deployed'},
+    ]
+}
+
+def build_inventory(host_count):
+    return {'all': {'hosts': {f'host{i:05d}': {'host': f'10.{i // 65536}.{i // 256 % 256}.{i % 256}', 'user': 'ubuntu'}
+                              for i in range(host_count)}}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the asyncio engine with simulated hosts")
+    parser.add_argument('--hosts', type=int, default=10000, help='Number of simulated hosts')
+    parser.add_argument('--latency', type=float, default=0.005, help='Simulated round-trip time in seconds')
+    parser.add_argument('--handler-workers', type=int, default=DEFAULT_HANDLER_WORKERS,
+                        help='Threads available to run handlers (default: one per host)')
+    args = parser.parse_args()
+
+    # Handler logging would dominate the measurement
+    logging.disable(logging.WARNING)
+    connections = []
+
+    def connection_factory(host_name, params):
+        connection = FakeAsyncSSHConnection(host_name, latency=args.latency)
+        connections.append(connection)
+        return connection
+
+    engine = AsyncPlaybookEngine(connection_factory=connection_factory, max_concurrent_hosts=args.hosts,
+                                 handler_workers=args.handler_workers)
+    start = time.perf_counter()
+    report = asyncio.run(engine.run(PLAYBOOK, build_inventory(args.hosts)))
+    elapsed = time.perf_counter() - start
+
+    commands = sum(len(connection.commands) for connection in connections)
+    print(f"hosts={args.hosts} tasks={len(report.results)} failed={len(report.failed_results())}")
+    print(f"elapsed={elapsed:.2f}s commands={commands} commands/s={commands / elapsed:.0f}")
+
+if __name__ == "__main__":
+    main()
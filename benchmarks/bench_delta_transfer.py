@@ -0,0 +1,102 @@
+# bench_delta_transfer.py
+#
+# Measures bytes on the wire for delta transfers at several change ratios.
+# The remote signature and patch scripts run locally through python3, so the
+# numbers include the exact signature and delta streams a host would see.
+# Changes too large for a delta are reported as full uploads.
+# Usage: python3 -m benchmarks.bench_delta_transfer --size-mb 64
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from deploymate.utils.delta_transfer import (DeltaCache, DeltaStats, DeltaTooLargeError, REMOTE_PATCH_SCRIPT,
+                                             REMOTE_SIGNATURE_SCRIPT, choose_block_size, parse_signature)
+from deploymate.utils.digest_cache import file_sha256
+
+CHANGE_RATIOS = (0.0, 0.001, 0.01, 0.1, 0.5)
+# Bytes overwritten at each changed location
+CHANGE_SIZE = 4096
+
+def write_random_file(path, size, seed):
+    rng = random.Random(seed)
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining:
+            chunk = min(remaining, 1024 * 1024)
+            file.write(rng.getrandbits(chunk * 8).to_bytes(chunk, 'little'))
+            remaining -= chunk
+
+def mutate(path, ratio, seed, insert=False):
+    """Overwrite about ``ratio`` of the file in CHANGE_SIZE pieces, or insert one piece at the front."""
+    rng = random.Random(seed)
+    with open(path, 'r+b') as file:
+        if insert:
+            data = file.read()
+            file.seek(0)
+            file.write(os.urandom(CHANGE_SIZE) + data)
+            return
+        size = os.fstat(file.fileno()).st_size
+        for _ in range(int(size * ratio / CHANGE_SIZE)):
+            file.seek(rng.randrange(0, size - CHANGE_SIZE))
+            file.write(os.urandom(CHANGE_SIZE))
+
+def run_case(work_dir, size, label, ratio=0.0, insert=False):
+    old_path = os.path.join(work_dir, 'remote.bin')
+    new_path = os.path.join(work_dir, 'local.bin')
+    write_random_file(old_path, size, seed=1)
+    shutil.copyfile(old_path, new_path)
+    mutate(new_path, ratio, seed=2, insert=insert)
+
+    stats = DeltaStats(os.path.getsize(new_path))
+    block_size = choose_block_size(stats.file_size)
+    start = time.perf_counter()
+    signature_output = subprocess.run([sys.executable, '-c', REMOTE_SIGNATURE_SCRIPT, old_path, str(block_size)],
+                                      check=True, capture_output=True, text=True).stdout
+    stats.signature_bytes = len(signature_output)
+    signature = parse_signature(signature_output)
+
+    try:
+        delta = DeltaCache().delta(new_path, signature)
+    except DeltaTooLargeError:
+        stats.full_transfer = True
+        delta = None
+
+    if delta:
+        stats.delta_bytes = delta.stats.delta_bytes
+        patch = subprocess.Popen([sys.executable, '-c', REMOTE_PATCH_SCRIPT, old_path, old_path,
+                                  file_sha256(new_path)], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        for chunk in delta.chunks():
+            patch.stdin.write(chunk)
+        patch.stdin.close()
+        if patch.wait() != 0:
+            raise SystemExit(f"{label}: remote rebuild failed")
+    elapsed = time.perf_counter() - start
+
+    if delta and file_sha256(old_path) != file_sha256(new_path):
+        raise SystemExit(f"{label}: rebuilt file differs from the local file")
+    delta_column = 'full' if stats.full_transfer else stats.delta_bytes
+    print(f"{label:>12} {stats.file_size:>12} {stats.signature_bytes:>10} {delta_column:>12} "
+          f"{stats.bytes_on_wire / stats.file_size:>7.1%} {elapsed:>7.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delta transfer bytes on the wire")
+    parser.add_argument('--size-mb', type=int, default=64, help='Size of the simulated artifact in MiB')
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    print(f"{'change':>12} {'file bytes':>12} {'signature':>10} {'delta bytes':>12} {'wire':>7} {'time':>8}")
+    work_dir = tempfile.mkdtemp(prefix='deploymate-delta-bench-')
+    try:
+        for ratio in CHANGE_RATIOS:
+            run_case(work_dir, size, f"{ratio:.1%}", ratio=ratio)
+        run_case(work_dir, size, 'insert 4KiB', insert=True)
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# bench_fleet.py
+#
+# Runs a representative playbook through execute_playbook_from_files against
+# a simulated fleet served by local fake SSH servers (see fake_ssh_server.py)
+# and reports throughput, per-task latency percentiles, the controller's peak
+# memory and the bytes sent to the hosts. With --json, the results are also
+# appended as one JSON line to a file so runs can be compared over time.
+# Usage: python3 -m benchmarks.bench_fleet --hosts 500 --latency 0.02 --bandwidth 10 --forks 200
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+import yaml
+from benchmarks.fake_ssh_server import FakeFleet, ServerSettings
+from deploymate.playbook_executor import YAMLDataProvider, execute_playbook_from_files
+from deploymate.run_report import STATUS_FAILED, STATUS_UNREACHABLE
+from deploymate.strategies import STRATEGIES, STRATEGY_LINEAR
+from deploymate.tracing import enable_tracing, disable_tracing
+
+PLAYBOOKS = ('commands', 'mixed')
+
+def write_payload(payload_dir, file_size, tree_files):
+    """Create the files the mixed playbook uploads: one file and a tree of ``tree_files`` files."""
+    with open(os.path.join(payload_dir, 'app.conf'), 'wb') as file:
+        file.write(os.urandom(file_size))
+    tree_dir = os.path.join(payload_dir, 'site')
+    os.makedirs(tree_dir)
+    for index in range(tree_files):
+        with open(os.path.join(tree_dir, f"page{index}.html"), 'w') as file:
+            file.write(f"<html><body>page {index}</body></html>\n" * 64)
+
+def generated_content(size):
+    """Return ``size`` bytes of config-like text, as a template or generator would write."""
+    line = "option_{:06d} = " + "v" * 48 + "\n"
+    lines = -(-size // len(line.format(0)))
+    return "".join(line.format(index) for index in range(lines))[:size]
+
+def build_playbook(name, content):
+    """Return the tasks of a benchmark playbook, whose uploads come from the payload directory."""
+    if name == 'commands':
+        return {'tasks': [{'name': f"Command {index}", 'type': 'command', 'command': f"echo {index}"}
+                          for index in range(5)]}
+    return {'tasks': [
+        {'name': 'Create app directory', 'type': 'directory', 'action': 'create', 'directory_path': '/opt/bench'},
+        {'name': 'Install nginx', 'type': 'package', 'action': 'install', 'package_name': 'nginx'},
+        {'name': 'Upload config', 'type': 'file', 'action': 'upload', 'remote_path': '/opt/bench',
+         'files': ['app.conf'], 'notify': 'Restart nginx'},
+        {'name': 'Upload site', 'type': 'file', 'action': 'upload_tree', 'remote_path': '/var/www/bench',
+         'local_dir': 'site'},
+        {'name': 'Write marker', 'type': 'file', 'action': 'create', 'file_path': '/opt/bench/release',
+         'content': content},
+        {'name': 'Report', 'type': 'command', 'command': 'echo deployed'},
+    ], 'handlers': [
+        {'name': 'Restart nginx', 'type': 'service', 'action': 'restart', 'service_name': 'nginx'},
+    ]}
+
+def build_inventory(host_count, port):
+    return {'all': {'hosts': {f"bench[00001:{host_count:05d}]": {'host': '127.0.0.1', 'port': port,
+                                                                   'user': 'bench', 'password': 'bench'}}}}
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * fraction // 1))
+    return sorted_values[int(rank) - 1]
+
+def peak_memory_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark playbook runs against a simulated fleet")
+    parser.add_argument('--hosts', type=int, default=100, help='Simulated hosts (1 to 99999)')
+    parser.add_argument('--playbook', choices=PLAYBOOKS, default='mixed',
+                        help='commands: five commands; mixed: directory, package, uploads, command and a '
+                             'service restart handler')
+    parser.add_argument('--latency', type=float, default=0.02, help='Round-trip time to each host in seconds')
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help='Bandwidth of each host in MiB/s (default: unlimited)')
+    parser.add_argument('--command-time', type=float, default=0.01, help='Seconds each remote command runs')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='Size of the uploaded file in bytes')
+    parser.add_argument('--content-size', type=int, default=0,
+                        help='Size in bytes of the generated file the mixed playbook writes (default: a 5 byte marker)')
+    parser.add_argument('--tree-files', type=int, default=20, help='Files in the uploaded directory tree')
+    parser.add_argument('--forks', type=int, default=100, help='Hosts worked on concurrently')
+    parser.add_argument('--max-parallel-connects', type=int, default=50, help='SSH handshakes run at once')
+    parser.add_argument('--strategy', choices=STRATEGIES, default=STRATEGY_LINEAR, help='Execution strategy')
+    parser.add_argument('--serial', default=None, help='Rolling batch sizes, e.g. 10%%')
+    parser.add_argument('--compile-scripts', action='store_true', help='Run shell-only tasks as one script')
+    parser.add_argument('--server-processes', type=int, default=max(1, min(4, (os.cpu_count() or 1) - 1)),
+                        help='Processes serving the simulated hosts')
+    parser.add_argument('--trace', metavar='PATH', help='Record spans and write them as Chrome trace JSON')
+    parser.add_argument('--json', metavar='PATH', help='Append the results as a JSON line to this file')
+    args = parser.parse_args()
+    if not 1 <= args.hosts <= 99999:
+        parser.error("--hosts must be between 1 and 99999")
+
+    # Per-task logging would dominate the measurement
+    logging.disable(logging.WARNING)
+    settings = ServerSettings(latency=args.latency, bandwidth=args.bandwidth * 1024 * 1024 or None,
+                              command_time=args.command_time)
+    content = generated_content(args.content_size) if args.content_size else 'bench'
+    work_dir = tempfile.mkdtemp(prefix='deploymate-bench-')
+    # The plan resolves uploads against the payload, so config/files_to_upload is left alone
+    payload_dir = os.path.join(work_dir, 'payload')
+    try:
+        os.makedirs(payload_dir)
+        write_payload(payload_dir, args.file_size, args.tree_files)
+        with FakeFleet(settings, processes=args.server_processes) as fleet:
+            playbook_path = os.path.join(work_dir, 'playbook.yaml')
+            inventory_path = os.path.join(work_dir, 'inventory.yaml')
+            with open(playbook_path, 'w') as file:
+                yaml.safe_dump(build_playbook(args.playbook, content), file)
+            with open(inventory_path, 'w') as file:
+                yaml.safe_dump(build_inventory(args.hosts, fleet.port), file)
+
+            baseline_memory = peak_memory_mib()
+            if args.trace:
+                enable_tracing()
+            start = time.perf_counter()
+            report = execute_playbook_from_files(playbook_path, inventory_path, YAMLDataProvider(), plan_cache_dir=None,
+                                                 upload_dir=payload_dir, forks=args.forks,
+                                                 max_parallel_connects=args.max_parallel_connects,
+                                                 strategy=args.strategy, serial=args.serial,
+                                                 compile_scripts=args.compile_scripts)
+            elapsed = time.perf_counter() - start
+            tracer = disable_tracing()
+            server_stats = fleet.stats()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    durations = sorted(result.duration for result in report.results if result.duration is not None)
+    failed = [result for result in report.results if result.status in (STATUS_FAILED, STATUS_UNREACHABLE)]
+    results = {
+        'hosts': args.hosts, 'playbook': args.playbook, 'strategy': args.strategy, 'serial': args.serial,
+        'compile_scripts': args.compile_scripts, 'traced': bool(args.trace), 'forks': args.forks,
+        'latency': args.latency, 'bandwidth_mib': args.bandwidth, 'command_time': args.command_time,
+        'elapsed': round(elapsed, 3),
+        'tasks': len(report.results),
+        'failed': len(failed),
+        'tasks_per_second': round(len(report.results) / elapsed, 1),
+        'hosts_per_second': round(args.hosts / elapsed, 1),
+        'task_p50_ms': round(percentile(durations, 0.50) * 1000, 1),
+        'task_p99_ms': round(percentile(durations, 0.99) * 1000, 1),
+        'peak_memory_mib': round(peak_memory_mib(), 1),
+        'run_memory_mib': round(peak_memory_mib() - baseline_memory, 1),
+        **server_stats,
+    }
+
+    print(f"hosts={args.hosts} playbook={args.playbook} strategy={args.strategy} elapsed={elapsed:.2f}s "
+          f"tasks={results['tasks']} failed={results['failed']}")
+    print(f"throughput: {results['tasks_per_second']} tasks/s, {results['hosts_per_second']} hosts/s")
+    print(f"task latency: p50={results['task_p50_ms']}ms p99={results['task_p99_ms']}ms")
+    print(f"memory: peak={results['peak_memory_mib']}MiB (+{results['run_memory_mib']}MiB during the run)")
+    print(f"transfer: received={server_stats['bytes_received'] / 1024 / 1024:.1f}MiB "
+          f"sent={server_stats['bytes_sent'] / 1024:.1f}KiB files={server_stats['files']} "
+          f"commands={server_stats['commands']} connections={server_stats['connections']}")
+    for result in failed[:3]:
+        print(f"  {result.host_name} | {result.task_name}: {result.error}")
+
+    if tracer:
+        tracer.write_chrome_trace(args.trace)
+        summary = tracer.summary(limit=3)
+        print(f"trace: {len(tracer.spans)} spans written to {args.trace}; time per category: "
+              + ", ".join(f"{category}={seconds:.1f}s" for category, seconds in sorted(summary['categories'].items())))
+        for seconds, host, task in summary['tasks']:
+            print(f"  slowest task {seconds * 1000:.0f}ms {host} | {task}")
+
+    if args.json:
+        with open(args.json, 'a') as file:
+            file.write(json.dumps({'timestamp': time.time(), **results}) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# bench_handler_dispatch.py
+#
+# Measures the import cost of the handler factory and the cost of looking up
+# a handler per task. "eager" reproduces the previous behaviour: importing
+# every handler module up front and building a new handler for every task.
+# Usage: python3 -m benchmarks.bench_handler_dispatch --dispatches 200000
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from deploymate.resource_handler_factory import BUILTIN_HANDLERS, HandlerRegistry, _import_reference
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+{body}
+print(time.perf_counter() - start)
+"""
+
+LAZY_IMPORT = "import deploymate.resource_handler_factory"
+EAGER_IMPORT = "\n".join(f"import {reference.partition(':')[0]}" for reference in BUILTIN_HANDLERS.values())
+
+def time_import(body, repeats):
+    """Return the median seconds a fresh interpreter spends running ``body``."""
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET.format(body=body)],
+                                check=True, capture_output=True, text=True).stdout
+        samples.append(float(output.split()[-1]))
+    return statistics.median(samples)
+
+def time_dispatch(lookup, dispatches):
+    """Return nanoseconds per handler lookup over a round robin of task types."""
+    types = list(BUILTIN_HANDLERS)
+    start = time.perf_counter()
+    for index in range(dispatches):
+        lookup(types[index % len(types)])
+    return (time.perf_counter() - start) / dispatches * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark handler registry startup and dispatch")
+    parser.add_argument('--dispatches', type=int, default=200000, help='Handler lookups to time')
+    parser.add_argument('--repeats', type=int, default=5, help='Fresh interpreters per import measurement')
+    args = parser.parse_args()
+
+    lazy_import = time_import(LAZY_IMPORT, args.repeats)
+    eager_import = time_import(EAGER_IMPORT, args.repeats)
+    print(f"import  lazy registry={lazy_import * 1000:.1f}ms  all handlers={eager_import * 1000:.1f}ms")
+
+    registry = HandlerRegistry(BUILTIN_HANDLERS, entry_point_group=None)
+    classes = {resource_type: _import_reference(reference) for resource_type, reference in BUILTIN_HANDLERS.items()}
+    cached = time_dispatch(registry.get, args.dispatches)
+    fresh = time_dispatch(lambda resource_type: classes[resource_type](), args.dispatches)
+    print(f"dispatch  cached instance={cached:.0f}ns  new instance per task={fresh:.0f}ns")
+
+if __name__ == "__main__":
+    main()
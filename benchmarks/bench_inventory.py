@@ -0,0 +1,51 @@
+# bench_inventory.py
+#
+# Builds a generated inventory of racks of hosts, defined with host ranges,
+# and measures load time, memory and how long host patterns take to resolve.
+# Usage: python3 -m benchmarks.bench_inventory --hosts 50000 --racks 50
+
+import argparse
+import time
+import tracemalloc
+from deploymate.inventory import Inventory
+
+PATTERNS = ['all', 'rack7', 'rack1:rack2:&frontend', 'frontend:!rack3', 'r1*', 'r04n[00001:00500]']
+
+def build_inventory_data(host_count, rack_count):
+    per_rack = host_count // rack_count
+    racks = {f'rack{rack}': {'vars': {'rack': rack}, 'hosts': {f'r{rack:02d}n[00001:{per_rack:05d}]': {}}}
+             for rack in range(rack_count)}
+    frontend = {f'rack{rack}': None for rack in range(0, rack_count, 2)}
+    return {'all': {'vars': {'user': 'deploy', 'ssh_private_key_file': '~/.ssh/fleet.pem'},
+                    'children': {**racks, 'frontend': {'vars': {'http_port': 8080}, 'children': frontend}}}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark inventory loading and host pattern resolution")
+    parser.add_argument('--hosts', type=int, default=50000, help='Hosts in the generated inventory')
+    parser.add_argument('--racks', type=int, default=50, help='Groups the hosts are split into')
+    args = parser.parse_args()
+
+    data = build_inventory_data(args.hosts, args.racks)
+    start = time.perf_counter()
+    inventory = Inventory.from_dict(data)
+    elapsed = time.perf_counter() - start
+
+    print(f"load hosts={len(inventory)} time={elapsed * 1000:.0f}ms")
+
+    for pattern in PATTERNS:
+        start = time.perf_counter()
+        count = len(inventory.resolve(pattern))
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        inventory.resolve(pattern)
+        cached = time.perf_counter() - start
+        print(f"{pattern:<24} hosts={count:<6} first={first * 1000:.2f}ms cached={cached * 1e6:.1f}us")
+
+    tracemalloc.start()
+    Inventory.from_dict(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"load peak_memory={peak / 1024 / 1024:.1f}MiB")
+
+if __name__ == "__main__":
+    main()
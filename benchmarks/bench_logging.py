@@ -0,0 +1,116 @@
+# bench_logging.py
+#
+# Measures what logging costs the worker threads of a run: every host of a
+# simulated fleet runs its tasks on a thread pool and logs what a command
+# task logs (the command, its output lines at DEBUG and the output at INFO)
+# at the INFO level. The synchronous setup formats eager f-strings and
+# writes them on the worker threads, as before the log pipeline; the
+# pipeline setups queue lazy records for the listener thread. Output goes to
+# temporary files.
+# Usage: python3 -m benchmarks.bench_logging --hosts 1000 --tasks 10
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from deploymate.log_pipeline import log_context, start_logging, stop_logging
+
+logger = logging.getLogger('deploymate.bench')
+
+SETUPS = ('disabled', 'synchronous', 'pipeline', 'pipeline-json')
+
+def run_task_eager(host_name, task_name, command, lines, task_time):
+    with log_context(host_name, task_name):
+        logger.info(f"Executing command: {command}")
+        time.sleep(task_time)
+        for line in lines:
+            logger.debug(f"stdout: {line}")
+        logger.info(f"Command output: {lines}")
+
+def run_task_lazy(host_name, task_name, command, lines, task_time):
+    with log_context(host_name, task_name):
+        logger.info("Executing command: %s", command)
+        time.sleep(task_time)
+        for line in lines:
+            logger.debug("%s: %s", 'stdout', line)
+        logger.info("Command output: %s", lines)
+
+def run_fleet(run_task, hosts, tasks, lines, forks, task_time):
+    """Run every task on every host, a task at a time like the linear strategy; return the wall time."""
+    host_names = [f"bench{index:05d}" for index in range(hosts)]
+    output = [f"output line {index} of the command" for index in range(lines)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=forks) as executor:
+        for task_index in range(tasks):
+            task_name = f"Command {task_index}"
+            command = f"echo {task_index}"
+            list(executor.map(lambda host_name: run_task(host_name, task_name, command, output, task_time),
+                              host_names))
+    return time.perf_counter() - start
+
+def measure(setup, args, out_dir):
+    """Return (worker seconds, seconds to write out what was still queued) for one setup."""
+    root = logging.getLogger()
+    run_args = (args.hosts, args.tasks, args.lines, args.forks, args.task_time)
+    if setup == 'disabled':
+        logging.disable(logging.CRITICAL)
+        try:
+            return run_fleet(run_task_lazy, *run_args), 0.0
+        finally:
+            logging.disable(logging.NOTSET)
+
+    log_file = open(os.path.join(out_dir, f"{setup}.log"), 'w')
+    try:
+        if setup == 'synchronous':
+            handler = logging.StreamHandler(log_file)
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            previous_level = root.level
+            root.addHandler(handler)
+            root.setLevel(logging.INFO)
+            try:
+                return run_fleet(run_task_eager, *run_args), 0.0
+            finally:
+                root.removeHandler(handler)
+                root.setLevel(previous_level)
+
+        json_path = os.path.join(out_dir, 'run.jsonl') if setup == 'pipeline-json' else None
+        start_logging(logging.INFO, stream=log_file, json_path=json_path)
+        elapsed = run_fleet(run_task_lazy, *run_args)
+        start = time.perf_counter()
+        stop_logging()
+        return elapsed, time.perf_counter() - start
+    finally:
+        log_file.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cost of logging on a run's worker threads")
+    parser.add_argument('--hosts', type=int, default=1000, help='Simulated hosts')
+    parser.add_argument('--tasks', type=int, default=10, help='Command tasks run on every host')
+    parser.add_argument('--lines', type=int, default=20, help='Output lines of every command')
+    parser.add_argument('--forks', type=int, default=100, help='Worker threads')
+    parser.add_argument('--task-time', type=float, default=0.005,
+                        help='Seconds each task waits, as on its remote command; 0 measures logging alone')
+    args = parser.parse_args()
+
+    out_dir = tempfile.mkdtemp(prefix='deploymate-bench-logging-')
+    try:
+        results = {setup: measure(setup, args, out_dir) for setup in SETUPS}
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    task_runs = args.hosts * args.tasks
+    baseline = results['disabled'][0]
+    print(f"hosts={args.hosts} tasks={args.tasks} lines={args.lines} forks={args.forks} "
+          f"({task_runs} task runs, {task_runs * 2} INFO and {task_runs * args.lines} DEBUG records)")
+    for setup in SETUPS:
+        elapsed, drain = results[setup]
+        overhead = (elapsed - baseline) / task_runs
+        # A task on a real host takes at least one SSH round trip, typically milliseconds
+        print(f"{setup:14s} workers {elapsed:6.2f}s  drain {drain:5.2f}s  "
+              f"logging per task run {overhead * 1e6:6.1f}us  ({overhead / 1e-3:.2%} of a 1ms task)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# bench_plan_cache.py
+#
+# Measures how long it takes to turn a generated playbook and inventory into a
+# Plan: parsing with the pure-Python and the libyaml loader, compiling, and
+# loading the compiled plan from the on-disk cache.
+# Usage: python3 -m benchmarks.bench_plan_cache --tasks 5000 --hosts 400
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import yaml
+from deploymate.plan import PlanCache, compile_plan, load_plan
+from deploymate.playbook_executor import YAMLDataProvider
+
+def generate_files(directory, task_count, host_count):
+    """Write a playbook of ``task_count`` tasks and an inventory of ``host_count`` hosts; return their paths."""
+    host_names = [f"web{index:04d}" for index in range(host_count)]
+    inventory = {'all': {'hosts': {name: {'host': f"10.0.{index // 256}.{index % 256}", 'user': 'deploy'}
+                                   for index, name in enumerate(host_names)}}}
+    tasks = []
+    for index in range(task_count):
+        hosts = 'all' if index % 3 else host_names[index % host_count::7]
+        kind = index % 4
+        if kind == 0:
+            tasks.append({'name': f"Install package {index}", 'type': 'package', 'action': 'install',
+                          'package_name': f"pkg{index}", 'hosts': hosts})
+        elif kind == 1:
+            tasks.append({'name': f"Create directory {index}", 'type': 'directory', 'action': 'create',
+                          'directory_path': f"/opt/app/{index}", 'hosts': hosts})
+        elif kind == 2:
+            tasks.append({'name': f"Write config {index}", 'type': 'file', 'action': 'overwrite',
+                          'remote_path': '/etc/app', 'files': [f"{index}.conf"], 'content': f"value={index}",
+                          'hosts': hosts})
+        else:
+            tasks.append({'name': f"Run command {index}", 'type': 'command', 'command': f"echo {index}",
+                          'hosts': hosts})
+
+    playbook_path = os.path.join(directory, 'playbook.yaml')
+    inventory_path = os.path.join(directory, 'inventory.yaml')
+    with open(playbook_path, 'w') as file:
+        yaml.dump({'tasks': tasks}, file, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
+    with open(inventory_path, 'w') as file:
+        yaml.dump(inventory, file, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
+    return playbook_path, inventory_path
+
+def median_seconds(function, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark playbook parsing, compiling and plan caching")
+    parser.add_argument('--tasks', type=int, default=5000, help='Tasks in the generated playbook')
+    parser.add_argument('--hosts', type=int, default=400, help='Hosts in the generated inventory')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per measurement')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        playbook_path, inventory_path = generate_files(directory, args.tasks, args.hosts)
+        data_provider = YAMLDataProvider()
+        cache = PlanCache(os.path.join(directory, 'plans'))
+
+        def parse_with(loader):
+            for path in (playbook_path, inventory_path):
+                with open(path) as file:
+                    yaml.load(file, Loader=loader)
+
+        playbook = data_provider.parse_playbook(playbook_path)
+        inventory = data_provider.parse_inventory(inventory_path)
+        timings = [
+            ('parse, pure-Python loader', lambda: parse_with(yaml.SafeLoader)),
+            ('parse, libyaml loader', lambda: parse_with(getattr(yaml, 'CSafeLoader', yaml.SafeLoader))),
+            ('compile parsed playbook', lambda: compile_plan(playbook, inventory)),
+            ('load_plan without cache', lambda: load_plan(playbook_path, inventory_path, data_provider)),
+        ]
+        for label, function in timings:
+            print(f"{label:<28} {median_seconds(function, args.repeats) * 1000:8.1f}ms")
+
+        load_plan(playbook_path, inventory_path, data_provider, cache)
+        cached = median_seconds(lambda: load_plan(playbook_path, inventory_path, data_provider, cache), args.repeats)
+        print(f"{'load_plan, cache hit':<28} {cached * 1000:8.1f}ms")
+
+if __name__ == "__main__":
+    main()
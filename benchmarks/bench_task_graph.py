@@ -0,0 +1,54 @@
+# bench_task_graph.py
+#
+# Schedules a generated host task list with the task graph scheduler, each
+# step simulated by sleeping for its latency, and compares the wall time with
+# the sum of all steps (sequential execution) and the graph's critical path.
+# Usage: python3 -m benchmarks.bench_task_graph --tasks 60 --latency 0.05 --concurrency 4
+
+import argparse
+import time
+from deploymate.task_graph import build_task_graph, critical_path_length, run_task_graph
+
+def generate_tasks(task_count):
+    """Return a mix of directory, upload, package and service tasks over a few application trees."""
+    tasks = []
+    for index in range(task_count):
+        app = f"/opt/app{index % 6}"
+        kind = index % 5
+        if kind == 0:
+            tasks.append({'name': f"dir {index}", 'type': 'directory', 'action': 'create',
+                          'directory_path': f"{app}/releases/{index}"})
+        elif kind in (1, 2):
+            tasks.append({'name': f"upload {index}", 'type': 'file', 'action': 'upload', 'remote_path': f"{app}/conf",
+                          'files': [f"{index}.conf"]})
+        elif kind == 3:
+            tasks.append({'name': f"package {index}", 'type': 'package', 'action': 'install',
+                          'package_name': f"lib{index}"})
+        else:
+            tasks.append({'name': f"service {index}", 'type': 'service', 'action': 'restart',
+                          'service_name': f"app{index % 6}"})
+    return tasks
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-host task graph scheduler")
+    parser.add_argument('--tasks', type=int, default=60, help='Tasks on the host')
+    parser.add_argument('--latency', type=float, default=0.05, help='Simulated seconds per step')
+    parser.add_argument('--concurrency', type=int, default=4, help='Steps run at once')
+    args = parser.parse_args()
+
+    steps = [[task] for task in generate_tasks(args.tasks)]
+    start = time.perf_counter()
+    dependencies = build_task_graph(steps)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    run_task_graph(dependencies, lambda index: time.sleep(args.latency), args.concurrency)
+    elapsed = time.perf_counter() - start
+
+    durations = [args.latency] * len(steps)
+    print(f"steps={len(steps)} edges={sum(len(deps) for deps in dependencies)} build={build_time * 1000:.2f}ms")
+    print(f"sequential={sum(durations):.2f}s critical_path={critical_path_length(dependencies, durations):.2f}s "
+          f"graph(concurrency={args.concurrency})={elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench_templates.py
+#
+# Renders a generated config template for every host of a generated
+# inventory of racks, where the template uses the rack's variables. It
+# compares parsing and substituting a string.Template per host with
+# rendering the cached compiled template, and measures a TemplateRenderer
+# rendering the whole fleet: wall time and the memory held by the output,
+# which hosts of the same rack share.
+# Usage: python3 -m benchmarks.bench_templates --hosts 2000 --racks 20 --lines 200
+
+import argparse
+import os
+import string
+import tempfile
+import time
+import tracemalloc
+from deploymate.inventory import Inventory
+from deploymate.plan import PlanTask
+from deploymate.templates import TemplateRenderer, get_template_cache, template_variables
+
+def build_inventory_data(host_count, rack_count):
+    per_rack = host_count // rack_count
+    racks = {f'rack{rack}': {'vars': {'rack': rack, 'upstream': f"10.{rack}.0.1", 'http_port': 8000 + rack},
+                             'hosts': {f'r{rack:02d}n[00001:{per_rack:05d}]': {}}}
+             for rack in range(rack_count)}
+    return {'all': {'vars': {'user': 'deploy'}, 'children': racks}}
+
+def build_template(lines):
+    """Return an nginx-like config of ``lines`` lines using the rack's variables."""
+    body = [f"    location /app{index} {{ proxy_pass http://${{upstream}}:$http_port/app{index}; }}"
+            for index in range(lines)]
+    return "# rack $rack\nserver {\n    listen $http_port;\n" + "\n".join(body) + "\n}\n"
+
+def render_fleet(inventory, task):
+    """Render ``task`` for every host through a TemplateRenderer and return the output, in host order."""
+    renderer = TemplateRenderer(inventory)
+    renderer.submit({host_name: [task] for host_name in inventory.host_names})
+    rendered = [renderer.content(task, host_name) for host_name in inventory.host_names]
+    renderer.close()
+    return rendered
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rendering a template for every host of a fleet")
+    parser.add_argument('--hosts', type=int, default=2000, help='Hosts in the generated inventory')
+    parser.add_argument('--racks', type=int, default=20, help='Groups with their own variables')
+    parser.add_argument('--lines', type=int, default=200, help='Lines in the template')
+    args = parser.parse_args()
+
+    inventory = Inventory.from_dict(build_inventory_data(args.hosts, args.racks))
+    host_names = inventory.host_names
+    with tempfile.NamedTemporaryFile('w', suffix='.tmpl', delete=False) as file:
+        file.write(build_template(args.lines))
+        template_path = file.name
+    try:
+        variables = {host_name: template_variables(inventory, host_name) for host_name in host_names}
+
+        start = time.perf_counter()
+        for host_name in host_names:
+            with open(template_path, 'r') as file:
+                string.Template(file.read()).substitute(variables[host_name])
+        per_host = time.perf_counter() - start
+
+        start = time.perf_counter()
+        template = get_template_cache().get(template_path)
+        for host_name in host_names:
+            template.render(variables[host_name])
+        compiled = time.perf_counter() - start
+
+        task = PlanTask({'name': 'Render', 'type': 'file', 'action': 'template', 'local_paths': (template_path,)})
+        start = time.perf_counter()
+        rendered = render_fleet(inventory, task)
+        pooled = time.perf_counter() - start
+
+        # Measured apart, as tracing allocations slows rendering down
+        del rendered
+        tracemalloc.start()
+        rendered = render_fleet(inventory, task)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        os.remove(template_path)
+
+    distinct = {id(text): len(text.encode('utf-8')) for text in rendered}
+    total = sum(len(text.encode('utf-8')) for text in rendered)
+    print(f"hosts={len(host_names)} racks={args.racks} template={len(build_template(args.lines))} bytes")
+    print(f"string.Template per host  {per_host * 1000:7.1f}ms  ({per_host / len(host_names) * 1e6:.0f}us per host)")
+    print(f"compiled template         {compiled * 1000:7.1f}ms  ({compiled / len(host_names) * 1e6:.0f}us per host)")
+    print(f"renderer, whole fleet     {pooled * 1000:7.1f}ms  peak memory {peak / 1024 / 1024:.1f}MiB")
+    print(f"output: {len(distinct)} distinct buffers of {sum(distinct.values()) / 1024:.0f}KiB "
+          f"shared by {len(rendered)} hosts ({total / 1024 / 1024:.1f}MiB if each host held its own)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+# fake_ssh_server.py
+#
+# Local paramiko SSH servers standing in for a fleet of hosts in benchmarks.
+# Commands are not executed: each one is answered after a simulated delay
+# with the output deploymate's handlers expect (staging directories, moved
+# file markers, compiled script markers), uploads are consumed by an
+# ``scp -t`` sink and tar and content streams are drained, all at a
+# simulated bandwidth.
+# Every host of a benchmark inventory points at the same port; the servers
+# run in separate processes so they do not share the interpreter with the
+# deploymate run being measured.
+
+import io
+import logging
+import multiprocessing
+import re
+import resource
+import socket
+import threading
+import time
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+# Round trips a real SSH handshake takes (TCP, version exchange, key exchange, authentication)
+HANDSHAKE_ROUND_TRIPS = 5
+# Round trips a real command takes: opening its channel, then starting it; the reply comes with the second
+COMMAND_ROUND_TRIPS = 2
+
+_STAGING_DIR_COMMAND = 'mktemp -d'
+_MOVE_MARKER = re.compile(r"echo '(@@deploymate-move ok \d+)'")
+_CONTENT_MARKER = re.compile(r"echo '(@@deploymate-content ok \d+)'")
+_SCRIPT_START = re.compile(r"echo '(@@deploymate-task-[0-9a-f]+) start (\d+)'")
+
+class ServerSettings:
+    """How the simulated hosts behave.
+
+    Args:
+        latency (float): Round-trip time between the controller and a host, in seconds.
+        bandwidth (float): Bytes per second a host receives, or None for no limit.
+        command_time (float): Seconds each command runs on the host.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, command_time=0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.command_time = command_time
+
+class ServerStats:
+    """Counters of one server process, updated from its connection threads."""
+
+    FIELDS = ('connections', 'commands', 'files', 'bytes_received', 'bytes_sent')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, field, amount=1):
+        with self._lock:
+            self.counts[field] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+class _Link:
+    """The simulated network link of one host; its channels share the bandwidth."""
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self._busy_until = 0.0
+
+    def transmit(self, size):
+        """Block until ``size`` bytes would have arrived over the link."""
+        if not self.bandwidth:
+            return
+        with self._lock:
+            start = max(time.monotonic(), self._busy_until)
+            self._busy_until = start + size / self.bandwidth
+            done = self._busy_until
+        delay = done - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+class _ChannelReader:
+    """Buffered reads from a channel, counted and throttled by the host's link."""
+
+    def __init__(self, channel, link, stats):
+        self.channel = channel
+        self.link = link
+        self.stats = stats
+        self.buffer = b''
+
+    def _fill(self):
+        data = self.channel.recv(32768)
+        if data:
+            self.link.transmit(len(data))
+            self.stats.add('bytes_received', len(data))
+            self.buffer += data
+        return bool(data)
+
+    def readline(self):
+        while b'\n' not in self.buffer:
+            if not self._fill():
+                line, self.buffer = self.buffer, b''
+                return line
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line
+
+    def skip(self, size):
+        """Consume ``size`` bytes, or everything up to EOF if fewer arrive."""
+        while len(self.buffer) < size:
+            size -= len(self.buffer)
+            self.buffer = b''
+            if not self._fill():
+                return
+        self.buffer = self.buffer[size:]
+
+    def drain(self):
+        self.buffer = b''
+        while self._fill():
+            self.buffer = b''
+
+def simulate_command(command):
+    """Return the (stdout, exit_code, runs) a host would answer ``command`` with.
+
+    ``runs`` is the number of commands the host executes, which is more than
+    one for compiled scripts.
+    """
+    if _STAGING_DIR_COMMAND in command:
+        return f"/home/bench/.deploymate-upload-{threading.get_ident():x}{time.monotonic_ns():x}\n", 0, 1
+    moved = _MOVE_MARKER.findall(command) or _CONTENT_MARKER.findall(command)
+    if moved:
+        return "".join(f"{line}\n" for line in moved), 0, 1
+    tasks = _SCRIPT_START.findall(command)
+    if tasks:
+        return "".join(f"{marker} start {index}\n\n{marker} end {index} 0 0\n" for marker, index in tasks), 0, len(tasks)
+    return "", 0, 1
+
+class _FakeTransport(paramiko.Transport):
+    """A server transport that tells command threads when their exec request has been acknowledged.
+
+    paramiko replies to an exec request only after check_channel_exec_request
+    returns; a command thread closing its channel before that reply makes
+    the client's exec_command fail with 'Channel closed'.
+    """
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.acknowledged = {}
+
+    def _send_user_message(self, data):
+        super()._send_user_message(data)
+        message = data.asbytes()
+        if message[:1] == paramiko.common.cMSG_CHANNEL_SUCCESS:
+            event = self.acknowledged.pop(int.from_bytes(message[1:5], 'big'), None)
+            if event:
+                event.set()
+
+class _FakeHost(paramiko.ServerInterface):
+    """One connection from the controller; accepts any user and answers exec requests."""
+
+    def __init__(self, settings, stats):
+        self.settings = settings
+        self.stats = stats
+        self.link = _Link(settings.bandwidth)
+
+    def get_allowed_auths(self, username):
+        return 'password,publickey'
+
+    def _authenticate(self):
+        time.sleep(self.settings.latency * HANDSHAKE_ROUND_TRIPS)
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return self._authenticate()
+
+    def check_auth_publickey(self, username, key):
+        return self._authenticate()
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        self.stats.add('commands')
+        acknowledged = threading.Event()
+        channel.transport.acknowledged[channel.remote_chanid] = acknowledged
+        threading.Thread(target=self._run, args=(channel, command.decode('utf-8', errors='replace'), acknowledged),
+                         daemon=True).start()
+        return True
+
+    def _send(self, channel, data):
+        self.stats.add('bytes_sent', len(data))
+        channel.sendall(data)
+
+    def _run(self, channel, command, acknowledged):
+        try:
+            if command.startswith('scp ') and ' -t ' in command:
+                exit_code = self._scp_sink(channel)
+            else:
+                time.sleep(self.settings.latency * COMMAND_ROUND_TRIPS)
+                stdout, exit_code, runs = simulate_command(command)
+                if 'tar -x' in command or 'sudo tee --' in command:
+                    _ChannelReader(channel, self.link, self.stats).drain()
+                time.sleep(self.settings.command_time * runs)
+                if stdout:
+                    self._send(channel, stdout.encode('utf-8'))
+            acknowledged.wait()
+            channel.send_exit_status(exit_code)
+        except (OSError, EOFError, paramiko.SSHException) as e:
+            logger.debug("Channel closed while running '%s': %s", command[:40], e)
+        finally:
+            channel.close()
+
+    def _scp_sink(self, channel):
+        """Receive files like ``scp -t``, acknowledging each protocol message after one round trip."""
+        reader = _ChannelReader(channel, self.link, self.stats)
+        time.sleep(self.settings.latency * COMMAND_ROUND_TRIPS)
+        self._send(channel, b'\0')
+        while True:
+            line = reader.readline()
+            if not line:
+                return 0
+            kind = line[:1]
+            if kind == b'C':
+                size = int(line.split(b' ', 2)[1])
+                self._send(channel, b'\0')
+                reader.skip(size + 1)
+                self.stats.add('files')
+            elif kind not in (b'D', b'E', b'T'):
+                return 1
+            time.sleep(self.settings.latency)
+            self._send(channel, b'\0')
+
+def _serve(listener, host_key_text, settings, control):
+    """Accept connections until told to stop; runs in a server process."""
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    _raise_file_limit()
+    host_key = paramiko.RSAKey.from_private_key(io.StringIO(host_key_text))
+    stats = ServerStats()
+
+    def accept_loop():
+        while True:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                return
+            stats.add('connections')
+            try:
+                transport = _FakeTransport(client)
+                transport.add_server_key(host_key)
+                transport.start_server(server=_FakeHost(settings, stats))
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                logger.debug("Handshake failed: %s", e)
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    while True:
+        request = control.recv()
+        if request == 'stats':
+            control.send(stats.snapshot())
+        else:
+            return
+
+def _raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class FakeFleet:
+    """Server processes answering SSH connections for any number of simulated hosts on one local port.
+
+    Use as a context manager; ``port`` is set once it has started.
+
+    Args:
+        settings (ServerSettings): How the simulated hosts behave.
+        processes (int): Server processes sharing the listening socket.
+    """
+
+    def __init__(self, settings=None, processes=1):
+        self.settings = settings or ServerSettings()
+        self.process_count = processes
+        self.port = None
+        self._listener = None
+        self._workers = []
+
+    def start(self):
+        _raise_file_limit()
+        host_key = paramiko.RSAKey.generate(2048)
+        host_key_text = io.StringIO()
+        host_key.write_private_key(host_key_text)
+
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(4096)
+        self.port = self._listener.getsockname()[1]
+
+        context = multiprocessing.get_context('fork')
+        for _ in range(self.process_count):
+            control, worker_control = context.Pipe()
+            process = context.Process(target=_serve, args=(self._listener, host_key_text.getvalue(), self.settings,
+                                                           worker_control), daemon=True)
+            process.start()
+            self._workers.append((process, control))
+        # The server processes hold their own copies of the socket
+        self._listener.close()
+        return self
+
+    def stats(self):
+        """Return the counters summed over all server processes."""
+        totals = dict.fromkeys(ServerStats.FIELDS, 0)
+        for process, control in self._workers:
+            control.send('stats')
+            for field, count in control.recv().items():
+                totals[field] += count
+        return totals
+
+    def stop(self):
+        for process, control in self._workers:
+            try:
+                control.send('stop')
+            except OSError:
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+# Example usage:
+# with FakeFleet(ServerSettings(latency=0.02, bandwidth=10 * 1024 * 1024), processes=2) as fleet:
+#     inventory = {'all': {'hosts': {'web[001:100]': {'host': '127.0.0.1', 'port': fleet.port,
+#                                                      'user': 'bench', 'password': 'bench'}}}}
+#     report = execute_playbook(playbook, inventory, forks=100)
+#     print(fleet.stats())
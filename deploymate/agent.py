@@ -0,0 +1,307 @@
+# agent.py
+#
+# Background process that keeps authenticated SSH sessions open between
+# deploymate runs. Runs connect to it over a Unix socket (see
+# deploymate/utils/agent_client.py for the protocol) and get their commands
+# executed on an existing session, skipping the key exchange and
+# authentication. Sessions nobody has used for ``idle_timeout`` seconds are
+# closed.
+#
+# Usage: python3 -m deploymate.agent serve|status|stop [--socket PATH] [--idle-timeout SECONDS]
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import paramiko
+from deploymate.utils.ssh_module import SSHConnection, SSHConnectionError, PrivateKeyCache, STREAM_CHUNK_SIZE
+from deploymate.utils.agent_client import (DEFAULT_AGENT_SOCKET, FRAME_CONNECT, FRAME_DATA, FRAME_EOF, FRAME_ERROR,
+                                           FRAME_EXEC, FRAME_EXIT, FRAME_OK, FRAME_SHUTDOWN, FRAME_STATUS,
+                                           FRAME_STDERR, FRAME_STDOUT, AgentError, AgentUnavailableError,
+                                           agent_request, read_frame, send_frame)
+
+logger = logging.getLogger(__name__)
+
+# Seconds an unused SSH session is kept open
+DEFAULT_IDLE_TIMEOUT = 300
+# Seconds between SSH keepalives on pooled sessions, so idle NAT entries are not dropped
+KEEPALIVE_INTERVAL = 30
+# Seconds to wait for a freshly started agent to accept connections
+AGENT_START_TIMEOUT = 5
+
+# Connection parameters a run may pass to the agent
+CONNECTION_PARAMS = ('host', 'port', 'user', 'password', 'key_file', 'connect_timeout', 'auth_timeout')
+
+class TransportPool:
+    """Authenticated SSH connections shared by the runs served by the agent.
+
+    Connections are keyed by host, port, user and credentials, so a run
+    only reuses a session opened with the same credentials it presented.
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.key_cache = PrivateKeyCache()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pool_key(params):
+        credentials = hashlib.sha256(f"{params.get('password')}\0{params.get('key_file')}".encode('utf-8')).hexdigest()
+        return f"{params.get('user')}@{params.get('host')}:{params.get('port', 22)}/{credentials[:16]}"
+
+    def acquire(self, params):
+        """Return (transport, reused, key) for a host, connecting if there is no live session.
+
+        Raises:
+            SSHConnectionError: If the host cannot be connected to.
+        """
+        key = self.pool_key(params)
+        with self._lock:
+            entry = self._entries.setdefault(key, {'lock': threading.Lock(), 'connection': None, 'users': 0,
+                                                   'last_used': time.monotonic()})
+        with entry['lock']:
+            connection = entry['connection']
+            transport = connection.get_transport() if connection else None
+            reused = bool(transport and transport.is_active())
+            if not reused:
+                connection_params = {name: params[name] for name in CONNECTION_PARAMS if params.get(name) is not None}
+                if connection_params.get('key_file'):
+                    connection_params['pkey'] = self.key_cache.get(connection_params['key_file'])
+                connection = SSHConnection(**connection_params)
+                connection.connect()
+                transport = connection.get_transport()
+                transport.set_keepalive(KEEPALIVE_INTERVAL)
+                entry['connection'] = connection
+                logger.info("Opened SSH session %s", key)
+            entry['users'] += 1
+            entry['last_used'] = time.monotonic()
+        return transport, reused, key
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry['users'] -= 1
+                entry['last_used'] = time.monotonic()
+
+    def expire_idle(self):
+        """Close sessions that have been unused for longer than the idle timeout."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items()
+                       if entry['users'] <= 0 and now - entry['last_used'] > self.idle_timeout]
+            entries = [self._entries.pop(key) for key in expired]
+        for key, entry in zip(expired, entries):
+            if entry['connection']:
+                entry['connection'].disconnect()
+            logger.info("Closed idle SSH session %s", key)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if entry['connection']:
+                entry['connection'].disconnect()
+
+    def status(self):
+        """Return one dictionary per pooled session."""
+        now = time.monotonic()
+        with self._lock:
+            return [{'key': key, 'users': entry['users'], 'idle': round(now - entry['last_used'], 1),
+                     'active': bool(entry['connection'] and entry['connection'].get_transport()
+                                    and entry['connection'].get_transport().is_active())}
+                    for key, entry in self._entries.items()]
+
+class ConnectionAgent:
+    """Serves pooled SSH sessions to deploymate runs over a Unix socket."""
+
+    def __init__(self, socket_path=DEFAULT_AGENT_SOCKET, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.socket_path = socket_path
+        self.pool = TransportPool(idle_timeout)
+        self._server = None
+        self._stopping = threading.Event()
+
+    def serve_forever(self):
+        """Accept runs until a shutdown request arrives."""
+        socket_dir = os.path.dirname(self.socket_path)
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the owner may use the agent's sessions
+        old_umask = os.umask(0o177)
+        try:
+            self._server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self._server.listen(128)
+        logger.info("Connection agent listening on %s", self.socket_path)
+
+        threading.Thread(target=self._expire_loop, daemon=True).start()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    client, _ = self._server.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self.handle_client, args=(client,), daemon=True).start()
+        finally:
+            self._server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.pool.close_all()
+            logger.info("Connection agent stopped")
+
+    def stop(self):
+        self._stopping.set()
+        if self._server:
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+
+    def _expire_loop(self):
+        interval = max(1, min(30, self.pool.idle_timeout / 2))
+        while not self._stopping.wait(interval):
+            self.pool.expire_idle()
+
+    def handle_client(self, client):
+        """Serve one socket connection: a control request, or a host connect optionally followed by one command."""
+        try:
+            frame_type, payload = read_frame(client)
+            if frame_type == FRAME_STATUS:
+                send_frame(client, FRAME_OK, json.dumps(self.pool.status()).encode('utf-8'))
+                return
+            if frame_type == FRAME_SHUTDOWN:
+                send_frame(client, FRAME_OK)
+                self.stop()
+                return
+            if frame_type != FRAME_CONNECT:
+                return
+
+            params = json.loads(payload)
+            try:
+                transport, reused, key = self.pool.acquire(params)
+            except SSHConnectionError as e:
+                send_frame(client, FRAME_ERROR, str(e).encode('utf-8'))
+                return
+
+            try:
+                send_frame(client, FRAME_OK, json.dumps({'reused': reused}).encode('utf-8'))
+                frame_type, payload = read_frame(client)
+                if frame_type != FRAME_EXEC:
+                    return
+                try:
+                    channel = transport.open_session()
+                    channel.exec_command(payload)
+                except (paramiko.SSHException, OSError) as e:
+                    send_frame(client, FRAME_ERROR, f"Failed to execute command: {e}".encode('utf-8'))
+                    return
+                send_frame(client, FRAME_OK)
+                self._relay(channel, client)
+            finally:
+                self.pool.release(key)
+        except (OSError, AgentError, ValueError) as e:
+            logger.debug("Client connection ended: %s", e)
+        finally:
+            client.close()
+
+    def _relay(self, channel, client):
+        """Copy stdin frames to the channel and channel output to the client until the command exits."""
+        def forward_input():
+            try:
+                while True:
+                    frame_type, payload = read_frame(client)
+                    if frame_type == FRAME_DATA:
+                        channel.sendall(payload)
+                    elif frame_type == FRAME_EOF:
+                        channel.shutdown_write()
+                    else:
+                        break
+            except (OSError, AgentError):
+                pass
+            # The run has gone away; closing the channel ends the relay below
+            channel.close()
+
+        threading.Thread(target=forward_input, daemon=True).start()
+        try:
+            while True:
+                while channel.recv_ready():
+                    send_frame(client, FRAME_STDOUT, channel.recv(STREAM_CHUNK_SIZE))
+                while channel.recv_stderr_ready():
+                    send_frame(client, FRAME_STDERR, channel.recv_stderr(STREAM_CHUNK_SIZE))
+                if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+                select.select([channel], [], [], 1.0)
+            send_frame(client, FRAME_EXIT, struct.pack('>i', channel.recv_exit_status()))
+        finally:
+            channel.close()
+
+def ensure_agent_running(socket_path=DEFAULT_AGENT_SOCKET, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """Start a background agent on ``socket_path`` unless one is already listening.
+
+    The agent's log goes to ``agent.log`` next to the socket.
+
+    Raises:
+        AgentUnavailableError: If the agent does not come up within AGENT_START_TIMEOUT seconds.
+    """
+    try:
+        agent_request(socket_path, FRAME_STATUS)
+        return
+    except AgentUnavailableError:
+        pass
+
+    socket_dir = os.path.dirname(socket_path)
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    with open(os.path.join(socket_dir, 'agent.log'), 'a') as log_file:
+        subprocess.Popen([sys.executable, '-m', 'deploymate.agent', 'serve', '--socket', socket_path,
+                          '--idle-timeout', str(idle_timeout)],
+                         stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file, start_new_session=True)
+
+    deadline = time.monotonic() + AGENT_START_TIMEOUT
+    while True:
+        try:
+            agent_request(socket_path, FRAME_STATUS)
+            logger.info("Started connection agent on %s", socket_path)
+            return
+        except AgentUnavailableError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser(description="DeployMate connection agent")
+    parser.add_argument('command', choices=['serve', 'status', 'stop'])
+    parser.add_argument('--socket', default=DEFAULT_AGENT_SOCKET, help=f'Unix socket path (default: {DEFAULT_AGENT_SOCKET})')
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f'Seconds an unused SSH session stays open (default: {DEFAULT_IDLE_TIMEOUT})')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'serve':
+        ConnectionAgent(args.socket, args.idle_timeout).serve_forever()
+        return
+
+    try:
+        reply = agent_request(args.socket, FRAME_STATUS if args.command == 'status' else FRAME_SHUTDOWN)
+    except AgentError as e:
+        logger.error("%s", e)
+        sys.exit(1)
+    if args.command == 'status':
+        for session in reply:
+            print(f"{session['key']} users={session['users']} idle={session['idle']}s active={session['active']}")
+
+if __name__ == "__main__":
+    main()
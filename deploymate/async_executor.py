@@ -0,0 +1,303 @@
+# async_executor.py
+
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from deploymate import tracing
+from deploymate.log_pipeline import log_context
+from deploymate.playbook_executor import (build_connection_params, tasks_by_host, execute_task_on_single_host,
+                                         group_tasks_into_steps, run_step_on_host, gather_facts_for_host,
+                                         resolve_target_hosts, notified_handlers)
+from deploymate.resource_handler_factory import TaskResourceHandlerFactory, handler_registry
+from deploymate.script_compiler import is_compilable_task
+from deploymate.handlers.compiled_task import CompiledTask
+from deploymate.plan import compile_plan
+from deploymate.templates import TemplateRenderer, is_template_task
+from deploymate.facts import FactCache, host_cache_key, DEFAULT_FACT_CACHE_DIR, DEFAULT_FACT_CACHE_TTL
+from deploymate.run_report import (RunReport, TaskResult, STATUS_OK, STATUS_CHANGED, STATUS_SKIPPED, STATUS_FAILED,
+                                   STATUS_UNREACHABLE)
+from deploymate.utils.async_ssh import ThreadedAsyncSSHConnection
+from deploymate.utils.ssh_module import (SSHConnection, SSHConnectionError, PrivateKeyCache, DEFAULT_CONNECT_TIMEOUT,
+                                         DEFAULT_AUTH_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+# Number of hosts whose coroutines may be active at the same time
+DEFAULT_MAX_CONCURRENT_HOSTS = 1000
+# Threads available to run (blocking) handler code; None gives one per host that may be in flight
+DEFAULT_HANDLER_WORKERS = None
+# Threads available to run blocking paramiko calls for ThreadedAsyncSSHConnection; None as above
+DEFAULT_IO_WORKERS = None
+
+class SyncConnectionBridge:
+    """Presents an AsyncSSHConnection to the synchronous handlers.
+
+    Handlers run on a worker thread and call ``run_command`` and friends
+    as usual; each call is scheduled on the event loop and the worker waits
+    for its result. If the connection wraps a blocking one (see
+    AsyncSSHConnection.blocking_connection), the worker calls that directly
+    instead, so a host holds one thread rather than a handler thread waiting
+    on an I/O thread. Any other attribute is looked up on the async
+    connection.
+    """
+
+    def __init__(self, connection, loop):
+        self.connection = connection
+        self.loop = loop
+        self.blocking_connection = connection.blocking_connection
+
+    def _call(self, method, *args, **kwargs):
+        if self.blocking_connection is not None:
+            return getattr(self.blocking_connection, method)(*args, **kwargs)
+        coroutine = getattr(self.connection, method)(*args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def execute_command(self, command):
+        return self._call('execute_command', command)
+
+    def run_command(self, command, line_callback=None, **options):
+        return self._call('run_command', command, line_callback, **options)
+
+    def upload_file(self, local_path, remote_path):
+        return self._call('upload_file', local_path, remote_path)
+
+    def upload_files(self, local_paths, remote_dir):
+        return self._call('upload_files', local_paths, remote_dir)
+
+    def upload_file_delta(self, local_path, remote_path, use_sudo=False):
+        return self._call('upload_file_delta', local_path, remote_path, use_sudo=use_sudo)
+
+    def upload_tree(self, local_dir, remote_dir, delete_missing=False):
+        return self._call('upload_tree', local_dir, remote_dir, delete_missing=delete_missing)
+
+    def write_content(self, content, remote_paths, mode=None, owner=None):
+        return self._call('write_content', content, remote_paths, mode=mode, owner=owner)
+
+    def get_transport(self):
+        return self.connection.get_transport()
+
+    @property
+    def facts(self):
+        return self.connection.facts
+
+    @facts.setter
+    def facts(self, facts):
+        self.connection.facts = facts
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+async def execute_task_async(task, connection, executor=None):
+    """Await a task on a single host through an AsyncSSHConnection.
+
+    The handler from TaskResourceHandlerFactory runs on ``executor`` with a
+    SyncConnectionBridge, so every handler in deploymate/handlers can be
+    awaited without being rewritten.
+    """
+    loop = asyncio.get_running_loop()
+    bridge = SyncConnectionBridge(connection, loop)
+    return await loop.run_in_executor(executor, execute_task_on_single_host, task, bridge)
+
+def is_awaitable_task(task):
+    """Return True if a task runs as one shell command that run_compiled_task_async can await."""
+    if task.get('type') == 'package':
+        return task.get('action') in handler_registry.handler_class('package').COMPILABLE_ACTIONS
+    return is_compilable_task(task)
+
+async def run_step_async(step, host_name, connection, executor=None):
+    """Await a step (see group_tasks_into_steps) on a single host and return its TaskResults.
+
+    A step of one task that runs as a single shell command is run by
+    run_compiled_task_async; any other step runs on ``executor`` through a
+    SyncConnectionBridge.
+    """
+    if len(step) == 1 and is_awaitable_task(step[0]):
+        return [await run_compiled_task_async(step[0], host_name, connection, executor)]
+    loop = asyncio.get_running_loop()
+    bridge = SyncConnectionBridge(connection, loop)
+    return await loop.run_in_executor(executor, run_step_on_host, step, host_name, bridge)
+
+async def run_compiled_task_async(task, host_name, connection, executor=None):
+    """Run a shell-only task with its command awaited on the event loop, and return its TaskResult.
+
+    Only the handler's ``compile_task`` runs on ``executor``; the command is
+    then awaited on the connection and its result passed to ``on_result``,
+    so a host waiting on a long command holds no handler thread.
+    """
+    loop = asyncio.get_running_loop()
+    bridge = SyncConnectionBridge(connection, loop)
+    name = task['name']
+    start = time.perf_counter()
+    with log_context(host_name, name), tracing.span(name, tracing.CATEGORY_TASK, host=host_name, task=name, tasks=1):
+        try:
+            handler = TaskResourceHandlerFactory.create_resource_handler(task['type'])
+            # Run in a copy of this context so the handler logs under the host and task
+            compiled = await loop.run_in_executor(executor, contextvars.copy_context().run, handler.compile_task,
+                                                  task, bridge)
+            if isinstance(compiled, CompiledTask):
+                output = compiled.on_result(await connection.run_command(compiled.command))
+            else:
+                output = compiled
+            status = STATUS_OK if output == STATUS_OK else STATUS_CHANGED
+            result = TaskResult(host_name, name, status, output=output)
+        except Exception as e:
+            result = TaskResult(host_name, name, STATUS_FAILED, error=str(e))
+    result.duration = time.perf_counter() - start
+    if result.status == STATUS_CHANGED and task.get('notify'):
+        result.notify = task['notify']
+    return result
+
+class AsyncPlaybookEngine:
+    """Runs a playbook as one coroutine per host.
+
+    Unlike execute_playbook, hosts do not wait for each other between tasks:
+    each host works through its own task list in playbook order as fast as
+    its connection allows.
+
+    Tasks that run as one shell command are compiled on the handler pool
+    and their command is awaited (see run_compiled_task_async). Any other
+    step runs its synchronous handler on the handler pool for its whole
+    duration, calling the wrapped SSHConnection directly when there is one
+    (see SyncConnectionBridge). ThreadedAsyncSSHConnection holds an I/O
+    thread for each blocking paramiko call. The number of hosts making
+    progress at once is therefore the smallest of ``max_concurrent_hosts``
+    and the pool sizes; by default both pools get one thread per host that
+    may be in flight, so ``max_concurrent_hosts`` alone sets it.
+
+    Args:
+        connection_factory (callable): Called with (host_name, connection_params)
+            and returning an AsyncSSHConnection. Defaults to wrapping an
+            SSHConnection in a ThreadedAsyncSSHConnection.
+        max_concurrent_hosts (int): Upper bound on hosts being worked on at once.
+        handler_workers (int): Size of the thread pool handlers run on, or
+            None for one thread per concurrent host.
+        io_workers (int): Size of the thread pool blocking SSH calls run on,
+            or None for one thread per concurrent host. It is kept apart from
+            the handler pool so handlers waiting on a command can never
+            starve the calls they are waiting for.
+        batch_packages (bool): Merge adjacent package tasks of a host into one
+            apt-get transaction, as execute_playbook does.
+        gather_facts (bool): Gather HostFacts after connecting, as
+            execute_playbook does.
+        compile_scripts (bool): Run adjacent shell-only tasks of a host as one
+            compiled script, as execute_playbook does.
+    """
+
+    def __init__(self, connection_factory=None, max_concurrent_hosts=DEFAULT_MAX_CONCURRENT_HOSTS,
+                 handler_workers=DEFAULT_HANDLER_WORKERS, io_workers=DEFAULT_IO_WORKERS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, auth_timeout=DEFAULT_AUTH_TIMEOUT, batch_packages=True,
+                 gather_facts=False, fact_cache_dir=DEFAULT_FACT_CACHE_DIR, fact_cache_ttl=DEFAULT_FACT_CACHE_TTL,
+                 compile_scripts=False):
+        self.connection_factory = connection_factory or self._default_connection_factory
+        self.max_concurrent_hosts = max_concurrent_hosts
+        self.handler_workers = handler_workers
+        self.io_workers = io_workers
+        self.connect_timeout = connect_timeout
+        self.auth_timeout = auth_timeout
+        self.batch_packages = batch_packages
+        self.compile_scripts = compile_scripts
+        self.fact_cache = FactCache(fact_cache_dir, fact_cache_ttl) if gather_facts else None
+        self.key_cache = PrivateKeyCache()
+        self.executor = None
+        self.io_executor = None
+        self.renderer = None
+
+    def _default_connection_factory(self, host_name, params):
+        params = dict(params)
+        if params.get('key_file') and 'pkey' not in params:
+            params['pkey'] = self.key_cache.get(params['key_file'])
+        connection = SSHConnection(connect_timeout=self.connect_timeout, auth_timeout=self.auth_timeout, **params)
+        return ThreadedAsyncSSHConnection(connection, self.io_executor)
+
+    async def _run_host(self, host_name, params, tasks, handler_hosts, semaphore, report):
+        async with semaphore:
+            try:
+                connection = self.connection_factory(host_name, params)
+                await connection.connect()
+            except SSHConnectionError as e:
+                for task in tasks:
+                    report.add(TaskResult(host_name, task['name'], STATUS_UNREACHABLE, error=str(e)))
+                return
+
+            try:
+                if self.renderer:
+                    connection.templates = self.renderer.for_host(host_name)
+                if self.fact_cache:
+                    loop = asyncio.get_running_loop()
+                    bridge = SyncConnectionBridge(connection, loop)
+                    await loop.run_in_executor(self.executor, gather_facts_for_host, host_name, bridge, tasks,
+                                               self.fact_cache)
+                failed = False
+                for step in group_tasks_into_steps(tasks, self.batch_packages, self.compile_scripts):
+                    for result in await run_step_async(step, host_name, connection, self.executor):
+                        report.add(result)
+                        failed = failed or result.status == STATUS_FAILED
+
+                # Notified handlers run once each after the host's tasks, unless one of them failed
+                host_handlers = notified_handlers(handler_hosts, host_name, report)
+                if failed:
+                    for handler in host_handlers:
+                        report.add(TaskResult(host_name, handler['name'], STATUS_SKIPPED,
+                                              error="Host failed before its handlers ran"))
+                else:
+                    for step in group_tasks_into_steps(host_handlers, self.batch_packages, self.compile_scripts):
+                        for result in await run_step_async(step, host_name, connection, self.executor):
+                            report.add(result)
+            finally:
+                if self.fact_cache and connection.facts:
+                    self.fact_cache.save(host_cache_key(connection), connection.facts)
+                await connection.disconnect()
+
+    async def run(self, playbook, inventory):
+        """Execute the playbook (parsed, or a Plan) against every inventory host.
+
+        Returns:
+            RunReport: The per-host results of every task.
+
+        Raises:
+            PlanError: If the playbook or inventory fails validation.
+        """
+        plan = compile_plan(playbook, inventory)
+        inventory = plan.inventory
+        report = RunReport()
+        connection_params = build_connection_params(inventory)
+
+        host_tasks = tasks_by_host(plan.tasks, inventory)
+        handler_hosts = [(handler, set(resolve_target_hosts(handler, inventory))) for handler in plan.handlers]
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_hosts)
+        # Threads are only started as hosts need them, so a small fleet does not pay for a large bound
+        in_flight = max(1, min(self.max_concurrent_hosts, len(host_tasks)))
+        self.executor = ThreadPoolExecutor(max_workers=self.handler_workers or in_flight)
+        self.io_executor = ThreadPoolExecutor(max_workers=self.io_workers or in_flight)
+        if any(is_template_task(task) for task in (*plan.tasks, *plan.handlers)):
+            self.renderer = TemplateRenderer(inventory)
+            self.renderer.submit(host_tasks)
+        try:
+            await asyncio.gather(*(
+                self._run_host(host_name, connection_params[host_name], tasks, handler_hosts, semaphore, report)
+                for host_name, tasks in host_tasks.items() if tasks and host_name in connection_params
+            ))
+        finally:
+            self.executor.shutdown(wait=False)
+            self.io_executor.shutdown(wait=False)
+            self.executor = None
+            self.io_executor = None
+            if self.renderer:
+                self.renderer.close()
+                self.renderer = None
+        return report
+
+def execute_playbook_async(playbook, inventory, **engine_options):
+    """Run a playbook on a fresh event loop with an AsyncPlaybookEngine."""
+    engine = AsyncPlaybookEngine(**engine_options)
+    report = asyncio.run(engine.run(playbook, inventory))
+    report.log_summary()
+    return report
+
+# Example usage:
+# from deploymate.utils.async_ssh import FakeAsyncSSHConnection
+# report = execute_playbook_async(playbook, inventory,
+#                                 connection_factory=lambda name, params: FakeAsyncSSHConnection(name))
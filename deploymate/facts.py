@@ -0,0 +1,218 @@
+# facts.py
+
+import json
+import logging
+import os
+import re
+import shlex
+import threading
+import time
+from deploymate.utils.apt_state import APT_LISTS_AGE_COMMAND, parse_apt_lists_age
+
+logger = logging.getLogger(__name__)
+
+# Seconds cached facts stay valid before they are gathered again
+DEFAULT_FACT_CACHE_TTL = 600
+DEFAULT_FACT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'deploymate', 'facts')
+
+SECTION_MARKER = '@@deploymate-facts '
+
+class FactGatheringError(Exception):
+    """Custom exception for errors while gathering host facts."""
+    pass
+
+class HostFacts:
+    """Known state of a single host.
+
+    Holds the installed packages, service states, checked paths and the time
+    the apt package lists were last refreshed. Handlers consult the facts to skip work that is already done and update
+    them after every change, so later tasks in the same run see the new state.
+    A path or service that was never checked is reported as unknown (None).
+    """
+
+    def __init__(self, installed_packages=None, service_states=None, paths=None, gathered_at=None,
+                 apt_lists_refreshed_at=None):
+        self.installed_packages = set(installed_packages or ())
+        self.service_states = dict(service_states or {})
+        self.paths = dict(paths or {})
+        self.gathered_at = gathered_at if gathered_at is not None else time.time()
+        self.apt_lists_refreshed_at = apt_lists_refreshed_at
+        self._lock = threading.Lock()
+
+    def is_installed(self, package_name):
+        return package_name in self.installed_packages
+
+    def set_installed(self, package_names, installed=True):
+        with self._lock:
+            if installed:
+                self.installed_packages.update(package_names)
+            else:
+                self.installed_packages.difference_update(package_names)
+
+    def service_state(self, service_name):
+        """Return the ActiveState of a unit (e.g. 'active', 'inactive') or None if unknown."""
+        return self.service_states.get(_unit_name(service_name))
+
+    def set_service_state(self, service_name, state):
+        with self._lock:
+            self.service_states[_unit_name(service_name)] = state
+
+    def path_exists(self, path):
+        """Return True or False for a checked path, or None if it was never checked."""
+        return self.paths.get(_normalize_path(path))
+
+    def set_path_exists(self, path, exists):
+        with self._lock:
+            self.paths[_normalize_path(path)] = exists
+
+    def covers_paths(self, paths):
+        return all(_normalize_path(path) in self.paths for path in paths)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'gathered_at': self.gathered_at,
+                'installed_packages': sorted(self.installed_packages),
+                'service_states': dict(self.service_states),
+                'paths': dict(self.paths),
+                'apt_lists_refreshed_at': self.apt_lists_refreshed_at,
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('installed_packages'), data.get('service_states'), data.get('paths'),
+                   data.get('gathered_at'), data.get('apt_lists_refreshed_at'))
+
+def _unit_name(service_name):
+    return service_name if '.' in service_name else f"{service_name}.service"
+
+def _normalize_path(path):
+    return os.path.normpath(path)
+
+def requested_paths(tasks):
+    """Return the remote paths whose existence the given tasks depend on."""
+    paths = []
+    for task in tasks:
+        if task.get('type') == 'directory' and task.get('directory_path'):
+            paths.append(task['directory_path'])
+    return paths
+
+class FactGatherer:
+    """Collects HostFacts from a host with a single remote command."""
+
+    def build_script(self, paths):
+        """Return the shell script printing every fact section."""
+        lines = [
+            f"echo '{SECTION_MARKER}packages'",
+            "dpkg-query -W -f='${Package}\\t${Status}\\n' 2>/dev/null",
+            f"echo '{SECTION_MARKER}services'",
+            "systemctl list-units --type=service --all --no-legend --plain 2>/dev/null",
+            f"echo '{SECTION_MARKER}apt'",
+            APT_LISTS_AGE_COMMAND,
+            f"echo '{SECTION_MARKER}paths'",
+        ]
+        for path in paths:
+            quoted = shlex.quote(path)
+            lines.append(f"if [ -e {quoted} ]; then echo 1 {quoted}; else echo 0 {quoted}; fi")
+        return "\n".join(lines)
+
+    def parse(self, output, paths):
+        """Parse the output of build_script into a HostFacts object."""
+        sections = {}
+        current = None
+        for line in output.splitlines():
+            if line.startswith(SECTION_MARKER):
+                current = sections.setdefault(line[len(SECTION_MARKER):].strip(), [])
+            elif current is not None and line.strip():
+                current.append(line)
+
+        if 'packages' not in sections:
+            raise FactGatheringError("Fact output is missing the packages section")
+
+        installed = set()
+        for line in sections.get('packages', []):
+            name, _, status = line.partition('\t')
+            if status.strip().endswith(' installed'):
+                installed.add(name.split(':')[0])
+
+        services = {}
+        for line in sections.get('services', []):
+            # UNIT LOAD ACTIVE SUB DESCRIPTION
+            columns = re.split(r'\s+', line.strip(), maxsplit=4)
+            if len(columns) >= 3:
+                services[columns[0]] = columns[2]
+
+        existing = {}
+        for line in sections.get('paths', []):
+            flag, _, path = line.partition(' ')
+            existing[_normalize_path(path)] = flag == '1'
+        for path in paths:
+            existing.setdefault(_normalize_path(path), False)
+
+        apt_lists_age = parse_apt_lists_age("\n".join(sections.get('apt', [])))
+        apt_lists_refreshed_at = time.time() - apt_lists_age if apt_lists_age is not None else None
+
+        return HostFacts(installed, services, existing, apt_lists_refreshed_at=apt_lists_refreshed_at)
+
+    def gather(self, ssh_client, paths=()):
+        """Gather the facts of one host in a single remote round trip."""
+        stdout, stderr, exit_code = ssh_client.run_command(self.build_script(paths), max_output_bytes=None)
+        if exit_code != 0:
+            raise FactGatheringError(f"Fact gathering exited with {exit_code}: {stderr}")
+        return self.parse(stdout, paths)
+
+class FactCache:
+    """On-disk cache of HostFacts with a time-to-live.
+
+    Each host is stored as a JSON file in ``cache_dir``. A ttl of 0 disables
+    reading from the cache, but facts are still written for the next run.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_FACT_CACHE_DIR, ttl=DEFAULT_FACT_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _path(self, host_key):
+        safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', host_key)
+        return os.path.join(self.cache_dir, f"{safe_name}.json")
+
+    def load(self, host_key, paths=()):
+        """Return cached facts that are fresh and cover ``paths``, or None."""
+        if self.ttl <= 0:
+            return None
+        try:
+            with open(self._path(host_key), 'r') as file:
+                facts = HostFacts.from_dict(json.load(file))
+        except (OSError, ValueError):
+            return None
+        if time.time() - facts.gathered_at > self.ttl or not facts.covers_paths(paths):
+            return None
+        return facts
+
+    def save(self, host_key, facts):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(host_key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(facts.to_dict(), file)
+        os.replace(temporary_path, path)
+
+def host_cache_key(ssh_client):
+    return f"{ssh_client.user}@{ssh_client.host}:{ssh_client.port}"
+
+def load_or_gather_facts(ssh_client, paths, cache=None, gatherer=None):
+    """Return facts for a host from the cache if fresh, otherwise gather them."""
+    if cache:
+        facts = cache.load(host_cache_key(ssh_client), paths)
+        if facts:
+            logger.debug("Using cached facts for %s", ssh_client.host)
+            return facts
+    facts = (gatherer or FactGatherer()).gather(ssh_client, paths)
+    if cache:
+        cache.save(host_cache_key(ssh_client), facts)
+    return facts
+
+# Example usage:
+# cache = FactCache(ttl=300)
+# ssh_client.facts = load_or_gather_facts(ssh_client, ['/opt/app'], cache)
+# ssh_client.facts.is_installed('nginx')
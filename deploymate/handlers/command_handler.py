@@ -1,5 +1,11 @@
 import logging
 from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager, SSHConnectionError
+from deploymate.utils.command_output import debug_line_logger
+from deploymate.handlers.compiled_task import CompiledTask
+
+class CommandHandlerError(Exception):
+    """Custom exception for command execution errors."""
+    pass
 
 class CommandHandler:
     """Handler for executing shell commands on a remote server."""
@@ -13,21 +19,41 @@ class CommandHandler:
         Args:
             task (dict): Task details containing the command to execute.
             ssh_client (SSHClient): SSH client connected to the remote server.
+
+        Raises:
+            CommandHandlerError: If the command exits with a non-zero code.
         """
+        compiled = self.compile_task(task, ssh_client)
+        if not isinstance(compiled, CompiledTask):
+            return compiled
+
+        try:
+            result = ssh_client.run_command(compiled.command, line_callback=debug_line_logger(self.logger))
+        except SSHConnectionError as e:
+            self.logger.error("Failed to execute command '%s': %s", compiled.command, e)
+            raise
+        return compiled.on_result(result)
+
+    def compile_task(self, task: dict, ssh_client):
+        """Return the CompiledTask running the task's command, or None if it has no command."""
         shell_command = task.get('command')
         if not shell_command:
             self.logger.error("No command specified in the task.")
             return
 
-        try:
-            self.logger.info(f"Executing command: {shell_command}")
-            stdout, stderr = ssh_client.execute_command(shell_command)
-            if stdout.strip():
-                self.logger.info(f"Command output: {stdout}")
-            if stderr.strip():
-                self.logger.info(f"Command error output: {stderr}")
-        except SSHConnectionError as e:
-            self.logger.error(f"Failed to execute command '{shell_command}': {e}")
+        self.logger.info("Executing command: %s", shell_command)
+
+        def on_result(result):
+            stdout, stderr, exit_code = result
+            if stdout:
+                self.logger.info("Command output: %s", stdout)
+            if stderr:
+                self.logger.info("Command error output: %s", stderr)
+            if exit_code != 0:
+                raise CommandHandlerError(f"Command '{shell_command}' failed with exit code {exit_code}: "
+                                          f"{stderr.strip()}")
+
+        return CompiledTask(shell_command, on_result)
 # Example usage:
 # command_task = {'command': 'echo "Hello, DeployMate!"'}
 # handler = CommandHandler()
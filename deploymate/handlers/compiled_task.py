@@ -0,0 +1,27 @@
+# compiled_task.py
+
+class CompiledTask:
+    """A task reduced to one shell command and the handler logic to apply to its result.
+
+    Handlers return a CompiledTask from ``compile_task`` when the task has
+    work to do. The command can be run on its own or as part of a compiled
+    script (see deploymate.script_compiler); either way ``on_result`` is then
+    called with the command's CommandResult (or a ``(stdout, stderr,
+    exit_code)`` tuple) and returns the task's status.
+
+    Args:
+        command (str): The shell command performing the task.
+        on_result (callable): Called with the command's result; returns the
+            handler output for the task.
+    """
+
+    def __init__(self, command, on_result):
+        self.command = command
+        self.on_result = on_result
+
+    def __repr__(self):
+        return f"CompiledTask({self.command!r})"
+
+# Example usage:
+# compiled = CompiledTask('sudo mkdir -p /opt/app', lambda result: STATUS_CHANGED)
+# status = compiled.on_result(ssh_client.execute_command(compiled.command))
@@ -1,9 +1,15 @@
 import logging
-from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager
+import shlex
+from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager, SSHConnectionError
+from deploymate.run_report import STATUS_OK, STATUS_CHANGED
+from deploymate.handlers.compiled_task import CompiledTask
 
-logging.basicConfig(level=logging.DEBUG)  # Set logging level to DEBUG
 logger = logging.getLogger(__name__)
 
+class DirectoryHandlerError(Exception):
+    """Custom exception for directory handling errors."""
+    pass
+
 class DirectoryHandler:
     """Handler for managing directories on a remote server."""
 
@@ -12,31 +18,57 @@ class DirectoryHandler:
 
     def execute(self, task, ssh_client):
         """Execute directory-related tasks on a remote server."""
-        logger.debug(f"Executing directory task: {task}")
+        compiled = self.compile_task(task, ssh_client)
+        if not isinstance(compiled, CompiledTask):
+            return compiled
+
+        logger.debug("Executing command '%s' on SSH client: %s", compiled.command, ssh_client)
+        try:
+            output = ssh_client.execute_command(compiled.command)
+        except SSHConnectionError as e:
+            logger.error("SSH error during '%s' on '%s': %s", task.get('action'), task.get('directory_path'), e)
+            raise
+        return compiled.on_result(output)
+
+    def compile_task(self, task, ssh_client):
+        """Return the CompiledTask for a directory task, or STATUS_OK if there is nothing to do."""
+        logger.debug("Executing directory task: %s", task)
 
         action = task.get('action')
-        logger.debug(f"Extracted action: {action}")
+        logger.debug("Extracted action: %s", action)
         assert action in ['create', 'delete'], "Invalid action specified"
 
         directory_path = task.get('directory_path')
-        logger.debug(f"Extracted directory path: {directory_path}")
+        logger.debug("Extracted directory path: %s", directory_path)
         assert directory_path, "No directory path specified"
 
+        facts = getattr(ssh_client, 'facts', None)
+        if facts and facts.path_exists(directory_path) is (action == 'create'):
+            logger.info("Directory '%s' is already %s, skipping '%s'.", directory_path,
+                        'present' if action == 'create' else 'absent', action)
+            return STATUS_OK
+
         command = self.construct_command(action, directory_path)
-        logger.debug(f"Constructing command for action '{action}' on '{directory_path}': {command}")
+        logger.debug("Constructing command for action '%s' on '%s': %s", action, directory_path, command)
 
-        logger.debug(f"Executing command '{command}' on SSH client: {ssh_client}")
-        try:
-            output = ssh_client.execute_command(command)
-            logger.info(f"Executed '{command}'. Output: {output}")
-        except SSHConnectionError as e:
-            logger.error(f"SSH error during '{action}' on '{directory_path}': {e}")
+        def on_result(result):
+            stdout, stderr, exit_code = result
+            if exit_code != 0:
+                raise DirectoryHandlerError(f"Failed to {action} directory {directory_path} "
+                                            f"(exit code {exit_code}): {stderr.strip()}")
+            logger.info("Executed '%s'. Output: %s", command, stdout)
+            if facts:
+                facts.set_path_exists(directory_path, action == 'create')
+            return STATUS_CHANGED
+
+        return CompiledTask(command, on_result)
 
     def construct_command(self, action, directory_path):
         """Constructs the command based on the action and directory path."""
-        logger.debug(f"Constructing command for action '{action}' and path '{directory_path}'")
-        # Add input sanitization here if directory_path is from an untrusted source
+        logger.debug("Constructing command for action '%s' and path '%s'", action, directory_path)
+        quoted_path = shlex.quote(directory_path)
         if action == 'create':
-            return f"sudo mkdir -p {directory_path}"
+            return f"sudo mkdir -p -- {quoted_path}"
         elif action == 'delete':
-            return f"rm -r {directory_path}"
+            # -f keeps deleting a directory that is already gone a success
+            return f"rm -rf -- {quoted_path}"
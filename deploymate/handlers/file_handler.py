@@ -1,19 +1,35 @@
 import logging
 import os
+import shlex
 from deploymate.utils.ssh_module import SSHConnection, SSHConnectionError
-from deploymate.handlers.directory_handler import DirectoryHandler
-from deploymate.utils.scp_transfer import SCPTransfer
+from deploymate.utils.digest_cache import get_digest_cache
+from deploymate.utils.scp_transfer import SCPTransferError
+from deploymate.run_report import STATUS_OK, STATUS_CHANGED
+from deploymate.handlers.compiled_task import CompiledTask
+from deploymate.templates import TemplateError
+from deploymate.paths import FILES_TO_UPLOAD_DIR
+
+# Prefix of the per-file status lines printed by the staged move command
+MOVE_MARKER = '@@deploymate-move'
+# Smallest file updated by delta transfer when a task sets 'delta: true'; smaller
+# files are cheaper to send whole than to sign and diff
+DELTA_MIN_SIZE = 1024 * 1024
 
 class FileHandlerError(Exception):
     """Custom exception for file handling errors."""
     pass
 
 class FileHandler:
+    # Actions that run as a single shell command and can be part of a compiled script
+    COMPILABLE_ACTIONS = ('delete',)
+    # Actions that stream the task's content, or its template rendered for the host, into its files
+    CONTENT_ACTIONS = ('create', 'overwrite', 'template')
+    PAST_TENSE = {'create': 'created', 'overwrite': 'overwritten', 'template': 'rendered', 'delete': 'deleted'}
+
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self.directory_handler = DirectoryHandler()
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Project base directory
-        self.files_to_upload_dir = os.path.join(self.base_dir, 'config', 'files_to_upload')
+        self.files_to_upload_dir = FILES_TO_UPLOAD_DIR
 
     def execute(self, task, ssh_client):
         action = task.get('action')
@@ -24,69 +40,277 @@ class FileHandler:
             raise FileHandlerError("No remote path specified in the task.")
 
         try:
-            if action in ['create', 'overwrite']:
-                content = task.get('content', '')
-                for file_name in file_paths:
-                    full_file_path = os.path.join(remote_path, file_name)
-                    if action == 'create':
-                        self.create_file(ssh_client, full_file_path, content)
-                    elif action == 'overwrite':
-                        self.overwrite_file(ssh_client, full_file_path, content)
-            elif action == 'delete':
-                for file_name in file_paths:
-                    full_file_path = os.path.join(remote_path, file_name)
-                    self.delete_file(ssh_client, full_file_path)
+            if action in self.CONTENT_ACTIONS:
+                return self.write_content(ssh_client, task)
+            elif action in self.COMPILABLE_ACTIONS:
+                compiled = self.compile_task(task, ssh_client)
+                return compiled.on_result(ssh_client.execute_command(compiled.command))
             elif action == 'upload':
-                # Ensure the remote directory exists
-                self.directory_handler.execute({'action': 'create', 'directory_path': remote_path}, ssh_client)
-
-                for file_name in file_paths:
-                    local_file_path = os.path.join(self.files_to_upload_dir, file_name)
-                    remote_file_path = os.path.join(remote_path, file_name)
-                    self.upload_and_move_file(ssh_client, local_file_path, remote_file_path)
+                return self.upload_files(ssh_client, file_paths, remote_path, delta=task.get('delta', False),
+                                         local_paths=task.get('local_paths'))
+            elif action == 'upload_tree':
+                local_paths = task.get('local_paths')
+                return self.upload_tree(ssh_client, task.get('local_dir'), remote_path,
+                                        delete_missing=task.get('delete_missing', False),
+                                        local_dir_path=local_paths[0] if local_paths else None)
             else:
                 raise FileHandlerError(f"Invalid or unsupported action '{action}' specified.")
         except Exception as e:
-            self.logger.error(f"Error during file '{action}' on '{remote_path}': {e}")
+            self.logger.error("Error during file '%s' on '%s': %s", action, remote_path, e)
+            raise FileHandlerError(e)
+
+    def compile_task(self, task, ssh_client):
+        """Return one CompiledTask deleting every file of the task.
+
+        Raises:
+            FileHandlerError: If the action is not one of COMPILABLE_ACTIONS.
+        """
+        action = task.get('action')
+        remote_path = task.get('remote_path')
+        if not remote_path:
+            raise FileHandlerError("No remote path specified in the task.")
+        if action not in self.COMPILABLE_ACTIONS:
+            raise FileHandlerError(f"File action '{action}' cannot be compiled into a command.")
+
+        file_paths = [os.path.join(remote_path, file_name) for file_name in task.get('files', [])]
+        commands = [self.delete_command(file_path) for file_path in file_paths]
+
+        def on_result(result):
+            _, stderr, exit_code = result
+            if exit_code != 0:
+                raise FileHandlerError(f"Failed to delete {', '.join(file_paths)} (exit code {exit_code}): "
+                                       f"{stderr.strip()}")
+            for file_path in file_paths:
+                self.logger.info("File %s at %s", self.PAST_TENSE[action], file_path)
+
+        return CompiledTask(" && ".join(commands) or "true", on_result)
+
+    @staticmethod
+    def delete_command(file_path):
+        return f"sudo rm -f -- {shlex.quote(file_path)}"
+
+    def write_content(self, ssh_client, task):
+        """Write the task's content to each of its files, see ContentTransfer.write_content.
+
+        For the template action, the content is the task's template rendered
+        with the host's variables by the run's TemplateRenderer.
+
+        Returns:
+            str: STATUS_OK if every file already held the content with the
+            requested mode and owner, STATUS_CHANGED otherwise.
+        """
+        remote_path = task.get('remote_path')
+        file_paths = [os.path.join(remote_path, file_name) for file_name in task.get('files', [])]
+        if not file_paths:
+            return STATUS_OK
+        written = ssh_client.write_content(self.task_content(task, ssh_client), file_paths,
+                                           mode=task.get('mode'), owner=task.get('owner'))
+        if not written:
+            return STATUS_OK
+        for file_path in written:
+            self.logger.info("File %s at %s", self.PAST_TENSE[task.get('action')], file_path)
+        facts = getattr(ssh_client, 'facts', None)
+        if facts:
+            facts.set_path_exists(remote_path, True)
+        return STATUS_CHANGED
+
+    @staticmethod
+    def task_content(task, ssh_client):
+        if task.get('action') != 'template':
+            content = task.get('content')
+            return '' if content is None else str(content)
+        templates = getattr(ssh_client, 'templates', None)
+        if templates is None:
+            raise FileHandlerError("Template tasks need host variables; run them with execute_playbook.")
+        try:
+            return templates.content(task)
+        except TemplateError as e:
             raise FileHandlerError(e)
 
-    def create_file(self, ssh_client, file_path, content):
-        command = f"echo '{content}' | sudo tee {file_path} > /dev/null"
-        ssh_client.execute_command(command)
-        self.logger.info(f"File created at {file_path}")
+    def create_file(self, ssh_client, file_path, content, mode=None, owner=None):
+        ssh_client.write_content(content, [file_path], mode=mode, owner=owner)
+        self.logger.info("File created at %s", file_path)
 
-    def overwrite_file(self, ssh_client, file_path, content):
-        command = f"echo '{content}' | sudo tee {file_path} > /dev/null"
-        ssh_client.execute_command(command)
-        self.logger.info(f"File overwritten at {file_path}")
+    def overwrite_file(self, ssh_client, file_path, content, mode=None, owner=None):
+        ssh_client.write_content(content, [file_path], mode=mode, owner=owner)
+        self.logger.info("File overwritten at %s", file_path)
 
     def delete_file(self, ssh_client, file_path):
-        command = f"sudo rm -f {file_path}"
-        ssh_client.execute_command(command)
-        self.logger.info(f"File deleted at {file_path}")
-
-    def upload_and_move_file(self, ssh_client, local_path, remote_final_path):
-        """Uploads a file to a temporary path and then moves it to the final path."""
-        if not os.path.isfile(local_path):
-            raise FileHandlerError(f"File does not exist: {local_path}")
-
-        # Temporary upload path in the home directory of the 'ubuntu' user
-        intermediate_path = "/home/ubuntu/" + os.path.basename(local_path)
-
-        # Upload the file to the temporary path
-        scp_transfer = SCPTransfer(ssh_client)
-        scp_transfer.upload_file(local_path, intermediate_path)
-
-        # Move the file to the final path using sudo
-        move_command = f"sudo mv {intermediate_path} {remote_final_path}"
-        stdout, stderr, exit_code = ssh_client.execute_command(move_command)
-        if exit_code != 0:
-            self.logger.error(f"Failed to move file. STDOUT: {stdout}, STDERR: {stderr}")
-            raise FileHandlerError("Failed to move file")
-        else:
-            self.logger.info(f"File moved to {remote_final_path}")
+        ssh_client.execute_command(self.delete_command(file_path))
+        self.logger.info("File deleted at %s", file_path)
+
+    def remote_digests(self, ssh_client, remote_file_paths):
+        """Return the SHA-256 digests of the existing remote files, fetched in one command.
+
+        Files that are missing or unreadable are left out of the result.
+        """
+        if not remote_file_paths:
+            return {}
+        quoted_paths = " ".join(shlex.quote(path) for path in remote_file_paths)
+        stdout, _, _ = ssh_client.execute_command(f"sudo sha256sum -- {quoted_paths} 2>/dev/null")
+
+        digests = {}
+        for line in stdout.splitlines():
+            digest, _, path = line.partition('  ')
+            if path:
+                digests[path] = digest
+        return digests
+
+    def upload_files(self, ssh_client, file_names, remote_path, delta=False, local_paths=None):
+        """Upload files to a remote directory, skipping those whose remote copy is identical.
+
+        With ``delta``, large files that already exist remotely are updated by
+        sending only their changed blocks. All other changed files are copied
+        into a staging directory over a single SCP session and then moved into
+        place by one privileged command.
+
+        Returns:
+            str: STATUS_OK if every remote file was already up to date,
+            STATUS_CHANGED otherwise.
+        """
+        uploads = []
+        for index, file_name in enumerate(file_names):
+            if local_paths:
+                local_file_path = local_paths[index]
+            else:
+                local_file_path = os.path.join(self.files_to_upload_dir, file_name)
+            if not os.path.isfile(local_file_path):
+                raise FileHandlerError(f"File does not exist: {local_file_path}")
+            uploads.append((local_file_path, os.path.join(remote_path, file_name)))
+
+        remote_digests = self.remote_digests(ssh_client, [remote_file_path for _, remote_file_path in uploads])
+        local_digests = get_digest_cache().digests([local_file_path for local_file_path, _ in uploads])
+        pending = []
+        for local_file_path, remote_file_path in uploads:
+            if remote_digests.get(remote_file_path) == local_digests[local_file_path]:
+                self.logger.info("File %s is up to date, skipping upload", remote_file_path)
+            else:
+                pending.append((local_file_path, remote_file_path))
+
+        if not pending:
+            return STATUS_OK
+
+        if delta:
+            pending = self.upload_deltas(ssh_client, pending, remote_digests)
+            if not pending:
+                return STATUS_CHANGED
+
+        staging_dir = self.create_staging_dir(ssh_client)
+        try:
+            staged_paths = ssh_client.upload_files([local_file_path for local_file_path, _ in pending], staging_dir)
+        except Exception:
+            ssh_client.execute_command(f"rm -rf -- {shlex.quote(staging_dir)}")
+            raise
+
+        moves = [(staged_paths[local_file_path], remote_file_path) for local_file_path, remote_file_path in pending]
+        self.move_staged_files(ssh_client, staging_dir, remote_path, moves)
+        return STATUS_CHANGED
+
+    def upload_tree(self, ssh_client, local_dir, remote_path, delete_missing=False, local_dir_path=None):
+        """Upload a directory from ``config/files_to_upload`` as one compressed tar stream.
+
+        ``local_dir_path`` is the directory's local path if a compiled plan
+        already resolved it.
+
+        Returns:
+            str: STATUS_CHANGED.
+        """
+        if not local_dir:
+            raise FileHandlerError("No local_dir specified for upload_tree.")
+        local_dir_path = local_dir_path or os.path.join(self.files_to_upload_dir, local_dir)
+        if not os.path.isdir(local_dir_path):
+            raise FileHandlerError(f"Directory does not exist: {local_dir_path}")
+
+        ssh_client.upload_tree(local_dir_path, remote_path, delete_missing=delete_missing)
+        facts = getattr(ssh_client, 'facts', None)
+        if facts:
+            facts.set_path_exists(remote_path, True)
+        return STATUS_CHANGED
+
+    def upload_deltas(self, ssh_client, pending, remote_digests):
+        """Update large files that exist remotely by delta transfer.
+
+        Returns:
+            list: The (local, remote) pairs that still need a full upload,
+            including those whose delta transfer failed.
+        """
+        remaining = []
+        for local_file_path, remote_file_path in pending:
+            if remote_file_path not in remote_digests or os.path.getsize(local_file_path) < DELTA_MIN_SIZE:
+                remaining.append((local_file_path, remote_file_path))
+                continue
+            try:
+                ssh_client.upload_file_delta(local_file_path, remote_file_path, use_sudo=True)
+            except SCPTransferError as e:
+                self.logger.warning("Delta transfer of %s failed, sending the whole file: %s", remote_file_path, e)
+                remaining.append((local_file_path, remote_file_path))
+        return remaining
+
+    def create_staging_dir(self, ssh_client):
+        """Create a private staging directory in the remote user's home and return its path."""
+        stdout, stderr, exit_code = ssh_client.execute_command('mktemp -d "$HOME/.deploymate-upload-XXXXXX"')
+        if exit_code != 0 or not stdout:
+            raise FileHandlerError(f"Failed to create staging directory: {stderr}")
+        return stdout.strip()
+
+    def move_staged_files(self, ssh_client, staging_dir, remote_path, moves):
+        """Move staged files to their final paths with one privileged command.
+
+        The staging directory is removed afterwards. Each file's outcome is
+        logged on its own.
+
+        Raises:
+            FileHandlerError: If any file could not be moved.
+        """
+        parent_dirs = sorted({remote_path} | {os.path.dirname(remote_file_path) for _, remote_file_path in moves})
+        lines = [f"sudo mkdir -p -- {' '.join(shlex.quote(parent_dir) for parent_dir in parent_dirs)}"]
+        for index, (staged_path, remote_file_path) in enumerate(moves):
+            lines.append(f"if sudo mv -f -- {shlex.quote(staged_path)} {shlex.quote(remote_file_path)}; "
+                         f"then echo '{MOVE_MARKER} ok {index}'; else echo '{MOVE_MARKER} failed {index}'; fi")
+        lines.append(f"rm -rf -- {shlex.quote(staging_dir)}")
+        stdout, stderr, _ = ssh_client.execute_command("\n".join(lines))
+
+        moved = set()
+        for line in stdout.splitlines():
+            if line.startswith(f"{MOVE_MARKER} ok "):
+                moved.add(int(line.rsplit(' ', 1)[1]))
+
+        failed = []
+        for index, (_, remote_file_path) in enumerate(moves):
+            if index in moved:
+                self.logger.info("File moved to %s", remote_file_path)
+            else:
+                self.logger.error("Failed to move file to %s. STDERR: %s", remote_file_path, stderr)
+                failed.append(remote_file_path)
+
+        facts = getattr(ssh_client, 'facts', None)
+        if facts and len(failed) < len(moves):
+            facts.set_path_exists(remote_path, True)
+
+        if failed:
+            raise FileHandlerError(f"Failed to move {len(failed)} of {len(moves)} files: {', '.join(failed)}")
 
 # Example usage (commented out)
+# tree_task = {
+#     'action': 'upload_tree',
+#     'local_dir': 'webroot',
+#     'remote_path': '/var/www/html',
+#     'delete_missing': True
+# }
+# config_task = {
+#     'action': 'create',
+#     'remote_path': '/etc/app',
+#     'files': ['app.conf'],
+#     'content': 'port = 8080\n',
+#     'mode': '0640',
+#     'owner': 'root:app'
+# }
+# template_task = {
+#     'action': 'template',
+#     'template': 'nginx.conf.tmpl',
+#     'remote_path': '/etc/nginx',
+#     'files': ['nginx.conf']
+# }
 # file_task = {
 #     'action': 'upload',
 #     'files': ['file1.txt', 'file2.txt'],
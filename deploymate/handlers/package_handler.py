@@ -1,5 +1,8 @@
 import logging
 from deploymate.utils.ssh_module import SSHConnection, SSHConnectionError
+from deploymate.utils.command_output import debug_line_logger
+from deploymate.run_report import STATUS_OK, STATUS_CHANGED
+from deploymate.handlers.compiled_task import CompiledTask
 
 class PackageHandlerError(Exception):
     """Custom exception for package handling errors."""
@@ -8,79 +11,201 @@ class PackageHandlerError(Exception):
 class PackageHandler:
     """Handler for managing software packages on a remote server."""
 
+    # Actions whose adjacent tasks can be merged into one apt-get transaction
+    BATCHABLE_ACTIONS = ('install', 'update', 'remove')
+    # Actions that run as a single shell command, see compile_task
+    COMPILABLE_ACTIONS = ('install', 'update')
+
     def __init__(self):
         self.logger = logging.getLogger(__name__)
 
+    @staticmethod
+    def package_names(task):
+        """Return the task's ``package_name`` as a list; it may be a string or a list."""
+        package_name = task.get('package_name')
+        if not package_name:
+            raise PackageHandlerError("No package name specified in the task.")
+        if isinstance(package_name, str):
+            return [package_name]
+        return list(package_name)
+
+    @staticmethod
+    def pending_packages(action, package_names, facts):
+        """Return the packages an action still has to touch according to the host facts."""
+        if not facts:
+            return list(package_names)
+        if action == 'install':
+            return [name for name in package_names if not facts.is_installed(name)]
+        if action == 'remove':
+            return [name for name in package_names if facts.is_installed(name)]
+        return list(package_names)
+
     def execute(self, task, ssh_client):
         """Execute package-related tasks on a remote server.
 
         Args:
             task (dict): Task details containing the action and package details.
+                ``package_name`` may be a single name or a list of names.
             ssh_client (SSHClient): SSH client connected to the remote server.
 
+        Returns:
+            str: STATUS_OK if gathered facts show nothing needs doing,
+            STATUS_CHANGED otherwise.
+
         Raises:
             PackageHandlerError: If there is an error in handling the package.
         """
         action = task.get('action')
-        package_name = task.get('package_name')
+        facts = getattr(ssh_client, 'facts', None)
+        packages = self.pending_packages(action, self.package_names(task), facts)
+        if not packages:
+            self.logger.info("Packages already in the desired state, skipping '%s'.", action)
+            return STATUS_OK
 
-        if not package_name:
-            raise PackageHandlerError("No package name specified in the task.")
+        self.run_action(ssh_client, action, packages)
+        return STATUS_CHANGED
+
+    def compile_task(self, task, ssh_client):
+        """Return the CompiledTask running the task's apt-get command, or STATUS_OK if facts show nothing to do.
+
+        Raises:
+            PackageHandlerError: If the action is not one of COMPILABLE_ACTIONS.
+        """
+        action = task.get('action')
+        if action not in self.COMPILABLE_ACTIONS:
+            raise PackageHandlerError(f"Package action '{action}' cannot be compiled into a command.")
+        packages = self.pending_packages(action, self.package_names(task), getattr(ssh_client, 'facts', None))
+        if not packages:
+            self.logger.info("Packages already in the desired state, skipping '%s'.", action)
+            return STATUS_OK
+        return self.compile_action(ssh_client, action, packages)
+
+    def compile_action(self, ssh_client, action, package_names):
+        """Return the CompiledTask installing or updating ``package_names`` in one apt-get call.
 
+        Updating refreshes the package lists first unless the host's apt
+        state shows they were refreshed within its freshness window.
+        """
+        facts = getattr(ssh_client, 'facts', None)
+        apt_state = getattr(ssh_client, 'apt_state', None)
+        packages = " ".join(package_names)
+        if action == 'install':
+            command = f"sudo apt-get install -y {packages}"
+            refresh_lists = False
+        else:
+            refresh_lists = not apt_state or apt_state.needs_update(ssh_client)
+            command = f"sudo apt-get install --only-upgrade -y {packages}"
+            if refresh_lists:
+                command = f"sudo apt-get update && {command}"
+
+        def on_result(result):
+            _, stderr, exit_code = result
+            if exit_code != 0:
+                raise PackageHandlerError(f"Failed to {action} package {packages}. Error: {stderr}")
+            if apt_state and refresh_lists:
+                apt_state.mark_updated(ssh_client)
+            if facts and action == 'install':
+                facts.set_installed(package_names, installed=True)
+            self.logger.info("Package %s: %s", 'installed' if action == 'install' else 'updated', packages)
+            return STATUS_CHANGED
+
+        return CompiledTask(command, on_result)
+
+    def execute_batch(self, tasks, ssh_client):
+        """Execute several package tasks sharing one action as a single apt-get transaction.
+
+        If the merged transaction fails, each task is retried on its own so the
+        failure is attributed to the tasks that actually cause it.
+
+        Args:
+            tasks (list): Package task dictionaries with the same action.
+            ssh_client (SSHClient): SSH client connected to the remote server.
+
+        Returns:
+            list: A (task, status, error) tuple per task. ``error`` is None on
+            success, ``status`` is None on failure.
+        """
+        facts = getattr(ssh_client, 'facts', None)
+        outcomes = {}
+        packages = []
+        pending_tasks = []
+        for index, task in enumerate(tasks):
+            try:
+                task_packages = self.pending_packages(task.get('action'), self.package_names(task), facts)
+            except PackageHandlerError as e:
+                outcomes[index] = (None, e)
+                continue
+            if not task_packages:
+                outcomes[index] = (STATUS_OK, None)
+                continue
+            pending_tasks.append(index)
+            for package in task_packages:
+                if package not in packages:
+                    packages.append(package)
+
+        if pending_tasks:
+            action = tasks[pending_tasks[0]].get('action')
+            try:
+                self.run_action(ssh_client, action, packages)
+                for index in pending_tasks:
+                    outcomes[index] = (STATUS_CHANGED, None)
+            except PackageHandlerError as e:
+                self.logger.warning("Batched package '%s' of %s packages failed, retrying tasks individually: %s",
+                                    action, len(packages), e)
+                for index in pending_tasks:
+                    try:
+                        outcomes[index] = (self.execute(tasks[index], ssh_client), None)
+                    except Exception as task_error:
+                        outcomes[index] = (None, task_error)
+
+        return [(task,) + outcomes[index] for index, task in enumerate(tasks)]
+
+    def run_action(self, ssh_client, action, package_names):
+        """Run one package action for a list of packages in a single apt-get call."""
+        facts = getattr(ssh_client, 'facts', None)
+        packages = " ".join(package_names)
         try:
-            if action == 'install':
-                self.install_package(ssh_client, package_name)
-            elif action == 'update':
-                self.update_package(ssh_client, package_name)
+            if action in self.COMPILABLE_ACTIONS:
+                compiled = self.compile_action(ssh_client, action, package_names)
+                compiled.on_result(ssh_client.run_command(compiled.command,
+                                                          line_callback=debug_line_logger(self.logger)))
             elif action == 'remove':
-                self.remove_package(ssh_client, package_name)
+                self.remove_package(ssh_client, packages)
+                if facts:
+                    facts.set_installed(package_names, installed=False)
             else:
                 raise PackageHandlerError(f"Invalid or unsupported action '{action}' specified.")
         except SSHConnectionError as e:
-            self.logger.error(f"SSH error during package '{action}' for '{package_name}': {e}")
+            self.logger.error("SSH error during package '%s' for '%s': %s", action, packages, e)
             raise PackageHandlerError(e)
 
-    def install_package(self, ssh_client, package_name):
-        """Install a software package."""
-        command = f"sudo apt-get install -y {package_name}"
-        stdout, stderr, exit_code = ssh_client.execute_command(command)
-        self.logger.info(f"STDOUT: {stdout}")
-        self.logger.info(f"STDERR: {stderr}")
-        self.logger.info(f"Package installed: {package_name}")
-
-    def update_package(self, ssh_client, package_name):
-        """Update a software package."""
-        command = f"sudo apt-get update && sudo apt-get install --only-upgrade -y {package_name}"
-        stdout, stderr, exit_code = ssh_client.execute_command(command)
-        self.logger.info(f"STDOUT: {stdout}")
-        self.logger.info(f"STDERR: {stderr}")
-        self.logger.info(f"Package updated: {package_name}")
-
     def remove_package(self, ssh_client, package_name):
-        """Purge a software package along with its configuration files and perform autoremove."""
+        """Purge space-separated software packages with their configuration files and perform autoremove."""
         purge_command = f"sudo apt-get purge -y {package_name}"
         autoremove_command = "sudo apt-get autoremove -y"
 
         # Execute purge command
-        stdout, stderr, exit_code = ssh_client.execute_command(purge_command)
+        stdout, stderr, exit_code = ssh_client.run_command(purge_command,
+                                                           line_callback=debug_line_logger(self.logger))
         if exit_code != 0:
-            self.logger.error(f"Failed to purge package {package_name}. Exit Code: {exit_code}")
-            self.logger.error(f"STDOUT: {stdout}")
-            self.logger.error(f"STDERR: {stderr}")
+            self.logger.error("Failed to purge package %s. Exit Code: %s", package_name, exit_code)
+            self.logger.error("STDOUT: %s", stdout)
+            self.logger.error("STDERR: %s", stderr)
             raise PackageHandlerError(f"Failed to purge package {package_name}. Error: {stderr}")
-        self.logger.info(f"Package purged: {package_name}")
+        self.logger.info("Package purged: %s", package_name)
 
         # Execute autoremove command
-        stdout, stderr, exit_code = ssh_client.execute_command(autoremove_command)
+        stdout, stderr, exit_code = ssh_client.run_command(autoremove_command,
+                                                           line_callback=debug_line_logger(self.logger))
         if exit_code != 0:
-            self.logger.error("Failed to execute autoremove. Exit Code: {exit_code}")
-            self.logger.error(f"STDOUT: {stdout}")
-            self.logger.error(f"STDERR: {stderr}")
+            self.logger.error("Failed to execute autoremove. Exit Code: %s", exit_code)
+            self.logger.error("STDOUT: %s", stdout)
+            self.logger.error("STDERR: %s", stderr)
         else:
             self.logger.info("Autoremove executed successfully.")
 
 # Example usage:
-# package_task = {'action': 'install', 'package_name': 'nginx'}
+# package_task = {'action': 'install', 'package_name': ['nginx', 'curl']}
 # ssh_client = SSHClient(host='192.168.1.10', user='user', key_file='/path/to/key.pem')
 # handler = PackageHandler()
 # handler.execute(package_task, ssh_client)
@@ -1,7 +1,11 @@
 # service_handler.py
 
 import logging
-from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager
+import shlex
+from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager, SSHConnectionError
+from deploymate.run_report import STATUS_OK, STATUS_CHANGED
+from deploymate.handlers.compiled_task import CompiledTask
+from deploymate import services
 
 class ServiceHandlerError(Exception):
     """Custom exception for service handling errors."""
@@ -10,58 +14,144 @@ class ServiceHandlerError(Exception):
 class ServiceHandler:
     """Handler for managing system services on a remote server."""
 
+    # Unit ActiveStates in which an action has nothing left to do
+    SATISFIED_STATES = {'start': ('active',), 'stop': ('inactive', 'failed')}
+    # ActiveState a unit is in after an action succeeded
+    RESULTING_STATES = {'start': 'active', 'stop': 'inactive', 'restart': 'active'}
+    PAST_TENSE = {'start': 'started', 'stop': 'stopped', 'restart': 'restarted'}
+    # Starts the line a pre-checked command prints with the units it acted on
+    ACTED_MARKER = '@@deploymate-service'
+
     def __init__(self):
         self.logger = logging.getLogger(__name__)
 
+    @staticmethod
+    def service_names(task):
+        """Return the task's ``service_name`` as a list; it may be a name, space-separated names or a list."""
+        names = services.service_names(task)
+        if not names:
+            raise ServiceHandlerError("No service name specified in the task.")
+        return names
+
     def execute(self, task, ssh_client):
         """Execute service-related tasks on a remote server.
 
         Args:
             task (dict): Task details containing the action and service name.
+                ``service_name`` may be a single unit or a list of units, which
+                are handled by one systemctl invocation.
             ssh_client (SSHClient): SSH client connected to the remote server.
 
+        Returns:
+            str: STATUS_OK if every unit was already in the desired state,
+            STATUS_CHANGED otherwise.
+
         Raises:
             ServiceHandlerError: If there is an error in handling the service.
         """
-        action = task.get('action')
-        service_name = task.get('service_name')
-
-        if not service_name:
-            raise ServiceHandlerError("No service name specified in the task.")
+        compiled = self.compile_task(task, ssh_client)
+        if not isinstance(compiled, CompiledTask):
+            return compiled
 
         try:
-            if action == 'start':
-                self.start_service(ssh_client, service_name)
-            elif action == 'stop':
-                self.stop_service(ssh_client, service_name)
-            elif action == 'restart':
-                self.restart_service(ssh_client, service_name)
-            else:
-                raise ServiceHandlerError(f"Invalid or unsupported action '{action}' specified.")
+            output = ssh_client.execute_command(compiled.command)
         except SSHConnectionError as e:
-            self.logger.error(f"SSH error during service '{action}' for '{service_name}': {e}")
+            self.logger.error("SSH error during service '%s' for '%s': %s", task.get('action'),
+                              task.get('service_name'), e)
             raise ServiceHandlerError(e)
+        return compiled.on_result(output)
+
+    def compile_task(self, task, ssh_client):
+        """Return the CompiledTask for a service task, or STATUS_OK if there is nothing to do.
+
+        Units that gathered facts show in the desired state are left out. For
+        start and stop, the command checks the remaining units with one
+        ``systemctl show`` and acts only on those not yet in the desired state.
+
+        Raises:
+            ServiceHandlerError: If the task is invalid.
+        """
+        action = task.get('action')
+        service_names = self.service_names(task)
+        if action not in self.RESULTING_STATES:
+            raise ServiceHandlerError(f"Invalid or unsupported action '{action}' specified.")
+
+        facts = getattr(ssh_client, 'facts', None)
+        satisfied = self.SATISFIED_STATES.get(action, ())
+        if facts:
+            pending = [name for name in service_names if facts.service_state(name) not in satisfied]
+            if not pending:
+                self.logger.info("Services %s are already %s, skipping '%s'.", ' '.join(service_names),
+                                 self.RESULTING_STATES[action], action)
+                return STATUS_OK
+        else:
+            pending = service_names
+
+        def on_result(result):
+            stdout, stderr, exit_code = result
+            if exit_code != 0:
+                raise ServiceHandlerError(f"Failed to {action} {' '.join(pending)} (exit code {exit_code}): "
+                                          f"{stderr.strip()}")
+            acted = self.acted_units(stdout, pending)
+            if not acted:
+                self.logger.info("Services %s are already %s, skipping '%s'.", ' '.join(pending),
+                                 self.RESULTING_STATES[action], action)
+                return STATUS_OK
+            self.logger.info("Services %s: %s", self.PAST_TENSE[action], ' '.join(acted))
+            if facts:
+                for name in acted:
+                    facts.set_service_state(name, self.RESULTING_STATES[action])
+            return STATUS_CHANGED
+
+        return CompiledTask(self.service_command(action, pending), on_result)
+
+    @classmethod
+    def service_command(cls, action, service_names):
+        """Return the shell command applying ``action`` to the units in ``service_names`` in one systemctl call.
+
+        Restarts always run. Start and stop first read every unit's
+        ActiveState with one ``systemctl show``, act only on the units not
+        yet in the desired state and print those after ACTED_MARKER.
+        """
+        units = ' '.join(shlex.quote(name) for name in service_names)
+        if action not in cls.SATISFIED_STATES:
+            return f"sudo systemctl {action} -- {units}"
+        satisfied = '|'.join(cls.SATISFIED_STATES[action])
+        # One paragraph of Id= and ActiveState= lines per unit
+        select_pending = ('awk \'BEGIN { RS = ""; FS = "\\n" } { id = ""; state = ""; '
+                          'for (i = 1; i <= NF; i++) { split($i, field, "="); '
+                          'if (field[1] == "Id") id = field[2]; else if (field[1] == "ActiveState") state = field[2] } '
+                          f'if (state !~ /^({satisfied})$/) printf "%s ", id }}\'')
+        return (f"states=$(systemctl show --property=Id --property=ActiveState -- {units}) || exit $?\n"
+                f"pending=$(printf '%s\\n' \"$states\" | {select_pending})\n"
+                f"if [ -n \"$pending\" ]; then sudo systemctl {action} -- $pending || exit $?; fi\n"
+                f"echo \"{cls.ACTED_MARKER} $pending\"")
+
+    @classmethod
+    def acted_units(cls, stdout, service_names):
+        """Return the units a service command acted on, from its marker line or, without one, all of them."""
+        for line in reversed(stdout.splitlines()):
+            if line.startswith(cls.ACTED_MARKER):
+                return line[len(cls.ACTED_MARKER):].split()
+        return list(service_names)
 
     def start_service(self, ssh_client, service_name):
         """Start a system service."""
-        command = f"sudo systemctl start {service_name}"
-        ssh_client.execute_command(command)
-        self.logger.info(f"Service started: {service_name}")
+        ssh_client.execute_command(self.service_command('start', [service_name]))
+        self.logger.info("Service started: %s", service_name)
 
     def stop_service(self, ssh_client, service_name):
         """Stop a system service."""
-        command = f"sudo systemctl stop {service_name}"
-        ssh_client.execute_command(command)
-        self.logger.info(f"Service stopped: {service_name}")
+        ssh_client.execute_command(self.service_command('stop', [service_name]))
+        self.logger.info("Service stopped: %s", service_name)
 
     def restart_service(self, ssh_client, service_name):
         """Restart a system service."""
-        command = f"sudo systemctl restart {service_name}"
-        ssh_client.execute_command(command)
-        self.logger.info(f"Service restarted: {service_name}")
+        ssh_client.execute_command(self.service_command('restart', [service_name]))
+        self.logger.info("Service restarted: %s", service_name)
 
 # Example usage:
-# service_task = {'action': 'restart', 'service_name': 'nginx'}
+# service_task = {'action': 'start', 'service_name': ['nginx', 'redis-server']}
 # ssh_client = SSHClient(host='192.168.1.10', user='user', key_file='/path/to/key.pem')
 # handler = ServiceHandler()
 # handler.execute(service_task, ssh_client)
@@ -1,7 +1,10 @@
 # update_handler.py
 
 import logging
-from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager
+from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager, SSHConnectionError
+from deploymate.utils.command_output import debug_line_logger
+from deploymate.run_report import STATUS_OK, STATUS_CHANGED
+from deploymate.handlers.compiled_task import CompiledTask
 
 class UpdateHandlerError(Exception):
     """Custom exception for update handling errors."""
@@ -20,33 +23,69 @@ class UpdateHandler:
             task (dict): Task details containing the action.
             ssh_client (SSHClient): SSH client connected to the remote server.
 
+        Returns:
+            str: STATUS_OK if the package lists were fresh enough to skip the
+            update, STATUS_CHANGED otherwise.
+
         Raises:
             UpdateHandlerError: If there is an error in handling the update.
         """
-        action = task.get('action')
+        compiled = self.compile_task(task, ssh_client)
+        if not isinstance(compiled, CompiledTask):
+            return compiled
 
         try:
-            if action == 'update':
-                self.update_packages(ssh_client)
-            elif action == 'upgrade':
-                self.upgrade_packages(ssh_client)
-            else:
-                raise UpdateHandlerError(f"Invalid or unsupported action '{action}' specified.")
+            result = ssh_client.run_command(compiled.command, line_callback=debug_line_logger(self.logger))
         except SSHConnectionError as e:
-            self.logger.error(f"SSH error during update '{action}': {e}")
+            self.logger.error("SSH error during update '%s': %s", task.get('action'), e)
             raise UpdateHandlerError(e)
+        return compiled.on_result(result)
+
+    def compile_task(self, task, ssh_client):
+        """Return the CompiledTask for an update task, or STATUS_OK if there is nothing to do.
+
+        Raises:
+            UpdateHandlerError: If the action is not supported.
+        """
+        action = task.get('action')
+        if action == 'update':
+            return self.update_packages(ssh_client)
+        elif action == 'upgrade':
+            return self.upgrade_packages(ssh_client)
+        raise UpdateHandlerError(f"Invalid or unsupported action '{action}' specified.")
 
     def update_packages(self, ssh_client):
-        """Update package lists."""
-        command = "sudo apt-get update"
-        ssh_client.execute_command(command)
-        self.logger.info("Package lists updated.")
+        """Return the CompiledTask updating the package lists, or STATUS_OK if they are within the freshness window."""
+        apt_state = getattr(ssh_client, 'apt_state', None)
+        try:
+            needs_update = not apt_state or apt_state.needs_update(ssh_client)
+        except SSHConnectionError as e:
+            raise UpdateHandlerError(e)
+        if not needs_update:
+            self.logger.info("Package lists are fresh, skipping apt-get update.")
+            return STATUS_OK
+
+        def on_result(result):
+            _, stderr, exit_code = result
+            if exit_code != 0:
+                raise UpdateHandlerError(f"apt-get update failed (exit code {exit_code}): {stderr.strip()}")
+            if apt_state:
+                apt_state.mark_updated(ssh_client)
+            self.logger.info("Package lists updated.")
+            return STATUS_CHANGED
+
+        return CompiledTask("sudo apt-get update", on_result)
 
     def upgrade_packages(self, ssh_client):
-        """Upgrade all installed packages."""
-        command = "sudo apt-get upgrade -y"
-        ssh_client.execute_command(command)
-        self.logger.info("Installed packages upgraded.")
+        """Return the CompiledTask upgrading all installed packages."""
+        def on_result(result):
+            _, stderr, exit_code = result
+            if exit_code != 0:
+                raise UpdateHandlerError(f"apt-get upgrade failed (exit code {exit_code}): {stderr.strip()}")
+            self.logger.info("Installed packages upgraded.")
+            return STATUS_CHANGED
+
+        return CompiledTask("sudo apt-get upgrade -y", on_result)
 
 # Example usage:
 # update_task = {'action': 'upgrade'}
@@ -0,0 +1,384 @@
+# inventory.py
+#
+# Indexed inventory with nested groups, host name ranges, per-host variables
+# and host patterns. The YAML layout follows Ansible's:
+#
+#   all:
+#     vars: {user: ubuntu}
+#     children:
+#       web:
+#         vars: {http_port: 8080}
+#         hosts:
+#           web[001:400]: {}          # web001 ... web400
+#       db:
+#         hosts:
+#           db1: {host: 10.0.0.5}
+#
+# Hosts are numbered in definition order. Every group keeps the set of host
+# numbers it contains, so a task's pattern resolves with set operations
+# instead of scans over all hosts, and each distinct pattern is resolved once.
+
+import fnmatch
+import os
+import re
+
+# Host variables that become SSHConnection parameters
+CONNECTION_VARS = ('host', 'port', 'user', 'password', 'ssh_private_key_file')
+# Relative ssh_private_key_file paths are resolved against this directory
+KEY_FILE_BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+RANGE_PATTERN = re.compile(r'\[([^\]:]+):([^\]:]+)(?::(\d+))?\]')
+PATTERN_SEPARATOR = re.compile(r'[,:](?![^\[]*\])')
+GLOB_CHARS = re.compile(r'[*?]|\[[^\]:]*\]')
+
+class InventoryError(Exception):
+    """Custom exception for malformed inventories and host patterns that match nothing."""
+    pass
+
+def expand_host_range(pattern):
+    """Return the host names a name with ``[start:end]`` or ``[start:end:step]`` ranges stands for.
+
+    Numeric ranges keep the zero padding of ``start`` (``web[01:03]`` gives
+    web01, web02, web03); single letters give alphabetic ranges.
+
+    Raises:
+        InventoryError: If a range is not numeric or alphabetic.
+    """
+    match = RANGE_PATTERN.search(pattern)
+    if not match:
+        return [pattern]
+
+    start, end, step = match.group(1), match.group(2), int(match.group(3) or 1)
+    if start.isdigit() and end.isdigit():
+        width = len(start) if start.startswith('0') else 0
+        values = [str(value).zfill(width) for value in range(int(start), int(end) + 1, step)]
+    elif len(start) == 1 and len(end) == 1 and start.isalpha() and end.isalpha():
+        values = [chr(value) for value in range(ord(start), ord(end) + 1, step)]
+    else:
+        raise InventoryError(f"Invalid host range '{match.group(0)}' in '{pattern}'")
+
+    prefix, suffix = pattern[:match.start()], pattern[match.end():]
+    return [name for value in values for name in expand_host_range(f"{prefix}{value}{suffix}")]
+
+def resolve_key_file(key_file):
+    key_file = os.path.expanduser(key_file)
+    if os.path.isabs(key_file):
+        return key_file
+    return os.path.normpath(os.path.join(KEY_FILE_BASE_DIR, key_file))
+
+class HostRecord:
+    """One inventory host: its connection settings, own variables and groups.
+
+    ``vars`` holds only the variables set on the host itself and is shared by
+    all hosts of a range entry; Inventory.host_vars merges in group variables.
+    """
+
+    __slots__ = ('name', 'address', 'port', 'user', 'password', 'key_file', 'vars', 'groups')
+
+    def __init__(self, name, address, port, user, password, key_file, host_vars, groups):
+        self.name = name
+        self.address = address
+        self.port = port
+        self.user = user
+        self.password = password
+        self.key_file = key_file
+        self.vars = host_vars
+        self.groups = groups
+
+    def connection_params(self):
+        """Return SSHConnection keyword arguments for the host."""
+        params = {'host': self.address, 'user': self.user}
+        if self.port is not None:
+            params['port'] = int(self.port)
+        if self.password is not None:
+            params['password'] = self.password
+        if self.key_file is not None:
+            params['key_file'] = self.key_file
+        return params
+
+class _Group:
+    __slots__ = ('name', 'vars', 'hosts', 'children', 'parents', 'depth')
+
+    def __init__(self, name):
+        self.name = name
+        self.vars = {}
+        self.hosts = []
+        self.children = []
+        self.parents = []
+        self.depth = None
+
+class Inventory:
+    """Hosts and groups of an inventory, indexed for fast pattern resolution.
+
+    Use Inventory.from_dict to build one from parsed YAML.
+    """
+
+    def __init__(self, hosts, groups, group_members):
+        self.hosts = hosts
+        self.host_names = tuple(record.name for record in hosts)
+        self._groups = groups
+        self._index = {name: number for number, name in enumerate(self.host_names)}
+        self._members = group_members
+        self._group_vars = {}
+        self._resolved = {}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build an Inventory from a parsed inventory file.
+
+        Top-level keys other than ``all`` are groups nested under ``all``.
+
+        Raises:
+            InventoryError: If the inventory is malformed.
+        """
+        if not isinstance(data, dict) or not data:
+            raise InventoryError("Inventory must be a mapping of groups, starting with 'all'")
+
+        groups = {'all': _Group('all')}
+        host_numbers = {}
+        # Per host number, the (variables, group name) of each place the host is defined
+        host_entries = []
+
+        def add_group(name, definition, parent, path):
+            if name in path:
+                raise InventoryError(f"Group '{name}' is its own descendant: {' > '.join(path + (name,))}")
+            group = groups.get(name)
+            if group is None:
+                group = groups[name] = _Group(name)
+            if parent is not None and parent not in group.parents:
+                group.parents.append(parent)
+                groups[parent].children.append(name)
+            if definition is None:
+                return
+            if not isinstance(definition, dict):
+                raise InventoryError(f"Group '{name}' must be a mapping")
+
+            group_vars = definition.get('vars') or {}
+            if not isinstance(group_vars, dict):
+                raise InventoryError(f"vars of group '{name}' must be a mapping")
+            group.vars.update(group_vars)
+
+            hosts = definition.get('hosts') or {}
+            if not isinstance(hosts, dict):
+                raise InventoryError(f"hosts of group '{name}' must be a mapping of host names")
+            for host_pattern, host_vars in hosts.items():
+                host_vars = host_vars or {}
+                if not isinstance(host_vars, dict):
+                    raise InventoryError(f"Host '{host_pattern}' in group '{name}' must map to variables")
+                for host_name in expand_host_range(str(host_pattern)):
+                    number = host_numbers.get(host_name)
+                    if number is None:
+                        number = host_numbers[host_name] = len(host_entries)
+                        host_entries.append([])
+                    host_entries[number].append((host_vars, name))
+                    group.hosts.append(number)
+
+            children = definition.get('children') or {}
+            if not isinstance(children, dict):
+                raise InventoryError(f"children of group '{name}' must be a mapping of group names")
+            for child_name, child_definition in children.items():
+                add_group(str(child_name), child_definition, name, path + (name,))
+
+        add_group('all', data.get('all'), None, ())
+        for name, definition in data.items():
+            if name != 'all':
+                add_group(str(name), definition, 'all', ('all',))
+
+        group_members = cls._collect_members(groups)
+        cls._assign_depths(groups)
+
+        # Hosts defined in the same groups share their merged group variables, and
+        # hosts of one range entry share their variables and connection settings
+        merged_by_groups = {}
+        settings_by_entry = {}
+        key_files = {}
+        hosts = []
+        # Host numbers were assigned in insertion order
+        for host_name, entries in zip(host_numbers, host_entries):
+            direct_groups = tuple(dict.fromkeys(group_name for _, group_name in entries))
+            if len(entries) == 1:
+                host_vars = entries[0][0]
+            else:
+                host_vars = {}
+                for entry_vars, _ in entries:
+                    host_vars.update(entry_vars)
+
+            entry_key = (id(host_vars), direct_groups) if len(entries) == 1 else None
+            cached = settings_by_entry.get(entry_key)
+            if cached is None:
+                merged = merged_by_groups.get(direct_groups)
+                if merged is None:
+                    merged = merged_by_groups[direct_groups] = cls._merge_group_vars(groups, direct_groups)
+                all_groups, group_vars = merged
+                settings = {key: host_vars.get(key, group_vars.get(key)) for key in CONNECTION_VARS}
+                key_file = settings['ssh_private_key_file']
+                if key_file is not None:
+                    if key_file not in key_files:
+                        key_files[key_file] = resolve_key_file(key_file)
+                    settings['ssh_private_key_file'] = key_files[key_file]
+                cached = (all_groups, settings)
+                if entry_key:
+                    settings_by_entry[entry_key] = cached
+            all_groups, settings = cached
+            hosts.append(HostRecord(host_name, settings['host'] or host_name, settings['port'], settings['user'],
+                                    settings['password'], settings['ssh_private_key_file'], host_vars, all_groups))
+        return cls(hosts, groups, group_members)
+
+    @staticmethod
+    def _collect_members(groups):
+        """Return every group's host numbers, including those of its descendants."""
+        members = {}
+
+        def collect(name, path):
+            if name in members:
+                return members[name]
+            if name in path:
+                raise InventoryError(f"Group '{name}' is its own descendant: {' > '.join(path + (name,))}")
+            group = groups[name]
+            numbers = set(group.hosts)
+            for child_name in group.children:
+                numbers |= collect(child_name, path + (name,))
+            members[name] = frozenset(numbers)
+            return members[name]
+
+        for name in groups:
+            collect(name, ())
+        return members
+
+    @staticmethod
+    def _assign_depths(groups):
+        # Called after _collect_members has ruled out cycles
+        def depth(group):
+            if group.depth is None:
+                group.depth = max((depth(groups[parent]) + 1 for parent in group.parents), default=0)
+            return group.depth
+
+        for group in groups.values():
+            depth(group)
+
+    @staticmethod
+    def _merge_group_vars(groups, direct_groups):
+        """Return (groups, variables) for hosts in ``direct_groups``, ancestors included.
+
+        Variables of deeper groups override those of their ancestors; groups
+        of equal depth are applied in name order.
+        """
+        names = set()
+        pending = list(direct_groups)
+        while pending:
+            name = pending.pop()
+            if name not in names:
+                names.add(name)
+                pending.extend(groups[name].parents)
+
+        ordered = tuple(sorted(names, key=lambda name: (groups[name].depth, name)))
+        merged_vars = {}
+        for name in ordered:
+            merged_vars.update(groups[name].vars)
+        return ordered, merged_vars
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def __contains__(self, host_name):
+        return host_name in self._index
+
+    def group_names(self):
+        return list(self._groups)
+
+    def host(self, host_name):
+        """Return the HostRecord of a host.
+
+        Raises:
+            InventoryError: If the host is not in the inventory.
+        """
+        number = self._index.get(host_name)
+        if number is None:
+            raise InventoryError(f"Unknown host '{host_name}'")
+        return self.hosts[number]
+
+    def host_vars(self, host_name):
+        """Return a host's variables: those of its groups, overridden by its own."""
+        record = self.host(host_name)
+        group_vars = self._group_vars.get(record.groups)
+        if group_vars is None:
+            group_vars = self._group_vars[record.groups] = self._merge_group_vars(self._groups, record.groups)[1]
+        return {**group_vars, **record.vars}
+
+    def connection_params(self):
+        """Return SSHConnection keyword arguments for every host."""
+        return {record.name: record.connection_params() for record in self.hosts}
+
+    def resolve(self, pattern):
+        """Return the names of the hosts a pattern selects, in inventory order.
+
+        A pattern is a string or a list of strings. Terms are separated by
+        ``,`` or ``:`` and each is a group, a host, a glob (``web*``) or a
+        host range (``web[001:400]``). Plain terms are combined, then terms
+        prefixed with ``&`` intersect the selection and terms prefixed with
+        ``!`` are removed from it. An empty pattern selects all hosts.
+
+        Raises:
+            InventoryError: If a term that is not a glob matches nothing.
+        """
+        if not pattern:
+            pattern = 'all'
+        key = pattern if isinstance(pattern, str) else tuple(pattern)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            items = [pattern] if isinstance(pattern, str) else pattern
+            terms = [term.strip() for item in items for term in PATTERN_SEPARATOR.split(str(item))]
+            resolved = self._resolved[key] = self._resolve_terms([term for term in terms if term])
+        return resolved
+
+    def _resolve_terms(self, terms):
+        included = [term for term in terms if term[0] not in '&!']
+        intersections = [term[1:] for term in terms if term[0] == '&']
+        exclusions = [term[1:] for term in terms if term[0] == '!']
+        if included == ['all'] and not intersections and not exclusions:
+            return self.host_names
+
+        selected = set()
+        for term in included:
+            selected |= self._match(term)
+        if not included:
+            selected = set(self._members['all'])
+        for term in intersections:
+            selected &= self._match(term)
+        for term in exclusions:
+            selected -= self._match(term)
+        return tuple(self.host_names[number] for number in sorted(selected))
+
+    def _match(self, term):
+        """Return the host numbers a single pattern term matches."""
+        if term in ('all', '*'):
+            return self._members['all']
+        if term in self._members:
+            return self._members[term]
+        number = self._index.get(term)
+        if number is not None:
+            return frozenset((number,))
+
+        if RANGE_PATTERN.search(term):
+            numbers = frozenset(number for number in map(self._index.get, expand_host_range(term))
+                                if number is not None)
+            if numbers:
+                return numbers
+        elif GLOB_CHARS.search(term):
+            numbers = set()
+            for group_name in fnmatch.filter(self._members, term):
+                numbers |= self._members[group_name]
+            numbers.update(self._index[host_name] for host_name in fnmatch.filter(self.host_names, term))
+            return frozenset(numbers)
+        raise InventoryError(f"Host pattern '{term}' matches no host or group")
+
+def load_inventory(inventory):
+    """Return ``inventory`` as an Inventory, building one if it is a parsed inventory file."""
+    if isinstance(inventory, Inventory):
+        return inventory
+    return Inventory.from_dict(inventory)
+
+# Example usage:
+# inventory = Inventory.from_dict(yaml_parser.parse_inventory('inventory.yml'))
+# inventory.resolve('web:&staging:!web003')
+# inventory.host_vars('web001')
@@ -0,0 +1,247 @@
+# log_pipeline.py
+#
+# Logging for playbook runs that keeps formatting and I/O off the worker
+# threads. While a LogPipeline is started, the root logger has a single
+# handler that puts records on a queue; a listener thread formats them and
+# writes them to the console and, optionally, a JSON-lines file. Messages
+# should use lazy %-style arguments (logger.debug("... %s", value)) so a
+# record below the configured level costs one level check.
+#
+# Code working on a host runs inside ``with log_context(host_name, task):``;
+# records logged there are tagged with the host and task. The console
+# holds back a host's records until its work leaves the context (or its
+# buffer fills), then writes them as one block, so the output of hosts run
+# concurrently does not interleave line by line.
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(host_label)s%(message)s'
+
+# Records held per host before its block is written early
+DEFAULT_HOST_BUFFER_CAPACITY = 500
+
+_current_context = contextvars.ContextVar('deploymate_log_context', default=(None, None))
+_pipeline = None
+
+class LogPipelineError(Exception):
+    """Custom exception for logging setup errors."""
+    pass
+
+class _HostBlockEnd:
+    """Queued when a host's work leaves its log context; tells the console to write the host's block."""
+
+    __slots__ = ('host',)
+
+    def __init__(self, host):
+        self.host = host
+
+class HostFormatter(logging.Formatter):
+    """Formats a record with its host, if it has one, in front of the message."""
+
+    def formatMessage(self, record):
+        host = getattr(record, 'host', None)
+        record.host_label = f"[{host}] " if host else ''
+        return super().formatMessage(record)
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record as one JSON object with its time, level, logger, host, task and message."""
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'host': getattr(record, 'host', None),
+            'task': getattr(record, 'task', None),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class HostBufferingHandler(logging.Handler):
+    """Passes records on to ``target``, holding those of each host back until its block ends.
+
+    Only the listener thread calls this handler, so the buffers need no lock.
+    """
+
+    def __init__(self, target, capacity=DEFAULT_HOST_BUFFER_CAPACITY):
+        super().__init__()
+        self.target = target
+        self.capacity = capacity
+        self.buffers = {}
+
+    def emit(self, record):
+        host = getattr(record, 'host', None)
+        if host is None:
+            self.target.handle(record)
+            return
+        buffer = self.buffers.setdefault(host, [])
+        buffer.append(record)
+        if len(buffer) >= self.capacity:
+            self.end_block(host)
+
+    def end_block(self, host):
+        """Write the records held for ``host`` to the target."""
+        for record in self.buffers.pop(host, ()):
+            self.target.handle(record)
+
+    def flush(self):
+        for host in list(self.buffers):
+            self.end_block(host)
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        super().close()
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """Queues records tagged with the current host and task, leaving their formatting to the listener."""
+
+    def handle(self, record):
+        # The queue is thread-safe, so unlike Handler.handle this does not
+        # serialise the worker threads on the handler's lock.
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def prepare(self, record):
+        # QueueHandler.prepare formats the message on the logging thread; the
+        # queue never leaves the process, so the record can be passed as is.
+        if not hasattr(record, 'host'):
+            record.host, record.task = _current_context.get()
+        return record
+
+class _BlockListener(logging.handlers.QueueListener):
+    def handle(self, record):
+        if isinstance(record, _HostBlockEnd):
+            for handler in self.handlers:
+                if isinstance(handler, HostBufferingHandler):
+                    handler.end_block(record.host)
+            return
+        super().handle(record)
+
+class LogPipeline:
+    """Routes the root logger's records through a queue to a console handler and an optional JSON-lines file.
+
+    Args:
+        level (int): Level of the root logger while the pipeline runs.
+        stream: Console stream, sys.stderr if None.
+        json_path (str): File to append one JSON object per record to, or None.
+        buffer_hosts (bool): Write each host's console output in blocks instead of line by line.
+        host_buffer_capacity (int): Records held per host before its block is written early.
+    """
+
+    def __init__(self, level=logging.INFO, stream=None, json_path=None, buffer_hosts=True,
+                 host_buffer_capacity=DEFAULT_HOST_BUFFER_CAPACITY):
+        self.level = level
+        self.queue = queue.SimpleQueue()
+        console = logging.StreamHandler(stream or sys.stderr)
+        console.setFormatter(HostFormatter(CONSOLE_FORMAT))
+        self.handlers = [HostBufferingHandler(console, host_buffer_capacity) if buffer_hosts else console]
+        if json_path:
+            try:
+                json_handler = logging.FileHandler(json_path, mode='a', encoding='utf-8')
+            except OSError as e:
+                raise LogPipelineError(f"Could not open log file {json_path}: {e}")
+            json_handler.setFormatter(JsonLinesFormatter())
+            self.handlers.append(json_handler)
+        self.queue_handler = _ContextQueueHandler(self.queue)
+        self.listener = _BlockListener(self.queue, *self.handlers)
+        self._replaced_handlers = []
+        self._replaced_level = None
+        self._replaced_switches = None
+
+    def start(self):
+        """Make the pipeline the root logger's only handler and start the listener thread."""
+        root = logging.getLogger()
+        self._replaced_handlers = list(root.handlers)
+        self._replaced_level = root.level
+        for handler in self._replaced_handlers:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+        # Neither output shows the caller's source line, thread or process,
+        # which are costly to collect for every record (see "Optimization"
+        # in the logging documentation)
+        self._replaced_switches = (logging._srcfile, logging.logThreads, logging.logProcesses,
+                                   logging.logMultiprocessing)
+        logging._srcfile = None
+        logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+        self.listener.start()
+
+    def end_host_block(self, host):
+        self.queue.put_nowait(_HostBlockEnd(host))
+
+    def stop(self):
+        """Write out every queued and held record, then give the root logger its previous handlers back."""
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+        for handler in self._replaced_handlers:
+            root.addHandler(handler)
+        root.setLevel(self._replaced_level)
+        (logging._srcfile, logging.logThreads, logging.logProcesses,
+         logging.logMultiprocessing) = self._replaced_switches
+
+def start_logging(level=logging.INFO, stream=None, json_path=None, buffer_hosts=True,
+                  host_buffer_capacity=DEFAULT_HOST_BUFFER_CAPACITY):
+    """Start a LogPipeline for the process, replacing one already running, and return it.
+
+    Raises:
+        LogPipelineError: If the JSON-lines file cannot be opened.
+    """
+    global _pipeline
+    pipeline = LogPipeline(level, stream, json_path, buffer_hosts, host_buffer_capacity)
+    stop_logging()
+    pipeline.start()
+    _pipeline = pipeline
+    return pipeline
+
+def stop_logging():
+    """Stop the running LogPipeline, if any, after writing out everything it holds."""
+    global _pipeline
+    pipeline, _pipeline = _pipeline, None
+    if pipeline:
+        pipeline.stop()
+
+class _LogContext:
+    __slots__ = ('host', 'task', '_token')
+
+    def __init__(self, host, task):
+        self.host = host
+        self.task = task
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_context.set((self.host, self.task))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_context.reset(self._token)
+        pipeline = _pipeline
+        if pipeline is not None and _current_context.get()[0] != self.host:
+            pipeline.end_host_block(self.host)
+        return False
+
+def log_context(host, task=None):
+    """Return a context manager tagging records logged inside it with ``host`` and ``task``.
+
+    Leaving the outermost context of a host ends its console block.
+    """
+    return _LogContext(host, task)
+
+# Example usage:
+# start_logging(logging.INFO, json_path='run.jsonl')
+# with log_context('web1', 'Install nginx'):
+#     logging.getLogger(__name__).info("Installing %s", 'nginx')
+# stop_logging()
@@ -3,47 +3,190 @@
 import argparse
 import logging
 import os
-from deploymate.playbook_executor import execute_playbook_from_files, YAMLDataProvider
+import sys
+from deploymate.playbook_executor import execute_playbook_from_files, YAMLDataProvider, DEFAULT_FORKS
+from deploymate.utils.ssh_module import DEFAULT_CONNECT_TIMEOUT, DEFAULT_AUTH_TIMEOUT, DEFAULT_MAX_PARALLEL_CONNECTS
+from deploymate.utils.command_output import DEFAULT_MAX_OUTPUT_BYTES
+from deploymate.facts import DEFAULT_FACT_CACHE_DIR, DEFAULT_FACT_CACHE_TTL
+from deploymate.utils.apt_state import DEFAULT_APT_FRESHNESS_WINDOW
+from deploymate.utils.agent_client import DEFAULT_AGENT_SOCKET, AgentError
+from deploymate.agent import ensure_agent_running, DEFAULT_IDLE_TIMEOUT
+from deploymate.plan import DEFAULT_PLAN_CACHE_DIR
+from deploymate.run_state import DEFAULT_RUN_STATE_DIR
+from deploymate.strategies import STRATEGIES, STRATEGY_LINEAR, parse_serial
+from deploymate.task_graph import DEFAULT_HOST_CONCURRENCY
+from deploymate.tracing import enable_tracing, disable_tracing
+from deploymate.log_pipeline import start_logging, stop_logging, LogPipelineError
 
 def validate_file(file_path):
     """Check if a file exists and is readable."""
     if not os.path.exists(file_path) or not os.path.isfile(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
+def positive_int(value):
+    """argparse type for options that take a count of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def serial_spec(value):
+    """argparse type for --serial: host counts and percentages, comma-separated."""
+    try:
+        parse_serial(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def percentage(value):
+    """argparse type for options that take a percentage from 0 to 100."""
+    number = float(value)
+    if not 0 <= number <= 100:
+        raise argparse.ArgumentTypeError(f"must be between 0 and 100, got {value}")
+    return number
+
 def parse_arguments():
     """Parse and validate command line arguments."""
     parser = argparse.ArgumentParser(description="DeployMate: Simple Configuration Management Tool")
     parser.add_argument('playbook', help='Path to the playbook YAML file')
     parser.add_argument('inventory', help='Path to the inventory YAML file')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
-    return parser.parse_args()
+    parser.add_argument('--log-json', metavar='PATH',
+                        help='Also append each log record to PATH as one JSON object per line')
+    parser.add_argument('--no-log-buffering', dest='log_buffering', action='store_false',
+                        help="Write log lines as they come instead of in blocks per host")
+    parser.add_argument('--forks', type=positive_int, default=DEFAULT_FORKS,
+                        help=f'Number of hosts to run each task on in parallel (default: {DEFAULT_FORKS})')
+    parser.add_argument('--strategy', choices=STRATEGIES, default=STRATEGY_LINEAR,
+                        help='linear: each task finishes on all hosts before the next starts; '
+                             'free: each host runs ahead on its own; graph: as free, and independent tasks of a '
+                             f'host run at the same time (default: {STRATEGY_LINEAR})')
+    parser.add_argument('--host-concurrency', type=positive_int, default=DEFAULT_HOST_CONCURRENCY,
+                        help=f'Tasks run at once on one host by the graph strategy (default: {DEFAULT_HOST_CONCURRENCY})')
+    parser.add_argument('--serial', type=serial_spec,
+                        help="Process hosts in rolling batches of this many hosts or percent of hosts, "
+                             "e.g. '10', '25%%' or '1,10%%,50%%'")
+    parser.add_argument('--max-fail-percentage', type=percentage,
+                        help='Stop the run once more than this percentage of a batch\'s hosts have failed')
+    parser.add_argument('--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help=f'Seconds to wait for a host to accept the SSH connection (default: {DEFAULT_CONNECT_TIMEOUT})')
+    parser.add_argument('--auth-timeout', type=float, default=DEFAULT_AUTH_TIMEOUT,
+                        help=f'Seconds to wait for SSH authentication (default: {DEFAULT_AUTH_TIMEOUT})')
+    parser.add_argument('--max-parallel-connects', type=positive_int, default=DEFAULT_MAX_PARALLEL_CONNECTS,
+                        help=f'Maximum number of SSH handshakes in flight at once (default: {DEFAULT_MAX_PARALLEL_CONNECTS})')
+    parser.add_argument('--max-output-bytes', type=positive_int, default=DEFAULT_MAX_OUTPUT_BYTES,
+                        help=f'Command output kept in memory per stream (default: {DEFAULT_MAX_OUTPUT_BYTES})')
+    parser.add_argument('--output-spill-dir',
+                        help='Directory to write the full output of commands exceeding --max-output-bytes')
+    parser.add_argument('--no-package-batching', dest='batch_packages', action='store_false',
+                        help='Run every package task as its own apt-get transaction')
+    parser.add_argument('--compile-scripts', action='store_true',
+                        help='Run consecutive shell-only tasks of each host as one remote script')
+    parser.add_argument('--agent', action='store_true',
+                        help='Reuse SSH sessions held by the connection agent, starting it if needed')
+    parser.add_argument('--agent-socket', default=DEFAULT_AGENT_SOCKET,
+                        help=f'Unix socket of the connection agent (default: {DEFAULT_AGENT_SOCKET})')
+    parser.add_argument('--agent-idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f'Seconds a started agent keeps unused sessions open (default: {DEFAULT_IDLE_TIMEOUT})')
+    parser.add_argument('--plan-cache-dir', default=DEFAULT_PLAN_CACHE_DIR,
+                        help=f'Directory for compiled playbook plans (default: {DEFAULT_PLAN_CACHE_DIR})')
+    parser.add_argument('--no-plan-cache', dest='plan_cache', action='store_false',
+                        help='Parse and validate the playbook on every run instead of using a cached plan')
+    parser.add_argument('--gather-facts', action='store_true',
+                        help='Gather installed packages, service states and paths first and skip tasks already done')
+    parser.add_argument('--fact-cache-dir', default=DEFAULT_FACT_CACHE_DIR,
+                        help=f'Directory for cached host facts (default: {DEFAULT_FACT_CACHE_DIR})')
+    parser.add_argument('--fact-cache-ttl', type=float, default=DEFAULT_FACT_CACHE_TTL,
+                        help=f'Seconds cached facts stay valid, 0 to always regather (default: {DEFAULT_FACT_CACHE_TTL})')
+    parser.add_argument('--apt-freshness-window', type=float, default=DEFAULT_APT_FRESHNESS_WINDOW,
+                        help='Skip apt-get update if the package lists were refreshed less than this many seconds '
+                             f'ago, 0 to always update (default: {DEFAULT_APT_FRESHNESS_WINDOW})')
+    parser.add_argument('--run-state-dir', default=DEFAULT_RUN_STATE_DIR,
+                        help=f'Directory of the per-playbook journals of task outcomes (default: {DEFAULT_RUN_STATE_DIR})')
+    parser.add_argument('--no-run-state', dest='run_state', action='store_false',
+                        help='Do not journal task outcomes; --resume and --changed-only are then unavailable')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the tasks each host completed in the previous run, up to its first failure')
+    parser.add_argument('--changed-only', action='store_true',
+                        help='Skip tasks whose definition and uploaded files are unchanged since they last '
+                             'succeeded on the host')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='Time connects, tasks, handlers, commands and transfers, write them to PATH as Chrome '
+                             'trace-event JSON and log the slowest tasks and hosts')
+    parser.add_argument('--trace-top', type=int, default=10,
+                        help='Number of slowest tasks and hosts logged with --trace (default: 10)')
+    args = parser.parse_args()
+    if (args.resume or args.changed_only) and not args.run_state:
+        parser.error("--resume and --changed-only need the run state journal, drop --no-run-state")
+    return args
 
 def main():
     args = parse_arguments()
 
-    # Manually set logging level to DEBUG:
     log_level = logging.DEBUG if args.verbose else logging.INFO
-    logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
-    logging.getLogger().setLevel(log_level)
-
-    # Check actual logging level:
-    logging.debug("Actual logging level: %s", logging.getLevelName(logging.getLogger().level))
-
-    # Isolate logging test:
-    logging.debug("This is a DEBUG message")
+    try:
+        start_logging(log_level, json_path=args.log_json, buffer_hosts=args.log_buffering)
+    except LogPipelineError as e:
+        sys.exit(f"Error: {e}")
 
     try:
         validate_file(args.playbook)
         validate_file(args.inventory)
         logging.info("Starting playbook execution...")
 
+        agent_socket = None
+        if args.agent:
+            try:
+                ensure_agent_running(args.agent_socket, args.agent_idle_timeout)
+                agent_socket = args.agent_socket
+            except AgentError as e:
+                logging.warning("Connection agent unavailable, connecting directly: %s", e)
+
+        if args.trace:
+            enable_tracing()
+
         # Using YAMLDataProvider for parsing
         yaml_data_provider = YAMLDataProvider()
-        execute_playbook_from_files(args.playbook, args.inventory, yaml_data_provider)
+        report = execute_playbook_from_files(
+            args.playbook, args.inventory, yaml_data_provider,
+            forks=args.forks,
+            strategy=args.strategy,
+            serial=args.serial,
+            max_fail_percentage=args.max_fail_percentage,
+            host_concurrency=args.host_concurrency,
+            connect_timeout=args.connect_timeout,
+            auth_timeout=args.auth_timeout,
+            max_parallel_connects=args.max_parallel_connects,
+            max_output_bytes=args.max_output_bytes,
+            output_spill_dir=args.output_spill_dir,
+            batch_packages=args.batch_packages,
+            compile_scripts=args.compile_scripts,
+            agent_socket=agent_socket,
+            plan_cache_dir=args.plan_cache_dir if args.plan_cache else None,
+            run_state_dir=args.run_state_dir if args.run_state else None,
+            resume=args.resume,
+            changed_only=args.changed_only,
+            gather_facts=args.gather_facts,
+            fact_cache_dir=args.fact_cache_dir,
+            fact_cache_ttl=args.fact_cache_ttl,
+            apt_freshness_window=args.apt_freshness_window,
+        )
 
-        logging.info("Playbook execution completed successfully.")
+        if report.has_failures():
+            logging.warning("Playbook execution completed with failures.")
+        else:
+            logging.info("Playbook execution completed successfully.")
     except Exception as e:  # Consider more specific exceptions here
         logging.error("Error: %s", e)
+    finally:
+        tracer = disable_tracing()
+        if tracer:
+            tracer.log_summary(args.trace_top)
+            try:
+                tracer.write_chrome_trace(args.trace)
+            except OSError as e:
+                logging.error("Could not write trace to %s: %s", args.trace, e)
+        stop_logging()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,14 @@
+# paths.py
+#
+# Local directories shared by the planner and the handlers. Kept apart from
+# deploymate.handlers so that compiling a plan does not import a handler.
+
+import os
+
+# Directory holding the bundled configuration
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+# Local directory that upload and upload_tree task paths are relative to
+FILES_TO_UPLOAD_DIR = os.path.join(CONFIG_DIR, 'files_to_upload')
+
+# Example usage:
+# local_path = os.path.join(FILES_TO_UPLOAD_DIR, 'app.tar.gz')
@@ -0,0 +1,390 @@
+# plan.py
+#
+# Compiles a parsed playbook and inventory into a Plan: every task is
+# validated before any host is contacted and lowered to a PlanTask with its
+# target hosts (see deploymate/inventory.py for host patterns) and local
+# upload paths already resolved. Plans compiled from files are cached on
+# disk, keyed by the content hash of both files, so an unchanged playbook is
+# neither parsed nor validated again. Only the tasks are cached; the
+# inventory, which holds passwords and host variables, is parsed afresh.
+
+import hashlib
+import logging
+import os
+import pickle
+import stat
+import threading
+from deploymate.resource_handler_factory import handler_registry, UnknownResourceTypeError
+from deploymate.paths import FILES_TO_UPLOAD_DIR
+from deploymate.utils.content_transfer import ContentTransferError, file_mode, file_owner
+from deploymate.templates import TEMPLATES_DIR, TemplateError, get_template_cache
+from deploymate.inventory import InventoryError, load_inventory
+from deploymate.task_graph import declared_dependencies
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLAN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'deploymate', 'plans')
+
+# Part of every cache key; bump it whenever PlanTask or Plan change shape
+PLAN_FORMAT_VERSION = 7
+
+# Keys each built-in task type requires, per action; a None action covers tasks of any action
+TASK_SCHEMAS = {
+    'package': {'install': ('package_name',), 'update': ('package_name',), 'remove': ('package_name',)},
+    'file': {'create': ('remote_path',), 'overwrite': ('remote_path',), 'delete': ('remote_path',),
+             'upload': ('remote_path', 'files'), 'upload_tree': ('remote_path', 'local_dir'),
+             'template': ('remote_path', 'template')},
+    'service': {'start': ('service_name',), 'stop': ('service_name',), 'restart': ('service_name',)},
+    'update': {'update': (), 'upgrade': ()},
+    'directory': {'create': ('directory_path',), 'delete': ('directory_path',)},
+    'command': {None: ('command',)},
+}
+
+# Task keys stored in their own slot; any other key goes to PlanTask.extra
+TASK_FIELDS = ('name', 'type', 'action', 'hosts', 'package_name', 'files', 'remote_path', 'content',
+               'directory_path', 'command', 'service_name', 'local_dir', 'delete_missing', 'delta', 'local_paths',
+               'depends_on', 'notify', 'mode', 'owner', 'template')
+
+class PlanError(Exception):
+    """Raised when a playbook or inventory fails validation; ``errors`` lists every problem found."""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        details = "\n".join(f"  - {error}" for error in self.errors)
+        super().__init__(f"Playbook validation failed with {len(self.errors)} error(s):\n{details}")
+
+class PlanTask:
+    """A validated task with its target hosts resolved.
+
+    Supports the read-only dict operations the executors and handlers use
+    (``task['name']``, ``task.get('files', [])``, ``'delta' in task``), so it
+    can be passed wherever a task dictionary is expected. ``hosts`` is a
+    tuple of inventory host names and, for uploads, ``local_paths`` holds
+    the absolute local paths of the files or directory to send.
+    """
+
+    __slots__ = TASK_FIELDS + ('extra',)
+
+    def __init__(self, fields):
+        extra = {}
+        for key, value in fields.items():
+            if key in TASK_FIELDS:
+                setattr(self, key, value)
+            else:
+                extra[key] = value
+        self.extra = extra
+
+    def get(self, key, default=None):
+        if key in TASK_FIELDS:
+            return getattr(self, key, default)
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self):
+        return [key for key in TASK_FIELDS if hasattr(self, key)] + list(self.extra)
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def __repr__(self):
+        return f"PlanTask({self.to_dict()!r})"
+
+_MISSING = object()
+
+class Plan:
+    """The compiled form of a playbook and the Inventory it runs against.
+
+    ``handlers`` are the playbook's handler tasks, which run on a host only
+    when a task that changed the host notified them.
+    """
+
+    __slots__ = ('tasks', 'inventory', 'handlers')
+
+    def __init__(self, tasks, inventory, handlers=()):
+        self.tasks = tasks
+        self.inventory = inventory
+        self.handlers = handlers
+
+    def local_paths(self):
+        """Return every local file and directory the plan uploads."""
+        return {path for task in (*self.tasks, *self.handlers) for path in task.get('local_paths', ())}
+
+def declared_notifications(task):
+    """Return the handler names listed in a task's ``notify``, which may be a name or a list."""
+    notify = task.get('notify')
+    if not notify:
+        return ()
+    if isinstance(notify, str):
+        return (notify,)
+    return tuple(notify)
+
+def resolve_hosts(hosts, inventory, errors, label):
+    """Return the host names a task's ``hosts`` pattern selects, recording bad patterns in ``errors``."""
+    try:
+        return inventory.resolve(hosts)
+    except InventoryError as e:
+        errors.append(f"{label}: {e}")
+        return ()
+
+def lower_file_task(fields, errors, label, upload_dir=FILES_TO_UPLOAD_DIR):
+    """Normalise a file task in place and resolve its local paths against ``upload_dir``."""
+    action = fields.get('action')
+    # 'file_path' names a single file, as an alternative to remote_path plus files
+    file_path = fields.pop('file_path', None)
+    if file_path and action in ('create', 'overwrite', 'template', 'delete') and not fields.get('remote_path'):
+        fields['remote_path'] = os.path.dirname(file_path)
+        fields['files'] = [os.path.basename(file_path)]
+
+    files = fields.get('files')
+    if files is not None and (not isinstance(files, list) or not all(isinstance(name, str) for name in files)):
+        errors.append(f"{label}: 'files' must be a list of file names")
+        return
+
+    if action in ('create', 'overwrite', 'template'):
+        for key, check in (('mode', file_mode), ('owner', file_owner)):
+            try:
+                if fields.get(key) is not None:
+                    check(fields[key])
+            except ContentTransferError as e:
+                errors.append(f"{label}: {e}")
+    if action == 'template' and fields.get('template'):
+        local_path = os.path.join(TEMPLATES_DIR, fields['template'])
+        if not os.path.isfile(local_path):
+            errors.append(f"{label}: template does not exist: {local_path}")
+        else:
+            try:
+                get_template_cache().get(local_path)
+            except TemplateError as e:
+                errors.append(f"{label}: {e}")
+        fields['local_paths'] = (local_path,)
+    elif action == 'upload':
+        local_paths = []
+        for file_name in files or ():
+            local_path = os.path.join(upload_dir, file_name)
+            if not os.path.isfile(local_path):
+                errors.append(f"{label}: local file does not exist: {local_path}")
+            local_paths.append(local_path)
+        fields['local_paths'] = tuple(local_paths)
+    elif action == 'upload_tree' and fields.get('local_dir'):
+        local_path = os.path.join(upload_dir, fields['local_dir'])
+        if not os.path.isdir(local_path):
+            errors.append(f"{label}: local directory does not exist: {local_path}")
+        fields['local_paths'] = (local_path,)
+
+def compile_task(task, index, inventory, earlier_names, errors, handler_names=None, kind='Task',
+                 upload_dir=FILES_TO_UPLOAD_DIR):
+    """Validate one playbook task and return its PlanTask, recording problems in ``errors``.
+
+    ``earlier_names`` are the names of the tasks before it, which its
+    ``depends_on`` may refer to, and ``handler_names`` the handlers its
+    ``notify`` may refer to; None for a handler, which cannot notify.
+    Upload paths are resolved against ``upload_dir``.
+    """
+    label = f"{kind} {index + 1}"
+    if not isinstance(task, dict):
+        errors.append(f"{label}: expected a mapping, got {type(task).__name__}")
+        return None
+    fields = dict(task)
+    if fields.get('name'):
+        label = f"{label} '{fields['name']}'"
+    else:
+        errors.append(f"{label}: missing 'name'")
+
+    task_type = fields.get('type')
+    schema = TASK_SCHEMAS.get(task_type)
+    if not task_type:
+        errors.append(f"{label}: missing 'type'")
+    elif schema is None:
+        try:
+            handler_registry.handler_class(task_type)
+        except UnknownResourceTypeError as e:
+            errors.append(f"{label}: {e}")
+    else:
+        action = fields.get('action')
+        if None in schema:
+            required = schema[None]
+        elif action in schema:
+            required = schema[action]
+        else:
+            required = ()
+            errors.append(f"{label}: unsupported {task_type} action '{action}' "
+                          f"(expected one of: {', '.join(schema)})")
+        if task_type == 'file':
+            lower_file_task(fields, errors, label, upload_dir)
+        for key in required:
+            if not fields.get(key):
+                errors.append(f"{label}: missing '{key}'")
+
+    if fields.get('depends_on') is not None:
+        depends_on = declared_dependencies(fields)
+        fields['depends_on'] = depends_on
+        for name in depends_on:
+            if name not in earlier_names:
+                errors.append(f"{label}: depends on '{name}', which is not an earlier task")
+
+    if fields.get('notify') is not None:
+        notify = declared_notifications(fields)
+        fields['notify'] = notify
+        if handler_names is None:
+            errors.append(f"{label}: handlers cannot notify other handlers")
+        else:
+            for name in notify:
+                if name not in handler_names:
+                    errors.append(f"{label}: notifies '{name}', which is not a handler")
+
+    fields['hosts'] = resolve_hosts(fields.get('hosts'), inventory, errors, label)
+    return PlanTask(fields)
+
+def compile_plan(playbook, inventory, upload_dir=FILES_TO_UPLOAD_DIR):
+    """Validate a parsed playbook and inventory and compile them into a Plan.
+
+    A Plan is returned unchanged, so callers can accept either form.
+
+    ``inventory`` may be a parsed inventory file or an Inventory. The local
+    files of upload and upload_tree tasks are looked up in ``upload_dir``.
+
+    Raises:
+        PlanError: Listing every problem found in the playbook and inventory.
+    """
+    if isinstance(playbook, Plan):
+        return playbook
+
+    try:
+        inventory = load_inventory(inventory)
+    except InventoryError as e:
+        raise PlanError([f"Inventory: {e}"])
+    tasks = playbook.get('tasks') if isinstance(playbook, dict) else None
+    if not isinstance(tasks, list):
+        raise PlanError(["Playbook has no 'tasks' list"])
+    handlers = playbook.get('handlers') or []
+    if not isinstance(handlers, list):
+        raise PlanError(["Playbook 'handlers' must be a list"])
+
+    errors = []
+    task_names = {task.get('name') for task in tasks if isinstance(task, dict)}
+    plan_handlers = []
+    handler_names = set()
+    for index, handler in enumerate(handlers):
+        plan_handler = compile_task(handler, index, inventory, set(), errors, kind='Handler',
+                                    upload_dir=upload_dir)
+        name = plan_handler.get('name') if plan_handler else None
+        if name in handler_names:
+            errors.append(f"Handler {index + 1} '{name}': another handler has the same name")
+        elif name in task_names:
+            errors.append(f"Handler {index + 1} '{name}': a task has the same name")
+        if name:
+            handler_names.add(name)
+        plan_handlers.append(plan_handler)
+
+    plan_tasks = []
+    earlier_names = set()
+    for index, task in enumerate(tasks):
+        plan_tasks.append(compile_task(task, index, inventory, earlier_names, errors, handler_names,
+                                       upload_dir=upload_dir))
+        if isinstance(task, dict):
+            earlier_names.add(task.get('name'))
+    if errors:
+        raise PlanError(errors)
+    return Plan(plan_tasks, inventory, tuple(plan_handlers))
+
+class PlanCache:
+    """Compiled plans on disk, keyed by the content of the files they were compiled from.
+
+    Only a plan's tasks and handlers are stored; loaded plans have no
+    inventory until the caller attaches the freshly parsed one. Plans are
+    pickled, so the cache directory is created with mode 0700, files are
+    written with mode 0600, and nothing is loaded from a directory or file
+    that another user owns or can write to.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_PLAN_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def key(playbook_path, inventory_path, data_provider, upload_dir=FILES_TO_UPLOAD_DIR):
+        """Return the cache key for a playbook and inventory read by ``data_provider``."""
+        digest = hashlib.sha256(f"{PLAN_FORMAT_VERSION}\0{type(data_provider).__qualname__}\0"
+                                f"{os.path.abspath(upload_dir)}\0".encode('utf-8'))
+        for path in (playbook_path, inventory_path):
+            with open(path, 'rb') as file:
+                content = file.read()
+            digest.update(len(content).to_bytes(8, 'big'))
+            digest.update(content)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pickle")
+
+    @staticmethod
+    def _trusted(file_stat):
+        return file_stat.st_uid == os.getuid() and not file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+    def load(self, key):
+        """Return the cached plan for ``key``, without its inventory.
+
+        Returns None if there is no trusted cache entry or the plan's local files are gone.
+        """
+        try:
+            if not self._trusted(os.stat(self.cache_dir)):
+                logger.warning("Ignoring plan cache %s: it is writable by other users", self.cache_dir)
+                return None
+            with open(self._path(key), 'rb') as file:
+                if not self._trusted(os.fstat(file.fileno())):
+                    logger.warning("Ignoring cached plan %s: it is writable by other users", self._path(key))
+                    return None
+                plan = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug("Ignoring unreadable cached plan %s: %s", key, e)
+            return None
+        if not isinstance(plan, Plan) or not all(os.path.exists(path) for path in plan.local_paths()):
+            return None
+        return plan
+
+    def save(self, key, plan):
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            path = self._path(key)
+            temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(Plan(plan.tasks, None, plan.handlers), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logger.warning("Could not write plan cache %s: %s", self.cache_dir, e)
+
+def load_plan(playbook_path, inventory_path, data_provider, cache=None, upload_dir=FILES_TO_UPLOAD_DIR):
+    """Return the Plan for a playbook and inventory file, compiling it only on a cache miss.
+
+    Upload paths are resolved against ``upload_dir``, see compile_plan.
+
+    Raises:
+        PlanError: If the playbook or inventory fails validation.
+    """
+    key = None
+    if cache:
+        key = cache.key(playbook_path, inventory_path, data_provider, upload_dir)
+        plan = cache.load(key)
+        if plan:
+            logger.debug("Using cached plan %s for %s", key[:12], playbook_path)
+            plan.inventory = load_inventory(data_provider.parse_inventory(inventory_path))
+            return plan
+
+    plan = compile_plan(data_provider.parse_playbook(playbook_path), data_provider.parse_inventory(inventory_path),
+                        upload_dir)
+    if cache:
+        cache.save(key, plan)
+    return plan
+
+# Example usage:
+# plan = load_plan('playbook.yml', 'inventory.yml', YAMLDataProvider(), PlanCache())
+# for task in plan.tasks:
+#     print(task['name'], task.hosts, [plan.inventory.host_vars(host) for host in task.hosts])
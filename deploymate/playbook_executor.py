@@ -1,15 +1,34 @@
 # playbook_executor.py
 
 import logging
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from deploymate import tracing
+from deploymate.log_pipeline import log_context
 from deploymate.utils import yaml_parser
-from deploymate.resource_handler_factory import TaskResourceHandlerFactory
-from deploymate.utils.ssh_module import SSHConnection, SSHConnectionManager, SSHConnectionError
+from deploymate.resource_handler_factory import TaskResourceHandlerFactory, handler_registry
+from deploymate.inventory import load_inventory
+from deploymate.paths import FILES_TO_UPLOAD_DIR
+from deploymate.plan import PlanTask, PlanCache, compile_plan, load_plan, DEFAULT_PLAN_CACHE_DIR
+from deploymate.script_compiler import is_compilable_task, run_compiled_tasks
+from deploymate.run_state import RunState, DEFAULT_RUN_STATE_DIR
+from deploymate.strategies import (STRATEGY_LINEAR, STRATEGY_FREE, STRATEGY_GRAPH, STRATEGIES, FailureTracker,
+                                   host_batches)
+from deploymate.task_graph import build_task_graph, run_task_graph, DEFAULT_HOST_CONCURRENCY
+from deploymate.templates import TemplateRenderer, is_template_task
+from deploymate.run_report import (RunReport, TaskResult, STATUS_OK, STATUS_CHANGED, STATUS_SKIPPED, STATUS_FAILED,
+                                   STATUS_UNREACHABLE)
+from deploymate.utils.ssh_module import (SSHConnectionManager, SSHConnectionError, DEFAULT_CONNECT_TIMEOUT, DEFAULT_AUTH_TIMEOUT,
+                                         DEFAULT_MAX_PARALLEL_CONNECTS)
+from deploymate.utils.command_output import DEFAULT_MAX_OUTPUT_BYTES
+from deploymate.utils.apt_state import DEFAULT_APT_FRESHNESS_WINDOW
+from deploymate.facts import (FactCache, FactGatheringError, requested_paths, load_or_gather_facts,
+                              host_cache_key, DEFAULT_FACT_CACHE_DIR, DEFAULT_FACT_CACHE_TTL)
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Number of hosts a task is executed on concurrently unless overridden
+DEFAULT_FORKS = 5
 
 # Data provider interface
 class DataProvider:
@@ -28,69 +47,474 @@ class YAMLDataProvider(DataProvider):
         return yaml_parser.parse_inventory(path)
 
 def execute_task_on_single_host(task, ssh_client):
-    """Execute a given task on a single host using an SSH client."""
-    logger.debug(f"Starting execution of task: {task['name']} on host")
+    """Execute a given task on a single host using an SSH client.
 
+    Returns the handler output. Errors raised by the handler are propagated so
+    the caller can record them against the host instead of logging them inline.
+    """
     resource_type = task['type']
-    logger.debug(f"Resource type: {resource_type}")
-
     handler = TaskResourceHandlerFactory.create_resource_handler(resource_type)
-    logger.debug(f"Handler: {handler}")
 
-    logger.debug(f"Executing task: {task['name']} with type {resource_type}")
-    try:
+    logger.debug("Executing task: %s with type %s", task['name'], resource_type)
+    action = task.get('action')
+    with tracing.span(f"{resource_type}.{action}" if action else resource_type, tracing.CATEGORY_HANDLER):
         output = handler.execute(task, ssh_client)
-        logger.debug(f"Task execution completed: {task['name']}")
-        logger.debug(f"Handler output: {output}")
+    logger.debug("Task execution completed: %s", task['name'])
+    return output
+
+def run_task_on_host(task, host_name, ssh_client):
+    """Execute a task on one host and wrap the outcome in a TaskResult.
+
+    Handlers return STATUS_OK when the host was already in the desired state;
+    any other return value counts as a change.
+    """
+    try:
+        output = execute_task_on_single_host(task, ssh_client)
+        status = STATUS_OK if output == STATUS_OK else STATUS_CHANGED
+        return TaskResult(host_name, task['name'], status, output=output)
     except Exception as e:
-        logger.error(f"Error executing task '{task['name']}': {e}")
-
-def execute_playbook(playbook, inventory):
-    """Execute tasks defined in a playbook for hosts in the inventory."""
-    connection_manager = SSHConnectionManager()
-
-    # Base directory for the SSH key (assumes this script is in the same directory as the config folder)
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-
-    # Establish connections to all hosts
-    for host_name, host_info in inventory['all']['hosts'].items():
-        if 'ssh_private_key_file' in host_info:
-            # Construct the absolute path for the SSH key file
-            relative_key_path = host_info.pop('ssh_private_key_file').lstrip('./')
-            ssh_key_path = os.path.join(base_dir, 'config', relative_key_path)
-            host_info['key_file'] = ssh_key_path
-
-        try:
-            connection = SSHConnection(**host_info)
-            connection.connect()
-            connection_manager.connections[host_name] = connection
-        except SSHConnectionError as e:
-            logger.error(f"Failed to establish SSH connection: {e}")
-
-    # Execute tasks on the appropriate hosts
-    for task in playbook['tasks']:
-        target_hosts = task.get('hosts', [])
-        
-        # Check if 'all' is specified in hosts, if so, target all hosts
-        if 'all' in target_hosts or not target_hosts:
-            target_hosts = inventory['all']['hosts'].keys()
-
-        for host_name in target_hosts:
+        return TaskResult(host_name, task['name'], STATUS_FAILED, error=str(e))
+
+def is_batchable_package_task(task):
+    return (task.get('type') == 'package'
+            and task.get('action') in handler_registry.handler_class('package').BATCHABLE_ACTIONS)
+
+def group_tasks_into_steps(tasks, batch_packages=True, compile_scripts=False):
+    """Split a task list into steps, each a list of tasks run together.
+
+    With ``batch_packages``, adjacent package tasks with the same action share
+    a step so they become a single apt-get transaction. With
+    ``compile_scripts``, adjacent shell-only tasks share a step so each host
+    runs them as one compiled script. Every other task is a step of its own.
+    """
+    steps = []
+    for task in tasks:
+        previous = steps[-1][0] if steps else None
+        if (batch_packages and previous and is_batchable_package_task(task)
+                and is_batchable_package_task(previous) and previous['action'] == task['action']):
+            steps[-1].append(task)
+        elif compile_scripts and previous and is_compilable_task(task) and is_compilable_task(previous):
+            steps[-1].append(task)
+        else:
+            steps.append([task])
+    return steps
+
+def run_step_on_host(step, host_name, ssh_client, failures=None):
+    """Execute the tasks of one step on one host and return a TaskResult per task.
+
+    Every result carries the step's wall time as its ``duration``, and the
+    result of a task that changed the host the handlers it notifies. A
+    compiled step stops early if one of its tasks aborts the run through
+    ``failures`` (see run_compiled_tasks).
+    """
+    name = step[0]['name'] if len(step) == 1 else f"{step[0]['name']} (+{len(step) - 1} more)"
+    start = time.perf_counter()
+    with log_context(host_name, name), tracing.span(name, tracing.CATEGORY_TASK, host=host_name, task=name,
+                                                    tasks=len(step)):
+        results = _run_step_on_host(step, host_name, ssh_client, failures)
+    duration = time.perf_counter() - start
+    for task, result in zip(step, results):
+        result.duration = duration
+        if result.status == STATUS_CHANGED and task.get('notify'):
+            result.notify = task['notify']
+    return results
+
+def _run_step_on_host(step, host_name, ssh_client, failures):
+    if len(step) == 1:
+        return [run_task_on_host(step[0], host_name, ssh_client)]
+    if is_compilable_task(step[0]):
+        return run_compiled_tasks(step, host_name, ssh_client, failures)
+
+    handler = TaskResourceHandlerFactory.create_resource_handler('package')
+    try:
+        with tracing.span(f"package.{step[0].get('action')} batch", tracing.CATEGORY_HANDLER):
+            outcomes = handler.execute_batch(step, ssh_client)
+    except Exception as e:
+        outcomes = [(task, None, e) for task in step]
+
+    results = []
+    for task, status, error in outcomes:
+        if error is None:
+            results.append(TaskResult(host_name, task['name'], status))
+        else:
+            results.append(TaskResult(host_name, task['name'], STATUS_FAILED, error=str(error)))
+    return results
+
+def resolve_target_hosts(task, inventory):
+    """Return the inventory host names a task should run on.
+
+    Raises:
+        InventoryError: If the task's hosts pattern matches nothing.
+    """
+    if isinstance(task, PlanTask):
+        # Resolved and checked against the inventory when the plan was compiled
+        return list(task.hosts)
+    return list(load_inventory(inventory).resolve(task.get('hosts')))
+
+def split_step_by_host(step, inventory):
+    """Return (host_name, tasks) pairs with the tasks of a step that target each host."""
+    inventory = load_inventory(inventory)
+    host_steps = {}
+    for task in step:
+        for host_name in resolve_target_hosts(task, inventory):
+            host_steps.setdefault(host_name, []).append(task)
+    return host_steps.items()
+
+def tasks_by_host(tasks, inventory):
+    """Return a mapping of host name to the tasks targeting it, in playbook order."""
+    inventory = load_inventory(inventory)
+    host_tasks = {host_name: [] for host_name in inventory.host_names}
+    for task in tasks:
+        for host_name in resolve_target_hosts(task, inventory):
+            host_tasks[host_name].append(task)
+    return host_tasks
+
+def gather_facts_for_host(host_name, ssh_client, tasks, fact_cache=None):
+    """Attach HostFacts to a connection, leaving it without facts if gathering fails."""
+    try:
+        with log_context(host_name), tracing.span('gather facts', tracing.CATEGORY_FACTS, host=host_name):
+            ssh_client.facts = load_or_gather_facts(ssh_client, requested_paths(tasks), fact_cache)
+    except (FactGatheringError, SSHConnectionError) as e:
+        logger.warning("Could not gather facts for %s, running its tasks without them: %s", host_name, e)
+
+def build_connection_params(inventory):
+    """Return SSHConnection keyword arguments for every inventory host.
+
+    Host and group variables are merged per host, and relative
+    ``ssh_private_key_file`` paths are resolved against the config directory
+    and passed on as ``key_file``; see deploymate.inventory.
+    """
+    return load_inventory(inventory).connection_params()
+
+def skip_tasks(host_name, tasks, report, reason):
+    """Record every task in ``tasks`` as skipped on a host."""
+    for task in tasks:
+        report.add(TaskResult(host_name, task['name'], STATUS_SKIPPED, error=reason))
+
+def record_results(results, report, failures):
+    for result in results:
+        report.add(result)
+        failures.record(result)
+
+def run_batch_linear(steps, batch, host_tasks, inventory, connection_manager, executor, report, failures):
+    """Run the steps on the hosts of a batch, finishing each step everywhere before the next one.
+
+    A host only runs the tasks of a step that are in its ``host_tasks`` list.
+    """
+    pending = {host_name: {id(task) for task in host_tasks[host_name]} for host_name in batch}
+
+    def batch_steps(step):
+        for host_name, host_step in split_step_by_host(step, inventory):
+            if host_name in pending:
+                host_step = [task for task in host_step if id(task) in pending[host_name]]
+                if host_step:
+                    yield host_name, host_step
+
+    for index, step in enumerate(steps):
+        host_steps = list(batch_steps(step))
+        if failures.aborted:
+            for remaining_step in steps[index:]:
+                for host_name, host_step in batch_steps(remaining_step):
+                    skip_tasks(host_name, host_step, report, failures.reason)
+            return
+
+        futures = []
+        for host_name, host_step in host_steps:
             ssh_client = connection_manager.connections.get(host_name)
             if ssh_client:
+                futures.append(executor.submit(run_step_on_host, host_step, host_name, ssh_client, failures))
+            else:
+                error = connection_manager.failed_hosts.get(host_name, "No SSH connection to host")
+                record_results([TaskResult(host_name, task['name'], STATUS_UNREACHABLE, error=error)
+                                for task in host_step], report, failures)
+
+        # Wait for the step to finish everywhere before starting the next one
+        for future in futures:
+            record_results(future.result(), report, failures)
+
+def run_host_free(host_name, ssh_client, host_steps, report, failures):
+    """Run one host's steps in order without waiting for other hosts."""
+    for index, step in enumerate(host_steps):
+        if failures.aborted:
+            skip_tasks(host_name, [task for remaining_step in host_steps[index:] for task in remaining_step],
+                       report, failures.reason)
+            return
+        record_results(run_step_on_host(step, host_name, ssh_client, failures), report, failures)
+
+def run_batch_free(batch, host_tasks, connection_manager, executor, report, failures, batch_packages,
+                   compile_scripts):
+    """Run the tasks of every host in a batch, each host working through its list independently."""
+    futures = []
+    for host_name in batch:
+        tasks = host_tasks[host_name]
+        ssh_client = connection_manager.connections.get(host_name)
+        if ssh_client:
+            host_steps = group_tasks_into_steps(tasks, batch_packages, compile_scripts)
+            futures.append(executor.submit(run_host_free, host_name, ssh_client, host_steps, report, failures))
+        else:
+            error = connection_manager.failed_hosts.get(host_name, "No SSH connection to host")
+            record_results([TaskResult(host_name, task['name'], STATUS_UNREACHABLE, error=error) for task in tasks],
+                           report, failures)
+    for future in futures:
+        future.result()
+
+def run_host_graph(host_name, ssh_client, steps, dependencies, report, failures, host_concurrency):
+    """Run one host's steps as a task graph, independent steps at the same time."""
+    def run_step(index):
+        record_results(run_step_on_host(steps[index], host_name, ssh_client, failures), report, failures)
+
+    not_started = run_task_graph(dependencies, run_step, host_concurrency, lambda: failures.aborted)
+    skip_tasks(host_name, [task for index in not_started for task in steps[index]], report, failures.reason)
+
+def run_batch_graph(batch, host_tasks, connection_manager, executor, report, failures, batch_packages,
+                    compile_scripts, host_concurrency, graph_cache):
+    """Run the task graph of every host in a batch, each host independently.
+
+    Hosts with the same task list share one graph through ``graph_cache``.
+    """
+    futures = []
+    for host_name in batch:
+        tasks = host_tasks[host_name]
+        ssh_client = connection_manager.connections.get(host_name)
+        if not ssh_client:
+            error = connection_manager.failed_hosts.get(host_name, "No SSH connection to host")
+            record_results([TaskResult(host_name, task['name'], STATUS_UNREACHABLE, error=error) for task in tasks],
+                           report, failures)
+            continue
+
+        key = tuple(id(task) for task in tasks)
+        if key not in graph_cache:
+            steps = group_tasks_into_steps(tasks, batch_packages, compile_scripts)
+            graph_cache[key] = (steps, build_task_graph(steps))
+        steps, dependencies = graph_cache[key]
+        futures.append(executor.submit(run_host_graph, host_name, ssh_client, steps, dependencies, report, failures,
+                                       host_concurrency))
+    for future in futures:
+        future.result()
+
+def notified_handlers(handler_hosts, host_name, report):
+    """Return the handlers to run on a host, given (handler, target host names) pairs in playbook order."""
+    notified = report.notified_handlers(host_name)
+    return [handler for handler, hosts in handler_hosts if handler['name'] in notified and host_name in hosts]
+
+def run_batch_handlers(handlers, batch, inventory, connection_manager, executor, report, failures, batch_packages,
+                       compile_scripts):
+    """Run on each host of a batch the handlers its tasks notified, once each and in playbook order.
+
+    A host that failed a task or became unreachable skips its handlers, as
+    does every host once the run is aborted.
+    """
+    futures = []
+    handler_hosts = [(handler, set(resolve_target_hosts(handler, inventory))) for handler in handlers]
+    for host_name in batch:
+        host_handlers = notified_handlers(handler_hosts, host_name, report)
+        if not host_handlers:
+            continue
+        ssh_client = connection_manager.connections.get(host_name)
+        if host_name in failures.failed_hosts or not ssh_client:
+            skip_tasks(host_name, host_handlers, report, "Host failed before its handlers ran")
+            continue
+        host_steps = group_tasks_into_steps(host_handlers, batch_packages, compile_scripts)
+        futures.append(executor.submit(run_host_free, host_name, ssh_client, host_steps, report, failures))
+    for future in futures:
+        future.result()
+
+def execute_playbook(playbook, inventory, forks=DEFAULT_FORKS, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                     auth_timeout=DEFAULT_AUTH_TIMEOUT, max_parallel_connects=DEFAULT_MAX_PARALLEL_CONNECTS,
+                     max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, output_spill_dir=None, batch_packages=True,
+                     gather_facts=False, fact_cache_dir=DEFAULT_FACT_CACHE_DIR, fact_cache_ttl=DEFAULT_FACT_CACHE_TTL,
+                     apt_freshness_window=DEFAULT_APT_FRESHNESS_WINDOW, compile_scripts=False, agent_socket=None,
+                     strategy=STRATEGY_LINEAR, serial=None, max_fail_percentage=None,
+                     host_concurrency=DEFAULT_HOST_CONCURRENCY, run_state=None, resume=False, changed_only=False):
+    """Execute tasks defined in a playbook for hosts in the inventory.
+
+    ``playbook`` is a parsed playbook or a Plan; a parsed playbook is
+    compiled against the inventory first, so invalid tasks are reported
+    before any host is contacted.
+
+    Each task is run on up to ``forks`` hosts concurrently. With the linear
+    ``strategy``, a task only starts once the previous task has finished on
+    every host; with the free strategy, each host works through its tasks
+    without waiting for the others. Either way each host sees its tasks in
+    playbook order. The graph strategy is free, but also runs up to
+    ``host_concurrency`` tasks of a host at once, each on its own channel,
+    when neither depends on the other (see deploymate.task_graph). With
+    ``batch_packages``, adjacent package tasks with the same action run as
+    one apt-get transaction per host.
+
+    With ``serial`` (a host count, a percentage such as '25%', or a list of
+    them, see deploymate.strategies.host_batches), hosts are processed in
+    rolling batches: a batch is connected, runs every task and is
+    disconnected before the next batch starts. Once more than
+    ``max_fail_percentage`` of a batch's hosts have failed, no further tasks
+    are started and the remaining tasks are reported as skipped. Without
+    ``serial``, all hosts form one batch.
+
+    Connections are opened concurrently at the start of each batch; see
+    SSHConnectionManager.establish_connections for the timeout semantics.
+    ``max_output_bytes`` and ``output_spill_dir`` bound the command output
+    handlers keep in memory, see SSHConnection.run_command.
+
+    With ``gather_facts``, the installed packages, service states and paths
+    of each host are collected up front (or read from a cache younger than
+    ``fact_cache_ttl`` seconds) so handlers can skip tasks that are already
+    in the desired state.
+
+    ``apt_freshness_window`` is the number of seconds after a refresh of a
+    host's apt package lists during which further apt-get updates are skipped.
+
+    With ``compile_scripts``, consecutive shell-only tasks (commands,
+    directories, services, updates and file deletes) run on
+    each host as one remote script instead of one command per task; see
+    deploymate.script_compiler.
+
+    With ``agent_socket``, SSH sessions are taken from the connection agent
+    listening on that Unix socket, which keeps them open for later runs.
+
+    With a ``run_state`` (see deploymate.run_state), every task outcome is
+    journaled as it happens. ``resume`` then skips the tasks each host
+    completed in the previous run up to its first failure, and
+    ``changed_only`` skips every task whose fingerprint last succeeded on
+    the host; skipped tasks are reported with STATUS_SKIPPED.
+
+    Handlers (see Plan.handlers) run on each host after all of its tasks
+    in the batch, once per handler that a task changing the host notified.
+    With a ``run_state``, a notification stays pending until its handler
+    succeeds, and later runs notify the handler again.
+
+    File template tasks are rendered for every host of a batch on a
+    worker pool while the batch connects, see deploymate.templates.
+
+    Returns:
+        RunReport: The per-host results of every task.
+
+    Raises:
+        PlanError: If the playbook or inventory fails validation.
+        ValueError: If an option is out of range.
+    """
+    if forks < 1:
+        raise ValueError(f"forks must be at least 1, got {forks}")
+    if strategy not in STRATEGIES:
+        raise ValueError(f"strategy must be one of {', '.join(STRATEGIES)}, got '{strategy}'")
+    if host_concurrency < 1:
+        raise ValueError(f"host_concurrency must be at least 1, got {host_concurrency}")
+    if (resume or changed_only) and run_state is None:
+        raise ValueError("resume and changed_only need a run_state")
+    failures = FailureTracker(max_fail_percentage)
+    plan = compile_plan(playbook, inventory)
+    inventory = plan.inventory
+
+    host_tasks = tasks_by_host(plan.tasks, inventory)
+    report = RunReport(on_result=run_state.record if run_state else None)
+    if run_state:
+        run_state.begin_run(plan.tasks, inventory, plan.handlers)
+        reason = "Already applied in an earlier run"
+        for host_name, tasks in host_tasks.items():
+            skipped = run_state.tasks_to_skip(host_name, tasks, resume, changed_only)
+            if skipped:
+                skip_tasks(host_name, skipped, report, reason)
+                skipped_ids = {id(task) for task in skipped}
+                host_tasks[host_name] = [task for task in tasks if id(task) not in skipped_ids]
+            pending = run_state.pending_notifications(host_name)
+            if pending:
+                logger.info("Handlers notified on %s in an earlier run have not run yet: %s", host_name,
+                            ', '.join(sorted(pending)))
+                report.add_notifications(host_name, pending)
+        if report.results:
+            logger.info("Skipping %s tasks already applied in an earlier run", len(report.results))
+    # Hosts with nothing left to do still connect to run the handlers pending on them
+    batches = host_batches([host_name for host_name, tasks in host_tasks.items()
+                            if tasks or report.notified_handlers(host_name)], serial)
+    steps = group_tasks_into_steps(plan.tasks, batch_packages, compile_scripts)
+    connection_params = build_connection_params(inventory)
+    fact_cache = FactCache(fact_cache_dir, fact_cache_ttl) if gather_facts else None
+    graph_cache = {}
+    has_templates = any(is_template_task(task) for task in (*plan.tasks, *plan.handlers))
+
+    try:
+        with ThreadPoolExecutor(max_workers=forks) as executor:
+            for batch_number, batch in enumerate(batches, 1):
+                if failures.aborted:
+                    for host_name in batch:
+                        skip_tasks(host_name, host_tasks[host_name], report, failures.reason)
+                    continue
+                if len(batches) > 1:
+                    logger.info("Starting batch %s of %s (%s hosts)", batch_number, len(batches), len(batch))
+
+                connection_manager = SSHConnectionManager(connect_timeout=connect_timeout,
+                                                          auth_timeout=auth_timeout,
+                                                          max_parallel_connects=max_parallel_connects,
+                                                          connection_options={
+                                                              'max_output_bytes': max_output_bytes,
+                                                              'output_spill_dir': output_spill_dir,
+                                                              'apt_freshness_window': apt_freshness_window,
+                                                              'agent_socket': agent_socket,
+                                                          })
+                failures.begin_batch(batch)
+                renderer = None
                 try:
-                    execute_task_on_single_host(task, ssh_client)
-                except Exception as e:
-                    logger.error(f"Error executing task '{task['name']}' on host '{host_name}': {e}")
-
-    # Close all connections
-    connection_manager.close_all_connections()
-
-def execute_playbook_from_files(playbook_path, inventory_path, data_provider):
-    """Execute playbook from file paths using a specified data provider."""
-    playbook = data_provider.parse_playbook(playbook_path)
-    inventory = data_provider.parse_inventory(inventory_path)
-    execute_playbook(playbook, inventory)
+                    if has_templates:
+                        # Rendering runs while the batch connects
+                        renderer = TemplateRenderer(inventory)
+                        renderer.submit({host_name: host_tasks[host_name] for host_name in batch})
+                    # Establish connections to the hosts of the batch
+                    connection_manager.establish_connections({host_name: connection_params[host_name]
+                                                              for host_name in batch})
+                    if renderer:
+                        for host_name, ssh_client in connection_manager.connections.items():
+                            ssh_client.templates = renderer.for_host(host_name)
+                    if gather_facts:
+                        list(executor.map(
+                            lambda item: gather_facts_for_host(item[0], item[1], host_tasks[item[0]], fact_cache),
+                            connection_manager.connections.items()))
+
+                    if strategy == STRATEGY_FREE:
+                        run_batch_free(batch, host_tasks, connection_manager, executor, report, failures,
+                                       batch_packages, compile_scripts)
+                    elif strategy == STRATEGY_GRAPH:
+                        run_batch_graph(batch, host_tasks, connection_manager, executor, report, failures,
+                                        batch_packages, compile_scripts, host_concurrency, graph_cache)
+                    else:
+                        run_batch_linear(steps, batch, host_tasks, inventory, connection_manager, executor, report,
+                                         failures)
+                    if plan.handlers:
+                        run_batch_handlers(plan.handlers, batch, inventory, connection_manager, executor, report,
+                                           failures, batch_packages, compile_scripts)
+                finally:
+                    if fact_cache:
+                        # Facts were updated by the handlers as they made changes
+                        for ssh_client in connection_manager.connections.values():
+                            if ssh_client.facts:
+                                fact_cache.save(host_cache_key(ssh_client), ssh_client.facts)
+
+                    # Close the batch's connections
+                    connection_manager.close_all_connections()
+                    if renderer:
+                        renderer.close()
+    finally:
+        if run_state:
+            run_state.end_run()
+
+    report.log_summary()
+    if failures.aborted:
+        logger.error(failures.reason)
+    return report
+
+def execute_playbook_from_files(playbook_path, inventory_path, data_provider, plan_cache_dir=DEFAULT_PLAN_CACHE_DIR,
+                                run_state_dir=DEFAULT_RUN_STATE_DIR, upload_dir=FILES_TO_UPLOAD_DIR, **options):
+    """Execute playbook from file paths using a specified data provider.
+
+    Upload tasks name their local files relative to ``upload_dir``. The
+    compiled plan is cached in ``plan_cache_dir`` (None disables the
+    cache), so unchanged files are not parsed or validated again. Task
+    outcomes are journaled in ``run_state_dir`` (None disables the journal)
+    for the ``resume`` and ``changed_only`` options. Other keyword options
+    are passed through to execute_playbook.
+    """
+    plan = load_plan(playbook_path, inventory_path, data_provider, PlanCache(plan_cache_dir) if plan_cache_dir else None,
+                     upload_dir)
+    run_state = RunState(run_state_dir, playbook_path, inventory_path) if run_state_dir else None
+    return execute_playbook(plan, plan.inventory, run_state=run_state, **options)
 
 # Example usage (commented out)
 # yaml_data_provider = YAMLDataProvider()
@@ -1,13 +1,25 @@
 # resource_handler_factory.py
 
-# Importing the specific handler classes
-from deploymate.handlers.package_handler import PackageHandler
+import importlib
+import logging
+import threading
 
-from deploymate.handlers.file_handler import FileHandler
-from deploymate.handlers.service_handler import ServiceHandler
-from deploymate.handlers.update_handler import UpdateHandler
-from deploymate.handlers.directory_handler import DirectoryHandler
-from deploymate.handlers.command_handler import CommandHandler
+logger = logging.getLogger(__name__)
+
+# Entry point group third-party packages use to provide handlers, e.g. in pyproject.toml:
+#   [project.entry-points."deploymate.handlers"]
+#   docker = "deploymate_docker.handler:DockerHandler"
+HANDLER_ENTRY_POINT_GROUP = 'deploymate.handlers'
+
+# Built-in handlers as 'module:Class' references; a module is only imported when its type is first used
+BUILTIN_HANDLERS = {
+    'package': 'deploymate.handlers.package_handler:PackageHandler',
+    'file': 'deploymate.handlers.file_handler:FileHandler',
+    'service': 'deploymate.handlers.service_handler:ServiceHandler',
+    'update': 'deploymate.handlers.update_handler:UpdateHandler',
+    'directory': 'deploymate.handlers.directory_handler:DirectoryHandler',
+    'command': 'deploymate.handlers.command_handler:CommandHandler',
+}
 
 class UnknownResourceTypeError(Exception):
     """Exception raised for unknown resource types."""
@@ -15,34 +27,116 @@ class UnknownResourceTypeError(Exception):
         self.message = f"Unknown resource type: {resource_type}"
         super().__init__(self.message)
 
+def _import_reference(reference):
+    module_name, _, class_name = reference.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+class HandlerRegistry:
+    """Maps resource types to handler classes that are imported on first use.
+
+    Handlers are declared as classes, 'module:Class' strings, or entry points
+    in the HANDLER_ENTRY_POINT_GROUP group; entry points are only scanned
+    when a type is not declared otherwise. Handler instances are cached and
+    shared, since handlers keep no per-task state; a handler class can set
+    ``stateless = False`` to get a new instance for every task instead.
+    """
+
+    def __init__(self, handlers=None, entry_point_group=HANDLER_ENTRY_POINT_GROUP):
+        self._declared = dict(handlers or {})
+        self._entry_point_group = entry_point_group
+        self._entry_points_loaded = False
+        self._classes = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def register(self, resource_type, handler):
+        """Declare the handler for a resource type, replacing any earlier one.
+
+        Args:
+            resource_type (str): The task ``type`` the handler serves.
+            handler: A handler class or a 'module:Class' reference.
+        """
+        with self._lock:
+            self._declared[resource_type] = handler
+            self._classes.pop(resource_type, None)
+            self._instances.pop(resource_type, None)
+
+    def _load_entry_points(self):
+        # Called with the lock held; declared handlers take precedence
+        self._entry_points_loaded = True
+        if not self._entry_point_group:
+            return
+        # Imported here because importlib.metadata alone costs more than the registry
+        import importlib.metadata
+        for entry_point in importlib.metadata.entry_points(group=self._entry_point_group):
+            if entry_point.name not in self._declared:
+                self._declared[entry_point.name] = entry_point
+                logger.debug("Found handler for '%s' in entry point %s", entry_point.name, entry_point.value)
+
+    def handler_class(self, resource_type):
+        """Return the handler class for a resource type, importing it if needed.
+
+        Raises:
+            UnknownResourceTypeError: If no handler is declared for the type.
+        """
+        handler_class = self._classes.get(resource_type)
+        if handler_class is not None:
+            return handler_class
+
+        with self._lock:
+            if resource_type not in self._declared and not self._entry_points_loaded:
+                self._load_entry_points()
+            declared = self._declared.get(resource_type)
+            if declared is None:
+                raise UnknownResourceTypeError(resource_type)
+            if isinstance(declared, str):
+                handler_class = _import_reference(declared)
+            elif hasattr(declared, 'load'):
+                # An importlib.metadata.EntryPoint
+                handler_class = declared.load()
+            else:
+                handler_class = declared
+            self._classes[resource_type] = handler_class
+        return handler_class
+
+    def get(self, resource_type):
+        """Return a handler instance for a resource type, shared unless the handler is stateful."""
+        handler = self._instances.get(resource_type)
+        if handler is not None:
+            return handler
+
+        handler_class = self.handler_class(resource_type)
+        if not getattr(handler_class, 'stateless', True):
+            return handler_class()
+        with self._lock:
+            return self._instances.setdefault(resource_type, handler_class())
+
+    def types(self):
+        """Return every declared resource type, including those from entry points."""
+        with self._lock:
+            if not self._entry_points_loaded:
+                self._load_entry_points()
+            return sorted(self._declared)
+
+# Process-wide registry used by the executors
+handler_registry = HandlerRegistry(BUILTIN_HANDLERS)
+
 class TaskResourceHandlerFactory:
     @staticmethod
     def create_resource_handler(resource_type):
-        """Create and return a handler object based on the resource type.
+        """Return the handler object for a resource type.
 
         Args:
             resource_type (str): The type of the resource (e.g., 'package', 'file').
 
         Returns:
-            object: An instance of the corresponding handler class.
+            object: The shared instance of the corresponding handler class.
 
         Raises:
             UnknownResourceTypeError: If an unknown resource type is provided.
         """
-        if resource_type == 'package':
-            return PackageHandler()
-        elif resource_type == 'file':
-            return FileHandler()
-        elif resource_type == 'service':
-            return ServiceHandler()
-        elif resource_type == 'update':
-            return UpdateHandler()
-        elif resource_type == 'directory':
-            return DirectoryHandler()
-        elif resource_type == 'command':
-            return CommandHandler()
-        else:
-            raise UnknownResourceTypeError(resource_type)
+        return handler_registry.get(resource_type)
 
 # Example usage:
 # handler = TaskResourceHandlerFactory.create_resource_handler('package')
+# handler_registry.register('docker', 'deploymate_docker.handler:DockerHandler')
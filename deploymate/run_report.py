@@ -0,0 +1,118 @@
+# run_report.py
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Task succeeded without changing the host (e.g. it was already in the desired state)
+STATUS_OK = 'ok'
+# Task succeeded and changed the host
+STATUS_CHANGED = 'changed'
+# Task was not run on the host
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+STATUS_UNREACHABLE = 'unreachable'
+
+SUMMARY_STATUSES = (STATUS_OK, STATUS_CHANGED, STATUS_SKIPPED, STATUS_FAILED, STATUS_UNREACHABLE)
+
+class TaskResult:
+    """Outcome of a single task on a single host.
+
+    ``duration`` is the time in seconds the step that ran the task took on
+    the host; tasks run together as one step (a package batch or compiled
+    script) share it. It is None for tasks that did not run. ``notify``
+    names the handlers the task notified by changing the host.
+    """
+
+    def __init__(self, host_name, task_name, status, output=None, error=None, duration=None, notify=()):
+        self.host_name = host_name
+        self.task_name = task_name
+        self.status = status
+        self.output = output
+        self.error = error
+        self.duration = duration
+        self.notify = notify
+
+    def __repr__(self):
+        return f"TaskResult({self.host_name!r}, {self.task_name!r}, {self.status!r})"
+
+class RunReport:
+    """Collects per-host task results from a playbook run.
+
+    Results may be added from several worker threads at once, so all access
+    to the underlying list goes through a lock. ``on_result``, if given, is
+    called with every result as it is added, on the thread adding it.
+    """
+
+    def __init__(self, on_result=None):
+        self._lock = threading.Lock()
+        self.results = []
+        self.on_result = on_result
+        self._notified = {}
+
+    def add(self, result):
+        """Record a TaskResult."""
+        with self._lock:
+            self.results.append(result)
+            if result.notify:
+                self._notified.setdefault(result.host_name, set()).update(result.notify)
+        if self.on_result:
+            self.on_result(result)
+
+    def add_notifications(self, host_name, handler_names):
+        """Notify handlers on a host without a result, e.g. ones left pending by an earlier run."""
+        with self._lock:
+            self._notified.setdefault(host_name, set()).update(handler_names)
+
+    def notified_handlers(self, host_name):
+        """Return the names of the handlers that tasks changing a host notified."""
+        with self._lock:
+            return set(self._notified.get(host_name, ()))
+
+    def results_for_host(self, host_name):
+        """Return the results recorded for one host, in execution order."""
+        with self._lock:
+            return [result for result in self.results if result.host_name == host_name]
+
+    def failed_results(self):
+        """Return every result that did not complete successfully."""
+        with self._lock:
+            return [result for result in self.results if result.status in (STATUS_FAILED, STATUS_UNREACHABLE)]
+
+    def has_failures(self):
+        return bool(self.failed_results())
+
+    def totals(self):
+        """Return a {status: count} dictionary over all hosts."""
+        totals = dict.fromkeys(SUMMARY_STATUSES, 0)
+        with self._lock:
+            for result in self.results:
+                totals[result.status] = totals.get(result.status, 0) + 1
+        return totals
+
+    def host_summary(self):
+        """Return a mapping of host name to a {status: count} dictionary."""
+        summary = {}
+        with self._lock:
+            for result in self.results:
+                counts = summary.setdefault(result.host_name, {})
+                counts[result.status] = counts.get(result.status, 0) + 1
+        return summary
+
+    def log_summary(self):
+        """Log one line per host followed by the collected errors."""
+        logger.info("Run summary:")
+        for host_name, counts in sorted(self.host_summary().items()):
+            line = " ".join(f"{status}={counts.get(status, 0)}" for status in SUMMARY_STATUSES)
+            logger.info("  %s: %s", host_name, line)
+        totals = " ".join(f"{status}={count}" for status, count in self.totals().items())
+        logger.info("  total: %s", totals)
+
+        for result in self.failed_results():
+            logger.error("  %s | %s: %s", result.host_name, result.task_name, result.error)
+
+# Example usage:
+# report = RunReport()
+# report.add(TaskResult('testserver1', 'Install nginx', STATUS_OK))
+# report.log_summary()
@@ -0,0 +1,270 @@
+# run_state.py
+#
+# A journal of task outcomes per host, kept for each playbook and inventory
+# pair, so an interrupted or failed run can be picked up again. Each task is
+# identified by its name and fingerprinted by its definition, the content
+# of the local files it uploads and, for a template, the host variables the
+# template uses; outcomes are appended to the journal as they happen, so
+# the record survives a controller that dies mid-run. A later run can then
+# skip:
+#
+#   - with resume, the tasks a host completed in the previous run, up to
+#     the first one that failed, did not run or has changed since;
+#   - with changed_only, every task whose current fingerprint is the last
+#     one that succeeded on the host.
+#
+# Skipping trusts that nothing else changed the host in between; tasks
+# sharing a name with another task are always run.
+#
+# Handler notifications are journaled too. A notification stays pending on
+# its host until the handler succeeds there, and every later run notifies
+# the handler again, so a restart is not lost when the task that asked for
+# it is skipped as applied.
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+import time
+from deploymate.run_report import STATUS_OK, STATUS_CHANGED, STATUS_FAILED
+from deploymate.templates import TemplateError, get_template_cache, is_template_task, template_variables
+from deploymate.utils.digest_cache import get_digest_cache
+from deploymate.utils.tar_transfer import local_tree_entries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RUN_STATE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'deploymate', 'runs')
+
+# Task keys that decide where and when a task runs rather than what it does
+UNFINGERPRINTED_KEYS = ('name', 'hosts', 'depends_on', 'notify', 'local_paths')
+
+class RunStateError(Exception):
+    """Custom exception for run state errors."""
+    pass
+
+def tree_digest(local_dir):
+    """Return a SHA-256 digest over the names, modes, link targets and file contents of a local tree."""
+    entries = local_tree_entries(local_dir)
+    file_digests = get_digest_cache().digests(
+        [os.path.join(local_dir, entry) for entry in entries if os.path.isfile(os.path.join(local_dir, entry))
+         and not os.path.islink(os.path.join(local_dir, entry))])
+    digest = hashlib.sha256()
+    for entry in entries:
+        path = os.path.join(local_dir, entry)
+        mode = os.lstat(path).st_mode
+        if stat.S_ISLNK(mode):
+            content = f"link:{os.readlink(path)}"
+        elif path in file_digests:
+            content = file_digests[path]
+        else:
+            content = 'dir'
+        digest.update(f"{entry}\0{stat.S_IMODE(mode):o}\0{content}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def task_fingerprint(task):
+    """Return a digest of what a task does: its definition and the content of its local upload paths."""
+    definition = {key: task[key] for key in task.keys() if key not in UNFINGERPRINTED_KEYS}
+    local_paths = task.get('local_paths') or ()
+    file_digests = get_digest_cache().digests([path for path in local_paths if not os.path.isdir(path)])
+    inputs = [file_digests[path] if path in file_digests else tree_digest(path) for path in local_paths]
+    payload = json.dumps([definition, inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class RunState:
+    """The journal of one playbook and inventory pair, stored as JSON lines in ``state_dir``.
+
+    Call begin_run with the tasks of a run before asking what to skip;
+    outcomes are then recorded with record, which is safe to call from
+    several threads, and end_run closes the journal.
+    """
+
+    def __init__(self, state_dir, playbook_path, inventory_path):
+        self.state_dir = state_dir
+        key = hashlib.sha256(f"{os.path.abspath(playbook_path)}\0{os.path.abspath(inventory_path)}".encode('utf-8'))
+        self.path = os.path.join(state_dir, f"{key.hexdigest()}.jsonl")
+        self.playbook_path = playbook_path
+        # host -> {task name: fingerprint last applied successfully}
+        self.applied = {}
+        # host -> {task name: (fingerprint, status)} from the previous run
+        self.last_run = {}
+        # id(task) -> fingerprint, and the same by name for tasks with a unique name
+        self.fingerprints = {}
+        self._fingerprints_by_name = {}
+        # task name -> the variables its template uses, for template tasks with a unique name
+        self._template_variables = {}
+        # host -> names of the handlers notified but not yet run successfully
+        self.pending = {}
+        self._handler_names = set()
+        self.inventory = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            raise RunStateError(f"Could not read run state {self.path}: {e}")
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by a run that died while writing it
+                continue
+            if 'run' in entry:
+                self.last_run = {}
+            elif 'applied' in entry:
+                self.applied[entry['host']] = dict(entry['applied'])
+            elif 'pending' in entry:
+                self.pending[entry['host']] = set(entry['pending'])
+            elif 'notify' in entry:
+                self.pending.setdefault(entry['host'], set()).update(entry['notify'])
+            elif 'handled' in entry:
+                self.pending.get(entry['host'], set()).discard(entry['handled'])
+            else:
+                self._replay(entry['host'], entry['task'], entry['fingerprint'], entry['status'])
+
+    def _replay(self, host_name, task_name, fingerprint, status):
+        self.last_run.setdefault(host_name, {})[task_name] = (fingerprint, status)
+        applied = self.applied.setdefault(host_name, {})
+        if status in (STATUS_OK, STATUS_CHANGED):
+            applied[task_name] = fingerprint
+        else:
+            # A failed task may have left the host half changed
+            applied.pop(task_name, None)
+
+    def begin_run(self, tasks, inventory=None, handlers=()):
+        """Fingerprint a run's tasks, load the previous state and start a new run in the journal.
+
+        With the run's ``inventory``, the fingerprint of a template task on
+        a host also covers the host variables its template uses. Pending
+        notifications of handlers missing from ``handlers`` are dropped.
+
+        The journal is compacted to the tasks last applied and the handlers
+        pending on each host before the new run is appended to it.
+
+        Raises:
+            RunStateError: If the journal cannot be read or written.
+        """
+        self.fingerprints = {id(task): task_fingerprint(task) for task in tasks}
+        name_counts = {}
+        for task in tasks:
+            name_counts[task['name']] = name_counts.get(task['name'], 0) + 1
+        self._fingerprints_by_name = {task['name']: self.fingerprints[id(task)] for task in tasks
+                                      if name_counts[task['name']] == 1}
+        self.inventory = inventory
+        self._template_variables = {}
+        if inventory is not None:
+            for task in tasks:
+                if is_template_task(task) and task['name'] in self._fingerprints_by_name:
+                    try:
+                        variables = get_template_cache().get(task['local_paths'][0]).variables
+                    except TemplateError:
+                        # The task fails on every host, so its fingerprint never matches an applied one
+                        variables = ()
+                    self._template_variables[task['name']] = variables
+        self._handler_names = {handler['name'] for handler in handlers}
+        self._load()
+        self.pending = {host_name: names & self._handler_names for host_name, names in self.pending.items()
+                        if names & self._handler_names}
+
+        try:
+            os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+            temporary_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary_path, 'w') as file:
+                for host_name, applied in self.applied.items():
+                    if applied:
+                        file.write(json.dumps({'host': host_name, 'applied': applied}) + "\n")
+                for host_name, names in self.pending.items():
+                    file.write(json.dumps({'host': host_name, 'pending': sorted(names)}) + "\n")
+                file.write(json.dumps({'run': time.time(), 'playbook': os.path.abspath(self.playbook_path)}) + "\n")
+            os.replace(temporary_path, self.path)
+            self._file = open(self.path, 'a')
+        except OSError as e:
+            raise RunStateError(f"Could not write run state {self.path}: {e}")
+
+    def fingerprint(self, host_name, task_name):
+        """Return the fingerprint of a uniquely named task on a host, or None."""
+        fingerprint = self._fingerprints_by_name.get(task_name)
+        names = self._template_variables.get(task_name)
+        if fingerprint is None or not names:
+            return fingerprint
+        variables = template_variables(self.inventory, host_name)
+        payload = json.dumps([fingerprint, {name: variables.get(name) for name in names}], sort_keys=True,
+                             default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def pending_notifications(self, host_name):
+        """Return the names of the handlers an earlier run notified on a host that have not succeeded since."""
+        return set(self.pending.get(host_name, ()))
+
+    def tasks_to_skip(self, host_name, tasks, resume=False, changed_only=False):
+        """Return the tasks of a host that a resumed or changed-only run leaves out.
+
+        Skipped tasks are recorded as still applied, so a later resume also
+        treats them as done.
+        """
+        skipped = []
+        if resume:
+            previous = self.last_run.get(host_name, {})
+            for task in tasks:
+                fingerprint = self.fingerprint(host_name, task['name'])
+                if fingerprint is None or previous.get(task['name']) not in ((fingerprint, STATUS_OK),
+                                                                             (fingerprint, STATUS_CHANGED)):
+                    break
+                skipped.append(task)
+        if changed_only:
+            applied = self.applied.get(host_name, {})
+            skipped += [task for task in tasks[len(skipped):]
+                        if task['name'] in self._fingerprints_by_name
+                        and applied.get(task['name']) == self.fingerprint(host_name, task['name'])]
+
+        for task in skipped:
+            self._write({'host': host_name, 'task': task['name'],
+                         'fingerprint': self.fingerprint(host_name, task['name']), 'status': STATUS_OK})
+        return skipped
+
+    def record(self, result):
+        """Append a TaskResult to the journal; results of tasks that did not run are ignored.
+
+        The handlers a result notified stay pending until a result of the
+        handler itself succeeds on the host.
+        """
+        if result.notify:
+            self._write({'host': result.host_name, 'notify': list(result.notify)})
+        if result.task_name in self._handler_names and result.status in (STATUS_OK, STATUS_CHANGED):
+            self._write({'host': result.host_name, 'handled': result.task_name})
+        fingerprint = self.fingerprint(result.host_name, result.task_name)
+        if fingerprint is None or result.status not in (STATUS_OK, STATUS_CHANGED, STATUS_FAILED):
+            return
+        self._write({'host': result.host_name, 'task': result.task_name, 'fingerprint': fingerprint,
+                     'status': result.status})
+
+    def _write(self, entry):
+        line = json.dumps(entry)
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.write(line + "\n")
+                self._file.flush()
+            except OSError as e:
+                logger.warning("Could not record run state in %s: %s", self.path, e)
+
+    def end_run(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+# Example usage:
+# run_state = RunState(DEFAULT_RUN_STATE_DIR, 'playbook.yaml', 'inventory.yaml')
+# run_state.begin_run(plan.tasks, plan.inventory, plan.handlers)
+# skipped = run_state.tasks_to_skip('web1', host_tasks['web1'], resume=True)
+# run_state.record(TaskResult('web1', 'Install nginx', STATUS_CHANGED))
+# run_state.end_run()
@@ -0,0 +1,230 @@
+# script_compiler.py
+#
+# Runs consecutive shell-only tasks of one host as a single remote script.
+# Each task's command runs in its own subshell, framed by marker lines on
+# stdout and stderr that carry the task index, exit code and run time, so
+# the combined output can be split back into one result per task. A script
+# stops at the first task that exits non-zero; the tasks after it run in a
+# new script unless the failure aborted the run.
+
+import logging
+import os
+import secrets
+from deploymate.resource_handler_factory import TaskResourceHandlerFactory
+from deploymate.handlers.compiled_task import CompiledTask
+from deploymate.services import service_names
+from deploymate.run_report import TaskResult, STATUS_OK, STATUS_CHANGED, STATUS_SKIPPED, STATUS_FAILED
+from deploymate.utils.command_output import StreamCapture, CommandResult, DEFAULT_MAX_OUTPUT_BYTES
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_MARKER = '@@deploymate-task'
+
+# Task types (and, where only some qualify, their actions) that run as a single shell command
+COMPILABLE_TASKS = {
+    'command': None,
+    'directory': None,
+    'service': None,
+    'update': None,
+    'file': ('delete',),
+}
+
+def is_compilable_task(task):
+    """Return True if a task runs as one shell command and can be part of a compiled script."""
+    task_type = task.get('type')
+    if task_type not in COMPILABLE_TASKS:
+        return False
+    actions = COMPILABLE_TASKS[task_type]
+    return actions is None or task.get('action') in actions
+
+def task_state_keys(task):
+    """Return the host facts a task both decides on and changes.
+
+    A task is only compiled into the same script as earlier tasks if none of
+    them touch the same keys, so each skip decision sees the state left by
+    the tasks before it, as it does when tasks run one at a time.
+    """
+    task_type = task.get('type')
+    if task_type == 'directory' and task.get('directory_path'):
+        return {('path', os.path.normpath(task['directory_path']))}
+    if task_type == 'service' and task.get('service_name'):
+        return {('service', name) for name in service_names(task)}
+    if task_type == 'update' and task.get('action') == 'update':
+        return {('apt',)}
+    return set()
+
+def build_script(commands, marker):
+    """Return a shell script running ``commands`` in order, each framed by ``marker`` lines.
+
+    The script stops after the first command that exits non-zero.
+    """
+    lines = []
+    for index, command in enumerate(commands):
+        lines += [
+            f"echo '{marker} start {index}'; echo '{marker} start {index}' >&2",
+            "__deploymate_start=$(date +%s%N)",
+            "(",
+            command,
+            ") </dev/null",
+            "__deploymate_rc=$?",
+            "__deploymate_ms=$(( ($(date +%s%N) - __deploymate_start) / 1000000 ))",
+            # The leading newline ends a last output line that lacks one
+            f"printf '\\n{marker} end {index} %s %s\\n' \"$__deploymate_rc\" \"$__deploymate_ms\"",
+            f"printf '\\n{marker} end {index}\\n' >&2",
+            '[ "$__deploymate_rc" -eq 0 ] || exit 0',
+        ]
+    lines.append("exit 0")
+    return "\n".join(lines)
+
+class ScriptOutputParser:
+    """Splits the output of a compiled script into one CommandResult per task."""
+
+    def __init__(self, marker, commands, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, spill_dir=None):
+        self.marker = marker
+        self.commands = commands
+        self.current = {'stdout': None, 'stderr': None}
+        self.captures = [
+            {stream: StreamCapture(max_output_bytes, spill_dir, name=stream) for stream in ('stdout', 'stderr')}
+            for _ in commands
+        ]
+        self.exit_codes = [None] * len(commands)
+        self.durations = [None] * len(commands)
+
+    def add_line(self, stream, line):
+        """run_command line_callback routing each line to the task that printed it."""
+        if line.startswith(self.marker + ' '):
+            fields = line[len(self.marker) + 1:].split()
+            kind, index = fields[0], int(fields[1])
+            if kind == 'start':
+                self.current[stream] = index
+            else:
+                self.current[stream] = None
+                if stream == 'stdout':
+                    self.exit_codes[index] = int(fields[2])
+                    self.durations[index] = int(fields[3]) / 1000
+            return
+
+        index = self.current[stream]
+        if index is not None:
+            self.captures[index][stream].add(line)
+            logger.debug("task %s %s: %s", index, stream, line)
+
+    def results(self):
+        """Return a CommandResult per task, or None for tasks that did not finish."""
+        results = []
+        for index, command in enumerate(self.commands):
+            for capture in self.captures[index].values():
+                capture.close()
+            if self.exit_codes[index] is None:
+                results.append(None)
+            else:
+                results.append(CommandResult(command, self.captures[index]['stdout'], self.captures[index]['stderr'],
+                                             self.exit_codes[index], self.durations[index]))
+        return results
+
+def run_compiled_script(entries, host_name, ssh_client):
+    """Run compiled tasks as one script and return a TaskResult per (task, CompiledTask) entry it ran.
+
+    The results stop at the first task that exited non-zero, as the script does.
+    """
+    marker = f"{SCRIPT_MARKER}-{secrets.token_hex(8)}"
+    commands = [compiled.command for _, compiled in entries]
+    parser = ScriptOutputParser(marker, commands, getattr(ssh_client, 'max_output_bytes', DEFAULT_MAX_OUTPUT_BYTES),
+                                getattr(ssh_client, 'output_spill_dir', None))
+
+    error = None
+    try:
+        ssh_client.run_command(build_script(commands, marker), line_callback=parser.add_line)
+    except Exception as e:
+        error = e
+
+    results = []
+    for (task, compiled), command_result in zip(entries, parser.results()):
+        if command_result is None:
+            message = str(error) if error else "Task did not complete in the compiled script"
+            results.append(TaskResult(host_name, task['name'], STATUS_FAILED, error=message))
+            continue
+        logger.debug("Task '%s' on %s exited with %s in %.3fs", task['name'], host_name, command_result.exit_code,
+                     command_result.duration)
+        try:
+            output = compiled.on_result(command_result)
+            status = STATUS_OK if output == STATUS_OK else STATUS_CHANGED
+            results.append(TaskResult(host_name, task['name'], status, output=output))
+        except Exception as e:
+            results.append(TaskResult(host_name, task['name'], STATUS_FAILED, error=str(e)))
+        if command_result.exit_code != 0:
+            break
+    return results
+
+def run_compiled_tasks(tasks, host_name, ssh_client, failures=None):
+    """Execute compilable tasks on one host with as few remote scripts as possible.
+
+    Tasks are compiled in order and run together in one script per host; a
+    task that depends on state changed by an earlier task in the script (see
+    task_state_keys) starts a new script. Tasks the handlers skip are reported
+    without running anything.
+
+    As when tasks run one at a time, a failing task stops the host only if it
+    aborts the run: a script stops at a task that exits non-zero, whose
+    failure is recorded in ``failures`` (a FailureTracker); if the run is
+    then aborted, the remaining tasks are skipped, otherwise they run in a
+    new script.
+
+    Returns:
+        list: A TaskResult per task, in task order.
+    """
+    results = {}
+    pending = []
+    touched = set()
+
+    def aborted():
+        return failures is not None and failures.aborted
+
+    def flush():
+        remaining = list(pending)
+        while remaining and not aborted():
+            script_results = run_compiled_script([entry for _, entry in remaining], host_name, ssh_client)
+            for (index, _), result in zip(remaining, script_results):
+                results[index] = result
+                if failures is not None:
+                    failures.record(result)
+            remaining = remaining[len(script_results):]
+        for index, (task, _) in remaining:
+            results[index] = TaskResult(host_name, task['name'], STATUS_SKIPPED, error=failures.reason)
+        pending.clear()
+        touched.clear()
+
+    for index, task in enumerate(tasks):
+        if aborted():
+            flush()
+            results[index] = TaskResult(host_name, task['name'], STATUS_SKIPPED, error=failures.reason)
+            continue
+        keys = task_state_keys(task)
+        if keys & touched:
+            flush()
+        try:
+            handler = TaskResourceHandlerFactory.create_resource_handler(task['type'])
+            compiled = handler.compile_task(task, ssh_client)
+        except Exception as e:
+            results[index] = TaskResult(host_name, task['name'], STATUS_FAILED, error=str(e))
+            if failures is not None:
+                failures.record(results[index])
+            continue
+
+        if isinstance(compiled, CompiledTask):
+            pending.append((index, (task, compiled)))
+            touched |= keys
+        else:
+            status = STATUS_OK if compiled == STATUS_OK else STATUS_CHANGED
+            results[index] = TaskResult(host_name, task['name'], status, output=compiled)
+    if pending:
+        flush()
+
+    return [results[index] for index in range(len(tasks))]
+
+# Example usage:
+# tasks = [
+#     {'name': 'Create app dir', 'type': 'directory', 'action': 'create', 'directory_path': '/opt/app'},
+#     {'name': 'Restart nginx', 'type': 'service', 'action': 'restart', 'service_name': 'nginx'},
+# ]
+# results = run_compiled_tasks(tasks, 'web1', ssh_client)
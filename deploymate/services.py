@@ -0,0 +1,19 @@
+# services.py
+#
+# Helpers on service tasks needed before any handler runs, when tasks are
+# scheduled and compiled. deploymate.handlers.service_handler builds on them.
+
+def service_names(task):
+    """Return a task's ``service_name`` as a list; it may be a name, space-separated names or a list.
+
+    Returns an empty list if the task names no service.
+    """
+    service_name = task.get('service_name')
+    if not service_name:
+        return []
+    if isinstance(service_name, str):
+        return service_name.split()
+    return list(service_name)
+
+# Example usage:
+# service_names({'type': 'service', 'action': 'restart', 'service_name': 'nginx redis-server'})
@@ -0,0 +1,126 @@
+# strategies.py
+#
+# Host batching and failure thresholds for the execution strategies of
+# execute_playbook. With ``serial``, hosts are processed in rolling batches;
+# each batch runs with one of the STRATEGIES and the run stops once more
+# than ``max_fail_percentage`` of a batch's hosts have failed.
+
+import math
+import threading
+from deploymate.run_report import STATUS_FAILED, STATUS_UNREACHABLE
+
+# Each task finishes on every host of the batch before the next task starts
+STRATEGY_LINEAR = 'linear'
+# Each host works through its tasks without waiting for the other hosts
+STRATEGY_FREE = 'free'
+# As free, and each host also runs its independent tasks concurrently (see deploymate.task_graph)
+STRATEGY_GRAPH = 'graph'
+STRATEGIES = (STRATEGY_LINEAR, STRATEGY_FREE, STRATEGY_GRAPH)
+
+def parse_serial(serial):
+    """Return batch size specifications as a list of ints (host counts) and strings ('N%').
+
+    ``serial`` is a count, a percentage such as '25%', or a list (or
+    comma-separated string) of them, e.g. '1,10%,50%': the first batch has
+    one host, the next 10% of the hosts, and every later batch 50%.
+
+    Raises:
+        ValueError: If a specification is not a positive count or percentage.
+    """
+    if serial is None or serial == '':
+        return []
+    if isinstance(serial, str):
+        serial = serial.split(',')
+    elif not isinstance(serial, (list, tuple)):
+        serial = [serial]
+
+    specs = []
+    for spec in serial:
+        text = str(spec).strip()
+        try:
+            if text.endswith('%'):
+                value = float(text[:-1])
+                if not 0 < value <= 100:
+                    raise ValueError
+                specs.append(f"{value:g}%")
+            else:
+                value = int(text)
+                if value < 1:
+                    raise ValueError
+                specs.append(value)
+        except ValueError:
+            raise ValueError(f"serial must be a positive host count or a percentage up to 100%, got '{spec}'")
+    return specs
+
+def host_batches(host_names, serial=None):
+    """Split hosts into the batches a ``serial`` run processes one after another.
+
+    Percentages are of all hosts and round down, but a batch always has at
+    least one host. The last specification repeats until every host is in a
+    batch. Without ``serial`` all hosts form one batch.
+    """
+    host_names = list(host_names)
+    specs = parse_serial(serial)
+    if not specs:
+        return [host_names] if host_names else []
+
+    batches = []
+    start = 0
+    while start < len(host_names):
+        spec = specs[min(len(batches), len(specs) - 1)]
+        if isinstance(spec, str):
+            size = max(1, math.floor(len(host_names) * float(spec[:-1]) / 100))
+        else:
+            size = spec
+        batches.append(host_names[start:start + size])
+        start += size
+    return batches
+
+class FailureTracker:
+    """Counts failed hosts per batch and decides when the run has to stop.
+
+    A host counts as failed once any of its tasks fails or it is
+    unreachable. The run is aborted when the failed share of the current
+    batch exceeds ``max_fail_percentage``; None never aborts and 0 aborts on
+    the first failure. Results may be recorded from several threads.
+    """
+
+    def __init__(self, max_fail_percentage=None):
+        if max_fail_percentage is not None and not 0 <= max_fail_percentage <= 100:
+            raise ValueError(f"max_fail_percentage must be between 0 and 100, got {max_fail_percentage}")
+        self.max_fail_percentage = max_fail_percentage
+        self.failed_hosts = set()
+        self.reason = None
+        self._batch_size = 0
+        self._batch_failures = set()
+        self._lock = threading.Lock()
+
+    @property
+    def aborted(self):
+        return self.reason is not None
+
+    def begin_batch(self, host_names):
+        with self._lock:
+            self._batch_size = len(host_names)
+            self._batch_failures = set()
+
+    def record(self, result):
+        """Note a TaskResult, aborting the run if it pushes the batch over the threshold."""
+        if result.status not in (STATUS_FAILED, STATUS_UNREACHABLE):
+            return
+        with self._lock:
+            self.failed_hosts.add(result.host_name)
+            self._batch_failures.add(result.host_name)
+            if self.reason or self.max_fail_percentage is None or not self._batch_size:
+                return
+            failed_percentage = len(self._batch_failures) * 100 / self._batch_size
+            if failed_percentage > self.max_fail_percentage:
+                self.reason = (f"Run aborted: {len(self._batch_failures)} of {self._batch_size} hosts in the batch "
+                               f"failed ({failed_percentage:.0f}%, max_fail_percentage is "
+                               f"{self.max_fail_percentage:g}%)")
+
+# Example usage:
+# host_batches(['web1', 'web2', 'web3', 'web4'], '1,50%')  # [['web1'], ['web2', 'web3'], ['web4']]
+# failures = FailureTracker(max_fail_percentage=20)
+# failures.begin_batch(batch)
+# failures.record(result); failures.aborted
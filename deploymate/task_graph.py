@@ -0,0 +1,213 @@
+# task_graph.py
+#
+# Dependency graphs between the steps of one host, and a scheduler that
+# runs independent steps concurrently. Dependencies are declared with a
+# task's ``depends_on`` (names of earlier tasks) or inferred from what the
+# tasks touch:
+#
+#   - directory and file tasks conflict when one path contains the other,
+#   - tasks on the same service conflict, and services wait for earlier
+#     package and update tasks, which may install their units,
+#   - services may read any file of the host when they (re)start, so a
+#     service task waits for every earlier directory and file task
+#     (templates included) and later ones wait for it,
+#   - package and update tasks all share apt and run one at a time,
+#   - command tasks and other task types can do anything, so they wait for
+#     every earlier task and every later task waits for them, unless they
+#     declare ``depends_on`` (possibly empty), in which case only those
+#     dependencies apply.
+#
+# Without conflicts and declared dependencies, two steps may run at the same
+# time; otherwise the later one waits for the earlier one.
+
+import heapq
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from deploymate.services import service_names
+
+logger = logging.getLogger(__name__)
+
+# Steps of one host run at once unless overridden; OpenSSH allows 10 sessions per connection by default
+DEFAULT_HOST_CONCURRENCY = 4
+
+class TaskGraphError(Exception):
+    """Custom exception for invalid task dependencies."""
+    pass
+
+def declared_dependencies(task):
+    """Return the task names listed in a task's ``depends_on``, which may be a name or a list."""
+    depends_on = task.get('depends_on')
+    if not depends_on:
+        return ()
+    if isinstance(depends_on, str):
+        return (depends_on,)
+    return tuple(depends_on)
+
+def task_resources(task):
+    """Return (paths, writes, reads) for a task, or None if it has to run on its own.
+
+    ``paths`` are remote paths the task changes; ``writes`` and ``reads`` are
+    other resources, such as ('service', name) and ('apt',), it changes or
+    depends on. Directory and file tasks read ('files',) and service tasks
+    write it, which orders services against the files around them.
+    """
+    task_type = task.get('type')
+    if task_type == 'directory' and task.get('directory_path'):
+        return {os.path.normpath(task['directory_path'])}, set(), {('files',)}
+    if task_type == 'file' and task.get('remote_path'):
+        remote_path = os.path.normpath(task['remote_path'])
+        if task.get('action') == 'upload_tree' or not task.get('files'):
+            return {remote_path}, set(), {('files',)}
+        return ({os.path.normpath(os.path.join(remote_path, name)) for name in task['files']}, set(),
+                {('files',)})
+    if task_type == 'service' and task.get('service_name'):
+        return set(), {('files',)} | {('service', name) for name in service_names(task)}, {('apt',)}
+    if task_type in ('package', 'update'):
+        return set(), {('apt',)}, set()
+    if task.get('depends_on') is not None:
+        return set(), set(), set()
+    return None
+
+def _path_ancestors(path):
+    ancestors = []
+    parent = os.path.dirname(path)
+    while parent and parent != path:
+        ancestors.append(parent)
+        path, parent = parent, os.path.dirname(parent)
+    return ancestors
+
+def build_task_graph(steps):
+    """Return, for each step, the set of earlier step indexes it has to wait for.
+
+    A step is a list of tasks that run together (see group_tasks_into_steps);
+    its resources and declared dependencies are those of all its tasks.
+
+    Raises:
+        TaskGraphError: If a task depends on a task name that does not come before it.
+    """
+    dependencies = []
+    steps_by_name = {}
+    at_path = {}        # path -> last step changing exactly that path
+    under_path = {}     # path -> steps changing the path or anything below it since the last step at the path
+    last_writer = {}    # resource -> last step changing it
+    readers = {}        # resource -> steps depending on it since it last changed
+    since_barrier = set()
+    last_barrier = None
+
+    for index, step in enumerate(steps):
+        deps = set()
+        for task in step:
+            for name in declared_dependencies(task):
+                if name not in steps_by_name:
+                    raise TaskGraphError(f"Task '{task.get('name')}' depends on '{name}', "
+                                         f"which is not an earlier task")
+                deps.update(steps_by_name[name])
+
+        resources = [task_resources(task) for task in step]
+        if any(resource is None for resource in resources):
+            deps |= since_barrier
+            if last_barrier is not None:
+                deps.add(last_barrier)
+            last_barrier = index
+            since_barrier = set()
+            at_path, under_path, last_writer, readers = {}, {}, {}, {}
+        else:
+            paths = set().union(*(resource[0] for resource in resources))
+            writes = set().union(*(resource[1] for resource in resources))
+            reads = set().union(*(resource[2] for resource in resources))
+            for path in paths:
+                ancestors = _path_ancestors(path)
+                deps.update(at_path[ancestor] for ancestor in ancestors if ancestor in at_path)
+                deps |= under_path.get(path, set())
+            for key in writes:
+                if key in last_writer:
+                    deps.add(last_writer[key])
+                deps |= readers.get(key, set())
+            for key in reads - writes:
+                if key in last_writer:
+                    deps.add(last_writer[key])
+            if last_barrier is not None:
+                deps.add(last_barrier)
+
+            for path in paths:
+                at_path[path] = index
+                under_path[path] = {index}
+                for ancestor in _path_ancestors(path):
+                    under_path.setdefault(ancestor, set()).add(index)
+            for key in writes:
+                last_writer[key] = index
+                readers[key] = set()
+            for key in reads - writes:
+                readers.setdefault(key, set()).add(index)
+            since_barrier.add(index)
+
+        for task in step:
+            steps_by_name.setdefault(task.get('name'), []).append(index)
+        dependencies.append(deps)
+    return dependencies
+
+def critical_path_length(dependencies, durations):
+    """Return the shortest possible wall time of a graph with unlimited concurrency."""
+    finish = []
+    for index, deps in enumerate(dependencies):
+        finish.append(max((finish[dep] for dep in deps), default=0) + durations[index])
+    return max(finish, default=0)
+
+def run_task_graph(dependencies, run_step, max_concurrency=DEFAULT_HOST_CONCURRENCY, should_stop=None):
+    """Run every step of a graph once all the steps it depends on have finished.
+
+    Up to ``max_concurrency`` steps run at the same time; among steps that
+    are ready, earlier ones start first. A failing step does not hold back
+    the steps that depend on it, as in sequential execution: ``run_step``
+    is expected to record failures rather than raise.
+
+    Args:
+        dependencies (list): Per step, the indexes of the steps it waits for.
+        run_step (callable): Called with a step index on a worker thread.
+        max_concurrency (int): Steps running at once.
+        should_stop (callable): Checked before starting each step; once it
+            returns True, no further steps are started.
+
+    Returns:
+        list: Indexes of the steps that were not started, in order.
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+
+    waiting = [len(deps) for deps in dependencies]
+    dependents = [[] for _ in dependencies]
+    for index, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(index)
+    ready = [index for index, count in enumerate(waiting) if count == 0]
+    heapq.heapify(ready)
+    started = set()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        running = {}
+        while ready or running:
+            while ready and len(running) < max_concurrency and not (should_stop and should_stop()):
+                index = heapq.heappop(ready)
+                started.add(index)
+                running[pool.submit(run_step, index)] = index
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                error = future.exception()
+                if error:
+                    logger.error("Step %s raised: %s", index, error)
+                for dependent in dependents[index]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        heapq.heappush(ready, dependent)
+
+    return [index for index in range(len(dependencies)) if index not in started]
+
+# Example usage:
+# steps = [[{'name': 'a', 'type': 'directory', 'action': 'create', 'directory_path': '/opt/a'}],
+#          [{'name': 'b', 'type': 'directory', 'action': 'create', 'directory_path': '/opt/b'}]]
+# dependencies = build_task_graph(steps)   # [set(), set()]: both can run at once
+# run_task_graph(dependencies, lambda index: print(steps[index]))
@@ -0,0 +1,217 @@
+# templates.py
+#
+# Rendering for file tasks with the ``template`` action. A template is a
+# file under config/templates whose $name and ${name} placeholders
+# (string.Template syntax, $$ for a literal $) are filled in with the
+# inventory variables of each host, plus inventory_hostname.
+#
+# A template is parsed once per process into a format string and cached
+# until the file changes, so a render is a single str.format call. At the
+# start of a batch a TemplateRenderer renders every template task for the
+# batch's hosts on a worker pool, while the hosts are still being
+# connected, and hosts whose output is identical share one string.
+
+import os
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Local directory that template task paths are relative to
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'templates')
+# Variable holding the host's inventory name
+HOST_NAME_VARIABLE = 'inventory_hostname'
+# Threads rendering templates; rendering is CPU-bound, so more would only contend for the GIL
+DEFAULT_RENDER_WORKERS = 2
+# Hosts rendered by one job of the pool, so the first hosts' output is ready early
+RENDER_CHUNK_SIZE = 64
+
+class TemplateError(Exception):
+    """Custom exception for template parsing and rendering errors."""
+    pass
+
+def is_template_task(task):
+    return task.get('type') == 'file' and task.get('action') == 'template'
+
+def template_variables(inventory, host_name):
+    """Return the variables a template is rendered with for a host."""
+    return {**inventory.host_vars(host_name), HOST_NAME_VARIABLE: host_name}
+
+class CompiledTemplate:
+    """A template parsed into a format string with one positional field per distinct placeholder.
+
+    Args:
+        text (str): The template source.
+        name (str): Name used in error messages, usually the file path.
+
+    Raises:
+        TemplateError: If a ``$`` is not followed by a valid placeholder.
+    """
+
+    def __init__(self, text, name='<template>'):
+        self.name = name
+        names = []
+        parts = []
+        position = 0
+        for match in string.Template.pattern.finditer(text):
+            parts.append(self._escape(text[position:match.start()]))
+            position = match.end()
+            if match.group('escaped') is not None:
+                parts.append('$')
+                continue
+            variable = match.group('named') or match.group('braced')
+            if variable is None:
+                line = text.count('\n', 0, match.start()) + 1
+                raise TemplateError(f"{name}: invalid placeholder on line {line}")
+            if variable not in names:
+                names.append(variable)
+            parts.append(f"{{{names.index(variable)}}}")
+        parts.append(self._escape(text[position:]))
+        self.format_string = ''.join(parts)
+        self.variables = tuple(names)
+
+    @staticmethod
+    def _escape(literal):
+        return literal.replace('{', '{{').replace('}', '}}')
+
+    def render(self, variables):
+        """Return the template with every placeholder replaced by ``str()`` of its variable.
+
+        Raises:
+            TemplateError: If a placeholder has no variable.
+        """
+        try:
+            values = [variables[name] for name in self.variables]
+        except KeyError as e:
+            raise TemplateError(f"{self.name}: undefined variable {e}")
+        return self.format_string.format(*values)
+
+class TemplateCache:
+    """Compiled templates by path, compiled again only when the file's size or mtime changes."""
+
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the CompiledTemplate of a local file.
+
+        Raises:
+            TemplateError: If the file cannot be read or parsed.
+        """
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            with self._lock:
+                cached = self._templates.get(path)
+            if cached and cached[0] == signature:
+                return cached[1]
+            with open(path, 'r', encoding='utf-8') as file:
+                template = CompiledTemplate(file.read(), path)
+        except (OSError, UnicodeDecodeError) as e:
+            raise TemplateError(f"Could not read template {path}: {e}")
+        with self._lock:
+            self._templates[path] = (signature, template)
+        return template
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_template_cache():
+    """Return the process-wide TemplateCache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = TemplateCache()
+        return _default_cache
+
+class TemplateRenderer:
+    """Renders the template tasks of a batch for its hosts ahead of the tasks running.
+
+    Rendered output is interned, so hosts that render the same text share
+    one string. Call close when the batch is done to release the output.
+
+    Args:
+        inventory (Inventory): Source of the host variables.
+        workers (int): Threads rendering templates.
+    """
+
+    def __init__(self, inventory, workers=DEFAULT_RENDER_WORKERS):
+        self.inventory = inventory
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='deploymate-render')
+        # (id(task), host name) -> future of the {host name: text or TemplateError} of its chunk
+        self._futures = {}
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, host_tasks):
+        """Start rendering the template tasks in ``host_tasks`` ({host name: tasks}) for their hosts."""
+        hosts_by_task = {}
+        for host_name, tasks in host_tasks.items():
+            for task in tasks:
+                if is_template_task(task):
+                    hosts_by_task.setdefault(id(task), (task, []))[1].append(host_name)
+        for task, host_names in hosts_by_task.values():
+            for start in range(0, len(host_names), RENDER_CHUNK_SIZE):
+                chunk = host_names[start:start + RENDER_CHUNK_SIZE]
+                future = self.executor.submit(self._render_chunk, task, chunk)
+                for host_name in chunk:
+                    self._futures[(id(task), host_name)] = future
+
+    def _render_chunk(self, task, host_names):
+        try:
+            template = get_template_cache().get(task['local_paths'][0])
+        except TemplateError as e:
+            return {host_name: e for host_name in host_names}
+        rendered = {}
+        for host_name in host_names:
+            try:
+                rendered[host_name] = self._share(template.render(template_variables(self.inventory, host_name)))
+            except TemplateError as e:
+                rendered[host_name] = e
+        return rendered
+
+    def _share(self, text):
+        with self._lock:
+            return self._buffers.setdefault(text, text)
+
+    def content(self, task, host_name):
+        """Return a task's rendered text for a host, rendering it now if it was not submitted.
+
+        Raises:
+            TemplateError: If the template cannot be read or rendered for the host.
+        """
+        future = self._futures.get((id(task), host_name))
+        if future is None:
+            template = get_template_cache().get(task['local_paths'][0])
+            return self._share(template.render(template_variables(self.inventory, host_name)))
+        rendered = future.result()[host_name]
+        if isinstance(rendered, TemplateError):
+            raise rendered
+        return rendered
+
+    def for_host(self, host_name):
+        """Return the view of this renderer that handlers find as ``ssh_client.templates``."""
+        return HostTemplates(self, host_name)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self._futures = {}
+        self._buffers = {}
+
+class HostTemplates:
+    """The rendered templates of one host."""
+
+    __slots__ = ('renderer', 'host_name')
+
+    def __init__(self, renderer, host_name):
+        self.renderer = renderer
+        self.host_name = host_name
+
+    def content(self, task):
+        return self.renderer.content(task, self.host_name)
+
+# Example usage:
+# renderer = TemplateRenderer(plan.inventory)
+# renderer.submit({'web1': host_tasks['web1'], 'web2': host_tasks['web2']})
+# text = renderer.content(template_task, 'web1')
+# renderer.close()
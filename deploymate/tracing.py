@@ -0,0 +1,221 @@
+# tracing.py
+#
+# Timing spans for playbook runs. Code that does something worth timing
+# wraps it in ``with tracing.span(name, category, **tags):``; while no Tracer
+# is enabled this returns a shared no-op span, so instrumentation costs a
+# function call. Spans started inside another span on the same thread
+# inherit its host and task tags, so a remote command is attributed to the
+# task that ran it without passing names around.
+#
+# A run's spans can be exported as Chrome trace-event JSON (open it in
+# chrome://tracing or https://ui.perfetto.dev; each host is one process
+# row) and summarised as the slowest tasks and hosts.
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Span categories recorded by deploymate
+CATEGORY_CONNECT = 'connect'
+CATEGORY_FACTS = 'facts'
+CATEGORY_TASK = 'task'
+CATEGORY_HANDLER = 'handler'
+CATEGORY_COMMAND = 'command'
+CATEGORY_TRANSFER = 'transfer'
+
+# Tags a span takes over from the span it was started in
+INHERITED_TAGS = ('host', 'task')
+
+_current_span = contextvars.ContextVar('deploymate_span', default=None)
+_tracer = None
+
+class Span:
+    """One timed operation; use as a context manager. ``set`` adds tags while it runs."""
+
+    __slots__ = ('tracer', 'name', 'category', 'tags', 'start', 'duration', 'thread_id', '_token')
+
+    def __init__(self, tracer, name, category, tags):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.tags = tags
+        self.start = None
+        self.duration = None
+        self.thread_id = None
+        self._token = None
+
+    def set(self, **tags):
+        self.tags.update(tags)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is not None:
+            for key in INHERITED_TAGS:
+                if key not in self.tags and key in parent.tags:
+                    self.tags[key] = parent.tags[key]
+        self._token = _current_span.set(self)
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.tags['error'] = exc_type.__name__
+        self.tracer.record(self)
+        return False
+
+class _NullSpan:
+    """Returned by span() while tracing is disabled."""
+
+    __slots__ = ()
+
+    def set(self, **tags):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Tracer:
+    """Collects the spans of a run; spans may be recorded from any thread."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def span(self, name, category, **tags):
+        return Span(self, name, category, tags)
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def _finished_spans(self):
+        with self._lock:
+            return list(self.spans)
+
+    def chrome_trace(self):
+        """Return the spans as a Chrome trace-event dictionary.
+
+        Each host becomes a process (spans without a host go to the
+        'deploymate' process) whose threads are the worker threads that
+        ran its spans; timestamps are microseconds since the tracer started.
+        """
+        host_ids = {None: 0}
+        events = []
+        for span in sorted(self._finished_spans(), key=lambda span: span.start):
+            host = span.tags.get('host')
+            if host not in host_ids:
+                host_ids[host] = len(host_ids)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round((span.start - self.origin) * 1e6, 1),
+                'dur': round(span.duration * 1e6, 1),
+                'pid': host_ids[host],
+                'tid': span.thread_id,
+                'args': {key: value if isinstance(value, (int, float, bool)) else str(value)
+                         for key, value in span.tags.items()},
+            })
+        for host, pid in host_ids.items():
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                           'args': {'name': host if host is not None else 'deploymate'}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        """Write the Chrome trace-event JSON to ``path``, replacing it atomically."""
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+        os.replace(temporary_path, path)
+        logger.info("Trace with %s spans written to %s", len(self.spans), path)
+
+    def summary(self, limit=10):
+        """Return the slowest tasks and hosts and the total time per span category.
+
+        Returns:
+            dict: 'tasks', a list of (seconds, host, task) for the slowest task
+            spans; 'hosts', a list of (seconds, host, {category: seconds}) with
+            the time each host spent connecting and in tasks; 'categories', a
+            {category: seconds} total over all spans.
+        """
+        spans = self._finished_spans()
+        tasks = sorted(((span.duration, span.tags.get('host'), span.name)
+                        for span in spans if span.category == CATEGORY_TASK), key=lambda entry: entry[0], reverse=True)
+
+        host_totals = {}
+        categories = {}
+        for span in spans:
+            categories[span.category] = categories.get(span.category, 0.0) + span.duration
+            host = span.tags.get('host')
+            if host is not None:
+                breakdown = host_totals.setdefault(host, {})
+                breakdown[span.category] = breakdown.get(span.category, 0.0) + span.duration
+        hosts = sorted(((breakdown.get(CATEGORY_CONNECT, 0.0) + breakdown.get(CATEGORY_FACTS, 0.0)
+                         + breakdown.get(CATEGORY_TASK, 0.0), host, breakdown)
+                        for host, breakdown in host_totals.items()), key=lambda entry: entry[0], reverse=True)
+        return {'tasks': tasks[:limit], 'hosts': hosts[:limit], 'categories': categories}
+
+    def log_summary(self, limit=10):
+        """Log the slowest tasks and hosts of the run."""
+        summary = self.summary(limit)
+        logger.info("Slowest tasks:")
+        for seconds, host, task in summary['tasks']:
+            logger.info("  %8.3fs  %s | %s", seconds, host, task)
+        logger.info("Slowest hosts (connect + tasks):")
+        for seconds, host, breakdown in summary['hosts']:
+            details = ", ".join(f"{category} {breakdown[category]:.3f}s"
+                                for category in (CATEGORY_CONNECT, CATEGORY_COMMAND, CATEGORY_TRANSFER)
+                                if category in breakdown)
+            logger.info("  %8.3fs  %s (%s)", seconds, host, details)
+        totals = ", ".join(f"{category} {seconds:.3f}s" for category, seconds in sorted(summary['categories'].items()))
+        logger.info("Time per span category (summed over hosts): %s", totals)
+
+def command_label(command, limit=60):
+    """Return the first line of a shell command, shortened to ``limit`` characters, as a span name."""
+    line = command.strip().split('\n', 1)[0]
+    return line if len(line) <= limit else f"{line[:limit - 3]}..."
+
+def span(name, category, **tags):
+    """Return a span timing ``name`` on the enabled tracer, or a no-op span if tracing is disabled."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return Span(tracer, name, category, tags)
+
+def enable_tracing(tracer=None):
+    """Record spans from every thread on ``tracer`` (a new Tracer if None) and return it."""
+    global _tracer
+    _tracer = tracer or Tracer()
+    return _tracer
+
+def disable_tracing():
+    """Stop recording spans and return the tracer that was enabled, if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+def get_tracer():
+    return _tracer
+
+# Example usage:
+# tracer = enable_tracing()
+# with span('Install nginx', CATEGORY_TASK, host='web1', task='Install nginx'):
+#     with span('apt-get install', CATEGORY_COMMAND):   # inherits host and task
+#         ...
+# disable_tracing()
+# tracer.write_chrome_trace('trace.json')
+# tracer.log_summary()
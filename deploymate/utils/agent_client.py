@@ -0,0 +1,291 @@
+# agent_client.py
+#
+# Client side of the connection agent (see deploymate/agent.py). Each remote
+# command uses its own Unix socket connection to the agent, which runs the
+# command on an SSH session it keeps open between deploymate runs. Messages
+# in both directions are frames of a 1-byte type, a 4-byte big-endian length
+# and the payload.
+
+import io
+import json
+import os
+import socket
+import struct
+import threading
+import paramiko
+
+DEFAULT_AGENT_SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'deploymate', 'agent.sock')
+
+# Client to agent
+FRAME_CONNECT = 1   # JSON connection parameters; answered with OK {"reused": bool} or ERROR
+FRAME_EXEC = 2      # Command to run on a new session; answered with OK or ERROR
+FRAME_DATA = 3      # Bytes for the command's stdin
+FRAME_EOF = 4       # End of the command's stdin
+FRAME_STATUS = 5    # Answered with OK and a JSON list of pooled connections
+FRAME_SHUTDOWN = 6  # Stops the agent
+# Agent to client
+FRAME_OK = 10
+FRAME_ERROR = 11
+FRAME_STDOUT = 12
+FRAME_STDERR = 13
+FRAME_EXIT = 14     # Signed 4-byte exit status; last frame of a command
+
+FRAME_HEADER = struct.Struct('>BI')
+MAX_DATA_FRAME = 32 * 1024
+
+class AgentError(paramiko.SSHException):
+    """Custom exception for errors reported by or talking to the connection agent."""
+    pass
+
+class AgentUnavailableError(AgentError):
+    """Raised when no agent is listening on the socket."""
+    pass
+
+def send_frame(sock, frame_type, payload=b''):
+    sock.sendall(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+
+def _read_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if data:
+                raise AgentError("Connection to the agent closed mid-frame")
+            return None
+        data += chunk
+    return bytes(data)
+
+def read_frame(sock):
+    """Return the next (frame_type, payload), or (None, None) if the peer closed the socket."""
+    header = _read_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None, None
+    frame_type, length = FRAME_HEADER.unpack(header)
+    payload = _read_exact(sock, length) if length else b''
+    if payload is None:
+        raise AgentError("Connection to the agent closed mid-frame")
+    return frame_type, payload
+
+def connect_to_agent(socket_path, timeout=None):
+    """Open a Unix socket connection to the agent."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except OSError as e:
+        sock.close()
+        raise AgentUnavailableError(f"No connection agent on {socket_path}: {e}")
+    sock.settimeout(None)
+    return sock
+
+def agent_request(socket_path, frame_type, timeout=5):
+    """Send a single control frame (status or shutdown) and return the decoded JSON reply."""
+    sock = connect_to_agent(socket_path, timeout)
+    try:
+        send_frame(sock, frame_type)
+        reply_type, payload = read_frame(sock)
+    finally:
+        sock.close()
+    if reply_type != FRAME_OK:
+        raise AgentError(payload.decode('utf-8', errors='replace') if payload else "No reply from the agent")
+    return json.loads(payload) if payload else None
+
+class AgentChannel:
+    """A remote command running through the agent, with the parts of paramiko.Channel deploymate uses.
+
+    Output frames are read by a background thread into per-stream buffers.
+    ``fileno`` returns a pipe that is readable whenever output or end of
+    file is pending, so the channel works with ``select`` like a paramiko
+    channel does.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.timeout = None
+        self.closed = False
+        self.eof_received = False
+        self.exit_status = -1
+        self._stdout = bytearray()
+        self._stderr = bytearray()
+        self._condition = threading.Condition()
+        self._exited = threading.Event()
+        self._send_lock = threading.Lock()
+        self._pipe_read, self._pipe_write = os.pipe()
+        self._pipe_set = False
+        self._reader = None
+
+    def exec_command(self, command):
+        if isinstance(command, str):
+            command = command.encode('utf-8')
+        send_frame(self.sock, FRAME_EXEC, command)
+        frame_type, payload = read_frame(self.sock)
+        if frame_type != FRAME_OK:
+            raise AgentError(payload.decode('utf-8', errors='replace') if payload else "Agent closed the channel")
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._reader.start()
+
+    def _read_output(self):
+        try:
+            while True:
+                frame_type, payload = read_frame(self.sock)
+                with self._condition:
+                    if frame_type == FRAME_STDOUT:
+                        self._stdout += payload
+                    elif frame_type == FRAME_STDERR:
+                        self._stderr += payload
+                    elif frame_type == FRAME_EXIT:
+                        self.exit_status = struct.unpack('>i', payload)[0]
+                    self._notify()
+                if frame_type in (FRAME_EXIT, None):
+                    break
+        except (OSError, AgentError):
+            pass
+        finally:
+            with self._condition:
+                self.eof_received = True
+                self._notify()
+            self._exited.set()
+
+    def _notify(self):
+        # Called with the condition held
+        if not self._pipe_set and not self.closed:
+            os.write(self._pipe_write, b'*')
+            self._pipe_set = True
+        self._condition.notify_all()
+
+    def _drain_pipe(self):
+        # Called with the condition held
+        if self._pipe_set and not self._stdout and not self._stderr and not self.eof_received:
+            os.read(self._pipe_read, 1)
+            self._pipe_set = False
+
+    def fileno(self):
+        return self._pipe_read
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv_ready(self):
+        with self._condition:
+            return bool(self._stdout)
+
+    def recv_stderr_ready(self):
+        with self._condition:
+            return bool(self._stderr)
+
+    def _recv(self, buffer, size):
+        with self._condition:
+            if not self._condition.wait_for(lambda: buffer or self.eof_received, self.timeout):
+                raise socket.timeout()
+            data = bytes(buffer[:size])
+            del buffer[:size]
+            self._drain_pipe()
+            return data
+
+    def recv(self, size):
+        return self._recv(self._stdout, size)
+
+    def recv_stderr(self, size):
+        return self._recv(self._stderr, size)
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        chunk = bytes(data[:MAX_DATA_FRAME])
+        with self._send_lock:
+            send_frame(self.sock, FRAME_DATA, chunk)
+        return len(chunk)
+
+    def sendall(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        view = memoryview(data)
+        while view:
+            view = view[self.send(view):]
+
+    def shutdown_write(self):
+        with self._send_lock:
+            send_frame(self.sock, FRAME_EOF)
+
+    def exit_status_ready(self):
+        return self._exited.is_set()
+
+    def recv_exit_status(self):
+        self._exited.wait()
+        return self.exit_status
+
+    def makefile_stderr(self, mode='rb'):
+        """Return the stderr not yet received as a file object; waits for the command to exit."""
+        self._exited.wait()
+        with self._condition:
+            data = bytes(self._stderr)
+            self._stderr.clear()
+        return io.BytesIO(data)
+
+    def close(self):
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        if self._reader:
+            self._reader.join()
+        os.close(self._pipe_read)
+        os.close(self._pipe_write)
+
+class AgentTransport:
+    """Stands in for the paramiko Transport of a host whose SSH session is held by the agent.
+
+    Args:
+        socket_path (str): The agent's Unix socket.
+        params (dict): host, port, user and credentials, as for SSHConnection.
+    """
+
+    def __init__(self, socket_path, params):
+        self.socket_path = socket_path
+        self.params = params
+        self._payload = json.dumps(params).encode('utf-8')
+
+    def _open(self):
+        sock = connect_to_agent(self.socket_path)
+        try:
+            send_frame(sock, FRAME_CONNECT, self._payload)
+            frame_type, payload = read_frame(sock)
+        except OSError as e:
+            sock.close()
+            raise AgentUnavailableError(f"Lost connection to the agent: {e}")
+        if frame_type != FRAME_OK:
+            sock.close()
+            raise AgentError(payload.decode('utf-8', errors='replace') if payload else "Agent closed the connection")
+        return sock, json.loads(payload)
+
+    def connect(self):
+        """Make sure the agent holds an authenticated session to the host.
+
+        Returns:
+            bool: True if an existing session was reused.
+        """
+        sock, reply = self._open()
+        sock.close()
+        return reply.get('reused', False)
+
+    def open_session(self):
+        sock, _ = self._open()
+        return AgentChannel(sock)
+
+    def getpeername(self):
+        return self.params.get('host'), self.params.get('port', 22)
+
+    def is_active(self):
+        return True
+
+# Example usage:
+# transport = AgentTransport(DEFAULT_AGENT_SOCKET, {'host': '10.0.0.5', 'user': 'ubuntu', 'key_file': 'id_rsa'})
+# transport.connect()
+# channel = transport.open_session()
+# channel.exec_command('uptime')
+# print(channel.recv(1024), channel.recv_exit_status())
@@ -0,0 +1,85 @@
+# apt_state.py
+
+import logging
+import threading
+import time
+
+# Seconds after an apt-get update during which another update is considered redundant
+DEFAULT_APT_FRESHNESS_WINDOW = 3600
+
+# Prints the remote clock followed by the mtimes of the apt update stamp and lists directory,
+# so the age can be computed without trusting the controller and host clocks to agree
+APT_LISTS_AGE_COMMAND = ("date +%s; stat -c %Y /var/lib/apt/periodic/update-success-stamp "
+                         "/var/lib/apt/lists 2>/dev/null; true")
+
+logger = logging.getLogger(__name__)
+
+def parse_apt_lists_age(output):
+    """Return the age in seconds of the apt lists from APT_LISTS_AGE_COMMAND output, or None."""
+    values = [int(line) for line in output.split() if line.strip().isdigit()]
+    if len(values) < 2:
+        return None
+    remote_now, mtimes = values[0], values[1:]
+    return max(0, remote_now - max(mtimes))
+
+class AptListsState:
+    """Tracks when the apt package lists of one host were last refreshed.
+
+    The refresh time is taken from, in order: an update made during this
+    run, the host facts, or a single remote query of the apt stamp files.
+    Updates within ``freshness_window`` seconds of the last refresh are
+    reported as redundant; a window of 0 disables skipping.
+    """
+
+    def __init__(self, freshness_window=DEFAULT_APT_FRESHNESS_WINDOW):
+        self.freshness_window = freshness_window
+        self.refreshed_at = None
+        self._queried_remote = False
+        self._lock = threading.Lock()
+
+    def _load_refreshed_at(self, ssh_client):
+        facts = getattr(ssh_client, 'facts', None)
+        if facts and facts.apt_lists_refreshed_at is not None:
+            self.refreshed_at = facts.apt_lists_refreshed_at
+            return
+
+        self._queried_remote = True
+        stdout, _, _ = ssh_client.execute_command(APT_LISTS_AGE_COMMAND)
+        age = parse_apt_lists_age(stdout)
+        if age is not None:
+            self.refreshed_at = time.time() - age
+
+    def needs_update(self, ssh_client):
+        """Return False if the package lists were refreshed within the freshness window."""
+        if self.freshness_window <= 0:
+            return True
+
+        with self._lock:
+            if self.refreshed_at is None and not self._queried_remote:
+                self._load_refreshed_at(ssh_client)
+            if self.refreshed_at is None:
+                logger.debug("Last apt-get update on %s is unknown, updating", ssh_client.host)
+                return True
+
+            age = time.time() - self.refreshed_at
+            if age < self.freshness_window:
+                logger.debug("apt lists on %s refreshed %.0fs ago, within the %ss freshness window: "
+                             "skipping apt-get update", ssh_client.host, age, self.freshness_window)
+                return False
+            logger.debug("apt lists on %s refreshed %.0fs ago, older than the %ss freshness window: updating",
+                         ssh_client.host, age, self.freshness_window)
+            return True
+
+    def mark_updated(self, ssh_client=None):
+        """Record a successful apt-get update made now."""
+        with self._lock:
+            self.refreshed_at = time.time()
+        facts = getattr(ssh_client, 'facts', None)
+        if facts:
+            facts.apt_lists_refreshed_at = self.refreshed_at
+
+# Example usage:
+# apt_state = AptListsState(freshness_window=600)
+# if apt_state.needs_update(ssh_client):
+#     ssh_client.execute_command('sudo apt-get update')
+#     apt_state.mark_updated(ssh_client)
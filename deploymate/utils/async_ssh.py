@@ -0,0 +1,245 @@
+# async_ssh.py
+
+import asyncio
+import functools
+import logging
+import os
+from deploymate.utils.ssh_module import SSHConnectionError
+from deploymate.utils.scp_transfer import SCPTransferError
+from deploymate.utils.command_output import StreamCapture, CommandResult, DEFAULT_MAX_OUTPUT_BYTES
+
+class AsyncSSHConnection:
+    """Asynchronous counterpart of the SSHConnection interface.
+
+    Implementations must provide awaitable ``connect``, ``execute_command``,
+    ``run_command``, ``upload_file``, ``upload_files``, ``upload_file_delta``,
+    ``upload_tree``, ``write_content`` and ``disconnect`` methods, plus
+    ``get_transport``.
+
+    ``blocking_connection`` is the synchronous connection an implementation
+    wraps, if any; handlers running on worker threads call it directly.
+    """
+    blocking_connection = None
+    host = None
+    user = None
+    port = 22
+    facts = None
+    templates = None
+    apt_state = None
+
+    async def connect(self):
+        raise NotImplementedError
+
+    async def execute_command(self, command):
+        """Return a (stdout, stderr, exit_code) tuple for the command."""
+        raise NotImplementedError
+
+    async def run_command(self, command, line_callback=None, **options):
+        """Return a CommandResult with bounded output, see SSHConnection.run_command."""
+        raise NotImplementedError
+
+    async def upload_file(self, local_path, remote_path):
+        raise NotImplementedError
+
+    async def upload_files(self, local_paths, remote_dir):
+        """Upload several files into a remote directory, see SSHConnection.upload_files."""
+        raise NotImplementedError
+
+    async def upload_file_delta(self, local_path, remote_path, use_sudo=False):
+        """Update a remote file with an rsync-style delta, see SSHConnection.upload_file_delta."""
+        raise NotImplementedError
+
+    async def upload_tree(self, local_dir, remote_dir, delete_missing=False):
+        """Copy a local directory tree as one tar stream, see SSHConnection.upload_tree."""
+        raise NotImplementedError
+
+    async def write_content(self, content, remote_paths, mode=None, owner=None):
+        """Stream text into remote files, see SSHConnection.write_content."""
+        raise NotImplementedError
+
+    def get_transport(self):
+        raise NotImplementedError
+
+    async def disconnect(self):
+        raise NotImplementedError
+
+class ThreadedAsyncSSHConnection(AsyncSSHConnection):
+    """Adapts a blocking SSHConnection to the async interface.
+
+    paramiko is synchronous, so each call is run on a shared, bounded thread
+    pool. Threads are only held while a call is in flight, not for the whole
+    lifetime of a host.
+    """
+
+    def __init__(self, connection, executor=None):
+        self.connection = connection
+        self.executor = executor
+        self.host = connection.host
+        self.user = connection.user
+        self.port = connection.port
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def connect(self):
+        await self._run(self.connection.connect)
+
+    async def execute_command(self, command):
+        return await self._run(self.connection.execute_command, command)
+
+    async def run_command(self, command, line_callback=None, **options):
+        return await self._run(functools.partial(self.connection.run_command, command, line_callback, **options))
+
+    async def upload_file(self, local_path, remote_path):
+        await self._run(self.connection.upload_file, local_path, remote_path)
+
+    async def upload_files(self, local_paths, remote_dir):
+        return await self._run(self.connection.upload_files, local_paths, remote_dir)
+
+    async def upload_file_delta(self, local_path, remote_path, use_sudo=False):
+        return await self._run(functools.partial(self.connection.upload_file_delta, local_path, remote_path,
+                                                 use_sudo=use_sudo))
+
+    async def upload_tree(self, local_dir, remote_dir, delete_missing=False):
+        return await self._run(functools.partial(self.connection.upload_tree, local_dir, remote_dir,
+                                                 delete_missing=delete_missing))
+
+    async def write_content(self, content, remote_paths, mode=None, owner=None):
+        return await self._run(functools.partial(self.connection.write_content, content, remote_paths, mode=mode,
+                                                 owner=owner))
+
+    def get_transport(self):
+        return self.connection.get_transport()
+
+    async def disconnect(self):
+        await self._run(self.connection.disconnect)
+
+    @property
+    def blocking_connection(self):
+        return self.connection
+
+    @property
+    def apt_state(self):
+        # AsyncSSHConnection.apt_state would otherwise hide the wrapped connection's from __getattr__
+        return self.connection.apt_state
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+class FakeTransport:
+    """Stand-in for a paramiko transport on a FakeAsyncSSHConnection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def is_active(self):
+        return self.connection.connected
+
+class FakeAsyncSSHConnection(AsyncSSHConnection):
+    """In-process transport that simulates a remote host without any network I/O.
+
+    Every call sleeps for ``latency`` seconds to model a round trip. Commands
+    are answered by ``responder``, a callable taking the command string and
+    returning a (stdout, stderr, exit_code) tuple; by default every command
+    succeeds with no output. Executed commands and uploads are recorded so
+    tests can assert on them.
+    """
+
+    def __init__(self, host, latency=0.0, responder=None, fail_connect=False):
+        self.host = host
+        self.latency = latency
+        self.responder = responder
+        self.fail_connect = fail_connect
+        self.connected = False
+        self.commands = []
+        self.uploads = []
+        self.bytes_uploaded = 0
+
+    async def connect(self):
+        await asyncio.sleep(self.latency)
+        if self.fail_connect:
+            raise SSHConnectionError(f"Failed to establish SSH connection with {self.host}: simulated failure")
+        self.connected = True
+
+    async def execute_command(self, command):
+        if not self.connected:
+            raise SSHConnectionError("SSH client not connected")
+        await asyncio.sleep(self.latency)
+        self.commands.append(command)
+        if self.responder:
+            return self.responder(command)
+        return '', '', 0
+
+    async def run_command(self, command, line_callback=None, **options):
+        stdout, stderr, exit_code = await self.execute_command(command)
+        captures = {
+            'stdout': StreamCapture(DEFAULT_MAX_OUTPUT_BYTES, name='stdout'),
+            'stderr': StreamCapture(DEFAULT_MAX_OUTPUT_BYTES, name='stderr'),
+        }
+        for stream_name, text in (('stdout', stdout), ('stderr', stderr)):
+            for line in text.splitlines():
+                captures[stream_name].add(line)
+                if line_callback:
+                    line_callback(stream_name, line)
+        return CommandResult(command, captures['stdout'], captures['stderr'], exit_code)
+
+    async def upload_file(self, local_path, remote_path):
+        if not self.connected:
+            raise SSHConnectionError("SSH client not connected")
+        await asyncio.sleep(self.latency)
+        self.uploads.append((local_path, remote_path))
+        self.bytes_uploaded += os.path.getsize(local_path)
+
+    async def upload_files(self, local_paths, remote_dir):
+        if not self.connected:
+            raise SSHConnectionError("SSH client not connected")
+        await asyncio.sleep(self.latency)
+        remote_paths = {}
+        for index, local_path in enumerate(local_paths):
+            remote_paths[local_path] = f"{remote_dir}/{index}/{os.path.basename(local_path)}"
+            self.uploads.append((local_path, remote_paths[local_path]))
+            self.bytes_uploaded += os.path.getsize(local_path)
+        return remote_paths
+
+    async def upload_file_delta(self, local_path, remote_path, use_sudo=False):
+        # There is no remote copy to diff against, so callers fall back to a full upload
+        raise SCPTransferError("Delta transfer is not simulated by FakeAsyncSSHConnection")
+
+    async def upload_tree(self, local_dir, remote_dir, delete_missing=False):
+        if not self.connected:
+            raise SSHConnectionError("SSH client not connected")
+        await asyncio.sleep(self.latency)
+        files = 0
+        bytes_sent = 0
+        for dir_path, _, file_names in os.walk(local_dir):
+            for file_name in file_names:
+                files += 1
+                bytes_sent += os.path.getsize(os.path.join(dir_path, file_name))
+        self.uploads.append((local_dir, remote_dir))
+        self.bytes_uploaded += bytes_sent
+        return {'files': files, 'bytes_sent': bytes_sent, 'deleted': []}
+
+    async def write_content(self, content, remote_paths, mode=None, owner=None):
+        if not self.connected:
+            raise SSHConnectionError("SSH client not connected")
+        await asyncio.sleep(self.latency)
+        for remote_path in remote_paths:
+            self.uploads.append(('<content>', remote_path))
+        self.bytes_uploaded += len(content.encode('utf-8'))
+        return list(remote_paths)
+
+    def get_transport(self):
+        if not self.connected:
+            raise SSHConnectionError("SSH client not connected or transport not available")
+        return FakeTransport(self)
+
+    async def disconnect(self):
+        if self.connected:
+            self.connected = False
+            logging.debug("Fake SSH connection closed with %s", self.host)
+
+# Example usage:
+# connection = FakeAsyncSSHConnection('web01', latency=0.01)
+# await connection.connect()
+# stdout, stderr, exit_code = await connection.execute_command('ls')
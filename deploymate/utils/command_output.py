@@ -0,0 +1,112 @@
+# command_output.py
+
+import collections
+import logging
+import os
+import tempfile
+
+# Bytes of output kept in memory per stream before older lines are dropped
+DEFAULT_MAX_OUTPUT_BYTES = 64 * 1024
+
+class StreamCapture:
+    """Keeps the tail of one output stream within a fixed memory budget.
+
+    Lines are retained until ``max_bytes`` is exceeded, after which the oldest
+    lines are dropped. If ``spill_dir`` is set, the first overflow opens a
+    file there and every line, including those already retained, is written
+    to it, so the complete output remains available on disk.
+
+    Args:
+        max_bytes (int): Memory budget in bytes, or None for no limit.
+        spill_dir (str): Directory for spill files, or None to discard dropped lines.
+        name (str): Stream name used in the spill file name.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_OUTPUT_BYTES, spill_dir=None, name='output'):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.name = name
+        self.lines = collections.deque()
+        self.retained_bytes = 0
+        self.total_bytes = 0
+        self.dropped_bytes = 0
+        self.spill_path = None
+        self._spill_file = None
+
+    def add(self, line):
+        """Append one line (without its trailing newline)."""
+        size = len(line) + 1
+        self.total_bytes += size
+        self.lines.append(line)
+        self.retained_bytes += size
+        if self._spill_file:
+            self._spill_file.write(line + '\n')
+
+        if self.max_bytes is None or self.retained_bytes <= self.max_bytes:
+            return
+
+        if self.spill_dir and not self._spill_file:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            fd, self.spill_path = tempfile.mkstemp(prefix=f'deploymate-{self.name}-', suffix='.log', dir=self.spill_dir)
+            self._spill_file = os.fdopen(fd, 'w', encoding='utf-8')
+            self._spill_file.writelines(retained + '\n' for retained in self.lines)
+
+        while self.retained_bytes > self.max_bytes and len(self.lines) > 1:
+            dropped = self.lines.popleft()
+            self.retained_bytes -= len(dropped) + 1
+            self.dropped_bytes += len(dropped) + 1
+
+    def close(self):
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+
+    @property
+    def truncated(self):
+        return self.dropped_bytes > 0
+
+    @property
+    def text(self):
+        """The retained output, prefixed with a marker if lines were dropped."""
+        body = '\n'.join(self.lines).strip()
+        if not self.truncated:
+            return body
+        where = f", full output in {self.spill_path}" if self.spill_path else ""
+        return f"[... {self.dropped_bytes} bytes truncated{where} ...]\n{body}"
+
+class CommandResult:
+    """Exit code and captured output of a remote command.
+
+    ``duration`` is the command's run time in seconds when it was measured.
+    """
+
+    def __init__(self, command, stdout, stderr, exit_code, duration=None):
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+        self.duration = duration
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    def __iter__(self):
+        # Allows ``stdout, stderr, exit_code = result`` like execute_command
+        return iter((self.stdout.text, self.stderr.text, self.exit_code))
+
+def debug_line_logger(logger):
+    """Return a run_command line_callback logging each line at DEBUG, or None if DEBUG is off."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return None
+
+    def log_line(stream, line):
+        logger.debug("%s: %s", stream, line)
+    return log_line
+
+# Example usage:
+# capture = StreamCapture(max_bytes=1024, spill_dir='/tmp/deploymate-output', name='stdout')
+# for line in lines:
+#     capture.add(line)
+# capture.close()
+# print(capture.text)
@@ -0,0 +1,207 @@
+# content_transfer.py
+
+import functools
+import hashlib
+import logging
+import os
+import re
+import shlex
+from deploymate import tracing
+
+# Prefix of the state and per-file status lines printed by the remote commands
+CONTENT_MARKER = '@@deploymate-content'
+# Distinct contents kept encoded and digested, so a task run on many hosts hashes its content once
+CONTENT_CACHE_SIZE = 32
+
+_MODE_PATTERN = re.compile(r'^0?[0-7]{3,4}$')
+_OWNER_PATTERN = re.compile(r'^[A-Za-z0-9_.][A-Za-z0-9_.-]*(:[A-Za-z0-9_.][A-Za-z0-9_.-]*)?$')
+
+class ContentTransferError(Exception):
+    """Custom exception for content transfer errors."""
+    pass
+
+def file_mode(mode):
+    """Return an octal mode as ``stat -c %a`` prints it, e.g. '644' for '0644'.
+
+    Modes must be strings: YAML reads an unquoted 0644 as the number 420.
+
+    Raises:
+        ContentTransferError: If the mode is not a quoted octal mode.
+    """
+    if not isinstance(mode, str) or not _MODE_PATTERN.match(mode):
+        raise ContentTransferError(f"Invalid file mode {mode!r}: expected a quoted octal mode such as '0644'")
+    return format(int(mode, 8), 'o')
+
+def file_owner(owner):
+    """Return ``owner`` ('user' or 'user:group') if it is a valid owner for chown.
+
+    Raises:
+        ContentTransferError: If the owner is not a user name, optionally followed by ':group'.
+    """
+    if not isinstance(owner, str) or not _OWNER_PATTERN.match(owner):
+        raise ContentTransferError(f"Invalid file owner {owner!r}: expected 'user' or 'user:group'")
+    return owner
+
+@functools.lru_cache(maxsize=CONTENT_CACHE_SIZE)
+def encoded_content(content):
+    """Return the UTF-8 bytes of a content string and their SHA-256 digest."""
+    data = content.encode('utf-8')
+    return data, hashlib.sha256(data).hexdigest()
+
+class ContentTransfer:
+    """Class for writing generated content to remote files over an existing SSH connection."""
+
+    def __init__(self, ssh_client):
+        self.ssh_client = ssh_client
+        self.logger = logging.getLogger(__name__)
+
+    def write_content(self, content, remote_paths, mode=None, owner=None):
+        """Write ``content`` to every remote path, skipping files that already hold it.
+
+        One command reads the digest, mode and owner of every existing file.
+        If any file differs, the content is sent once, over the stdin of a
+        second command, into a staging file next to its target; each target
+        gets a copy that is given its mode and owner and then renamed into
+        place, so a file is never seen half written. Without ``mode`` and
+        ``owner``, a replaced file keeps those of the file it replaces and a
+        new file is 644 and owned by root.
+
+        Args:
+            content (str): The text to write.
+            remote_paths (list): The files to write; parent directories are created.
+            mode (str): Octal mode such as '0644', or None.
+            owner (str): 'user' or 'user:group', or None.
+
+        Returns:
+            list: The remote paths that were written; empty if all were up to date.
+
+        Raises:
+            ContentTransferError: If the mode or owner is invalid, or a file could not be written.
+        """
+        mode = file_mode(mode) if mode is not None else None
+        owner = file_owner(owner) if owner is not None else None
+        data, digest = encoded_content(content)
+
+        states = self.remote_states(remote_paths)
+        pending = []
+        for remote_path in remote_paths:
+            state = states.get(remote_path)
+            if state and state[0] == digest and mode in (None, state[1]) and self._owner_matches(owner, state[2]):
+                self.logger.info("File %s is up to date, skipping write", remote_path)
+            else:
+                pending.append(remote_path)
+        if not pending:
+            return []
+
+        stdout, stderr, _ = self._stream(data, self.write_script(pending, mode, owner))
+        written = set()
+        for line in stdout.splitlines():
+            if line.startswith(f"{CONTENT_MARKER} ok "):
+                written.add(int(line.rsplit(' ', 1)[1]))
+
+        failed = []
+        for index, remote_path in enumerate(pending):
+            if index in written:
+                self.logger.info("Wrote %s bytes to %s", len(data), remote_path)
+            else:
+                failed.append(remote_path)
+        if failed:
+            self.logger.error("Failed to write %s: %s", ', '.join(failed), stderr)
+            raise ContentTransferError(f"Failed to write {len(failed)} of {len(pending)} files: {', '.join(failed)}")
+        return pending
+
+    @staticmethod
+    def _owner_matches(owner, current):
+        if owner is None:
+            return True
+        # 'user' leaves the group alone, 'user:group' sets both
+        return owner == (current if ':' in owner else current.partition(':')[0])
+
+    def remote_states(self, remote_paths):
+        """Return (digest, mode, 'user:group') for each existing remote file, fetched in one command.
+
+        Files that are missing or unreadable are left out of the result.
+        """
+        quoted_paths = " ".join(shlex.quote(path) for path in remote_paths)
+        stdout, _, _ = self.ssh_client.execute_command(
+            f"sudo sha256sum -- {quoted_paths} 2>/dev/null; "
+            f"sudo stat -c '{CONTENT_MARKER} %a %U:%G %n' -- {quoted_paths} 2>/dev/null")
+
+        digests = {}
+        attributes = {}
+        for line in stdout.splitlines():
+            if line.startswith(f"{CONTENT_MARKER} "):
+                _, mode, owner, path = line.split(' ', 3)
+                attributes[path] = (mode, owner)
+            else:
+                digest, _, path = line.partition('  ')
+                if path:
+                    digests[path] = digest
+        return {path: (digest, *attributes[path]) for path, digest in digests.items() if path in attributes}
+
+    @staticmethod
+    def write_script(remote_paths, mode=None, owner=None):
+        """Return the command that writes its stdin to every path in ``remote_paths``.
+
+        Stdin goes to a staging file in the last path's directory; the other
+        paths get copies staged in their own directories, so every rename
+        stays within one filesystem. Each path prints an ok or failed line.
+        """
+        def set_attributes(staged, remote_path):
+            quoted_path = shlex.quote(remote_path)
+            if mode is not None:
+                commands = [f"sudo chmod {mode} -- {staged}"]
+            else:
+                commands = [f"{{ sudo chmod --reference={quoted_path} -- {staged} 2>/dev/null "
+                            f"|| sudo chmod 644 -- {staged}; }}"]
+            if owner is not None:
+                commands.append(f"sudo chown {owner} -- {staged}")
+            else:
+                commands.append(f"{{ sudo chown --reference={quoted_path} -- {staged} 2>/dev/null || true; }}")
+            return " && ".join(commands)
+
+        def staging_template(remote_path):
+            return shlex.quote(os.path.join(os.path.dirname(remote_path) or '.', '.deploymate-content-XXXXXX'))
+
+        copy, staged = '"$copy"', '"$staged"'
+        parent_dirs = sorted({os.path.dirname(remote_path) or '.' for remote_path in remote_paths})
+        last_path = remote_paths[-1]
+        lines = [
+            f"sudo mkdir -p -- {' '.join(shlex.quote(parent_dir) for parent_dir in parent_dirs)} || exit 1",
+            f"staged=$(sudo mktemp -- {staging_template(last_path)}) || exit 1",
+            'sudo tee -- "$staged" > /dev/null || { sudo rm -f -- "$staged"; exit 1; }',
+        ]
+        for index, remote_path in enumerate(remote_paths[:-1]):
+            lines.append(f"copy=; if copy=$(sudo mktemp -- {staging_template(remote_path)}) "
+                         f"&& sudo cp -- {staged} {copy} && {set_attributes(copy, remote_path)} "
+                         f"&& sudo mv -f -- {copy} {shlex.quote(remote_path)}; "
+                         f"then echo '{CONTENT_MARKER} ok {index}'; "
+                         f"else sudo rm -f -- {copy}; echo '{CONTENT_MARKER} failed {index}'; fi")
+        lines.append(f"if {set_attributes(staged, last_path)} "
+                     f"&& sudo mv -f -- {staged} {shlex.quote(last_path)}; "
+                     f"then echo '{CONTENT_MARKER} ok {len(remote_paths) - 1}'; "
+                     f"else sudo rm -f -- {staged}; echo '{CONTENT_MARKER} failed {len(remote_paths) - 1}'; fi")
+        return "\n".join(lines)
+
+    def _stream(self, data, command):
+        """Run ``command`` with ``data`` as its stdin and return its stdout, stderr and exit code.
+
+        Output is read from both streams as it arrives (see CommandStream),
+        so this works on agent channels as well as paramiko ones.
+        """
+        with tracing.span(f"write {len(data)} bytes", tracing.CATEGORY_TRANSFER, bytes=len(data)):
+            stream = self.ssh_client.stream_command(command)
+            try:
+                stream.channel.sendall(data)
+                stream.channel.shutdown_write()
+            except OSError as e:
+                # The command exited early; its stderr explains why
+                self.logger.debug("Content stream interrupted: %s", e)
+            output = {'stdout': [], 'stderr': []}
+            for stream_name, line in stream:
+                output[stream_name].append(line)
+        return "\n".join(output['stdout']), "\n".join(output['stderr']), stream.exit_code
+
+# Example usage:
+# transfer = ContentTransfer(ssh_client)
+# written = transfer.write_content("listen 80;\n", ['/etc/nginx/conf.d/app.conf'], mode='0644', owner='root')
@@ -0,0 +1,392 @@
+# delta_transfer.py
+#
+# rsync-style delta encoding. The remote side describes its copy of a file
+# as a list of per-block (weak, strong) checksums; the controller slides a
+# rolling checksum over the local file to find those blocks at any offset
+# and sends only a recipe of block references plus the literal bytes that
+# did not match. The remote side rebuilds the file next to the target and
+# renames it into place once the result's SHA-256 has been verified.
+# A delta is generated once per local file and remote signature and shared
+# by every host holding the same copy; one that would carry more than
+# MAX_LITERAL_RATIO of the file as literals is abandoned for a full upload.
+
+import collections
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+DELTA_MAGIC = b'DMDELTA1'
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 128 * 1024
+# Literal bytes buffered before they are flushed as one 'L' op
+MAX_LITERAL_CHUNK = 1024 * 1024
+# Bytes scanned per slice of the file while no block matches
+SCAN_WINDOW = 64 * 1024
+# Share of the file that may be sent as literals before a full upload is used instead
+MAX_LITERAL_RATIO = 0.5
+# Deltas kept for hosts whose copy has the same signature
+MAX_CACHED_DELTAS = 4
+# Bytes read per iteration when streaming a cached delta
+DELTA_READ_CHUNK = 1024 * 1024
+
+ADLER_MOD = 65521
+
+# Runs remotely as: python3 -c SCRIPT <path> <block_size>. Prints 'DMSIG missing' if the
+# file does not exist, otherwise a 'DMSIG <size> <block_size>' header and one
+# '<adler32> <blake2b-128 hex>' line per block.
+REMOTE_SIGNATURE_SCRIPT = r'''
+import hashlib, os, sys, zlib
+path, block_size = sys.argv[1], int(sys.argv[2])
+if not os.path.isfile(path):
+    print('DMSIG missing')
+    sys.exit(0)
+out = sys.stdout
+out.write('DMSIG %d %d\n' % (os.path.getsize(path), block_size))
+with open(path, 'rb') as f:
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        out.write('%d %s\n' % (zlib.adler32(block), hashlib.blake2b(block, digest_size=16).hexdigest()))
+'''
+
+# Runs remotely as: python3 -c SCRIPT <basis> <target> <sha256>, reading the delta on stdin.
+REMOTE_PATCH_SCRIPT = r'''
+import hashlib, os, struct, sys, tempfile
+basis_path, target_path, expected = sys.argv[1], sys.argv[2], sys.argv[3]
+stdin = sys.stdin.buffer
+def read_exact(size):
+    data = stdin.read(size)
+    if len(data) != size:
+        sys.exit('deploymate delta: truncated input')
+    return data
+if read_exact(8) != b'DMDELTA1':
+    sys.exit('deploymate delta: bad header')
+block_size = struct.unpack('>I', read_exact(4))[0]
+fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(target_path) or '.', prefix='.deploymate-delta-')
+digest = hashlib.sha256()
+try:
+    with open(basis_path, 'rb') as basis, os.fdopen(fd, 'wb') as out:
+        while True:
+            op = read_exact(1)
+            if op == b'E':
+                break
+            if op == b'C':
+                start, count = struct.unpack('>II', read_exact(8))
+                basis.seek(start * block_size)
+                remaining = count * block_size
+                while remaining:
+                    data = basis.read(min(remaining, 1 << 20))
+                    if not data:
+                        break
+                    out.write(data)
+                    digest.update(data)
+                    remaining -= len(data)
+            elif op == b'L':
+                data = read_exact(struct.unpack('>I', read_exact(4))[0])
+                out.write(data)
+                digest.update(data)
+            else:
+                sys.exit('deploymate delta: bad op')
+        out.flush()
+        os.fsync(out.fileno())
+    if digest.hexdigest() != expected:
+        sys.exit('deploymate delta: checksum mismatch')
+    basis_stat = os.stat(basis_path)
+    os.chmod(temporary_path, basis_stat.st_mode & 0o7777)
+    try:
+        os.chown(temporary_path, basis_stat.st_uid, basis_stat.st_gid)
+    except OSError:
+        pass
+    os.replace(temporary_path, target_path)
+except BaseException:
+    os.unlink(temporary_path)
+    raise
+print('DMPATCH ok')
+'''
+
+class DeltaTransferError(Exception):
+    """Custom exception for delta transfer errors."""
+    pass
+
+class DeltaTooLargeError(DeltaTransferError):
+    """Raised when a delta would carry more literal bytes than is worth sending."""
+    pass
+
+class DeltaStats:
+    """Byte counts of one delta transfer."""
+
+    def __init__(self, file_size=0):
+        self.file_size = file_size
+        self.signature_bytes = 0
+        self.delta_bytes = 0
+        self.literal_bytes = 0
+        self.matched_blocks = 0
+        self.full_transfer = False
+
+    @property
+    def bytes_on_wire(self):
+        return self.signature_bytes + (self.file_size if self.full_transfer else self.delta_bytes)
+
+    def __repr__(self):
+        return (f"DeltaStats(file_size={self.file_size}, signature_bytes={self.signature_bytes}, "
+                f"delta_bytes={self.delta_bytes}, matched_blocks={self.matched_blocks}, "
+                f"full_transfer={self.full_transfer})")
+
+def choose_block_size(file_size):
+    """Pick a block size of roughly sqrt(file_size), rounded to 1 KiB and clamped."""
+    block_size = int(math.sqrt(file_size)) // 1024 * 1024
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+class Signature:
+    """Parsed block signature of the remote copy of a file."""
+
+    def __init__(self, file_size, block_size, blocks, digest=None):
+        self.file_size = file_size
+        self.block_size = block_size
+        self.blocks = blocks
+        # SHA-256 of the signature output; equal digests mean equal remote copies
+        self.digest = digest
+        self.weak_index = {}
+        for index, (weak, strong) in enumerate(blocks):
+            self.weak_index.setdefault(weak, {}).setdefault(strong, index)
+
+    def find(self, weak, data):
+        """Return the index of a block matching ``data`` with weak checksum ``weak``, or None."""
+        candidates = self.weak_index.get(weak)
+        if not candidates:
+            return None
+        return candidates.get(hashlib.blake2b(data, digest_size=16).hexdigest())
+
+def parse_signature(output):
+    """Parse REMOTE_SIGNATURE_SCRIPT output; returns None if the remote file is missing."""
+    lines = output.splitlines()
+    if not lines or not lines[0].startswith('DMSIG '):
+        raise DeltaTransferError(f"Unexpected signature output: {output[:200]!r}")
+    header = lines[0].split()
+    if header[1] == 'missing':
+        return None
+    blocks = []
+    for line in lines[1:]:
+        weak, strong = line.split()
+        blocks.append((int(weak), strong))
+    return Signature(int(header[1]), int(header[2]), blocks, hashlib.sha256(output.encode()).hexdigest())
+
+def generate_delta(local_path, signature, stats=None, max_literal_bytes=None):
+    """Yield the delta that turns the remote copy described by ``signature`` into ``local_path``.
+
+    Blocks are searched at every byte offset with a rolling Adler-32, so data
+    that merely moved is still matched. A block is only sliced and hashed
+    when its weak checksum appears in the signature; unchanged regions
+    advance a block at a time.
+
+    Raises:
+        DeltaTooLargeError: If more than ``max_literal_bytes`` would be sent as literals.
+    """
+    block_size = signature.block_size
+    weak_index = signature.weak_index
+    stats = stats or DeltaStats(os.path.getsize(local_path))
+    yield DELTA_MAGIC + struct.pack('>I', block_size)
+    stats.delta_bytes += len(DELTA_MAGIC) + 4
+
+    pending_copy = None  # [start, count]
+
+    def flush_copy():
+        nonlocal pending_copy
+        if pending_copy:
+            op = b'C' + struct.pack('>II', *pending_copy)
+            stats.delta_bytes += len(op)
+            pending_copy = None
+            return op
+        return b''
+
+    def literal(data):
+        stats.literal_bytes += len(data)
+        if max_literal_bytes is not None and stats.literal_bytes > max_literal_bytes:
+            raise DeltaTooLargeError(f"{local_path} differs in more than {max_literal_bytes} bytes")
+        op = b'L' + struct.pack('>I', len(data)) + data
+        stats.delta_bytes += len(op)
+        return op
+
+    with open(local_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            yield b'E'
+            stats.delta_bytes += 1
+            return
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = 0
+            literal_start = 0
+            weak = None
+            last_block = len(signature.blocks) - 1
+            tail_size = signature.file_size - last_block * block_size if signature.blocks else 0
+
+            while position + block_size <= size:
+                if weak is None:
+                    weak = zlib.adler32(data[position:position + block_size])
+                    low, high = weak & 0xffff, weak >> 16
+
+                if weak in weak_index:
+                    index = signature.find(weak, data[position:position + block_size])
+                    if index is not None and (index != last_block or tail_size == block_size):
+                        if literal_start < position:
+                            yield flush_copy() + literal(data[literal_start:position])
+                        if pending_copy and pending_copy[0] + pending_copy[1] == index:
+                            pending_copy[1] += 1
+                        else:
+                            copy_op = flush_copy()
+                            if copy_op:
+                                yield copy_op
+                            pending_copy = [index, 1]
+                        stats.matched_blocks += 1
+                        position += block_size
+                        literal_start = position
+                        weak = None
+                        continue
+
+                if position + block_size == size:
+                    position += 1
+                    break
+
+                # Roll the checksum forward until it names a block of the signature
+                stop = min(size - block_size, position + SCAN_WINDOW, literal_start + MAX_LITERAL_CHUNK)
+                window = data[position:stop + block_size]
+                for position, outgoing, incoming in zip(range(position + 1, stop + 1), window,
+                                                        window[block_size:]):
+                    low = (low - outgoing + incoming) % ADLER_MOD
+                    high = (high - block_size * outgoing + low - 1) % ADLER_MOD
+                    weak = (high << 16) | low
+                    if weak in weak_index:
+                        break
+
+                if position - literal_start >= MAX_LITERAL_CHUNK:
+                    yield flush_copy() + literal(data[literal_start:position])
+                    literal_start = position
+
+            # The remote file's last block is usually short; match it against the local tail
+            if signature.blocks and 0 < tail_size < block_size and size - literal_start >= tail_size:
+                tail = data[size - tail_size:size]
+                if signature.find(zlib.adler32(tail), tail) == last_block:
+                    if literal_start < size - tail_size:
+                        yield flush_copy() + literal(data[literal_start:size - tail_size])
+                    copy_op = flush_copy()
+                    if copy_op:
+                        yield copy_op
+                    pending_copy = [last_block, 1]
+                    stats.matched_blocks += 1
+                    literal_start = size
+
+            while literal_start < size:
+                end = min(size, literal_start + MAX_LITERAL_CHUNK)
+                yield flush_copy() + literal(data[literal_start:end])
+                literal_start = end
+        finally:
+            data.close()
+
+    yield flush_copy() + b'E'
+    stats.delta_bytes += 1
+
+class CachedDelta:
+    """A delta generated once into a temporary file, readable by any number of hosts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.file = None
+        self.stats = None
+        self.error = None
+
+    def chunks(self):
+        """Yield the delta from the start; safe to call from several threads at once."""
+        fd = self.file.fileno()
+        offset = 0
+        while True:
+            chunk = os.pread(fd, DELTA_READ_CHUNK, offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+class DeltaCache:
+    """Deltas by local file and remote signature, so hosts holding the same copy share one.
+
+    The first host to ask for a (file, signature) pair generates the delta;
+    hosts asking meanwhile wait for it instead of generating their own. A
+    delta abandoned as too large is remembered the same way.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_DELTAS, max_literal_ratio=MAX_LITERAL_RATIO):
+        self.max_entries = max_entries
+        self.max_literal_ratio = max_literal_ratio
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def delta(self, local_path, signature):
+        """Return the CachedDelta that turns the copy described by ``signature`` into ``local_path``.
+
+        Raises:
+            DeltaTooLargeError: If the literals would exceed max_literal_ratio of the file.
+        """
+        stat = os.stat(local_path)
+        key = (os.path.abspath(local_path), stat.st_size, stat.st_mtime_ns, signature.digest)
+        with self._lock:
+            entry = self._entries.get(key) if signature.digest else None
+            if entry is None:
+                entry = CachedDelta()
+                if signature.digest:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+
+        with entry.lock:
+            if entry.file is None and entry.error is None:
+                try:
+                    self._generate(entry, local_path, signature, stat.st_size)
+                except DeltaTooLargeError as e:
+                    entry.error = str(e)
+                except BaseException:
+                    with self._lock:
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                    raise
+        if entry.error is not None:
+            raise DeltaTooLargeError(entry.error)
+        return entry
+
+    def _generate(self, entry, local_path, signature, file_size):
+        stats = DeltaStats(file_size)
+        file = tempfile.TemporaryFile(prefix='deploymate-delta-')
+        try:
+            for chunk in generate_delta(local_path, signature, stats, int(file_size * self.max_literal_ratio)):
+                file.write(chunk)
+            file.flush()
+        except BaseException:
+            file.close()
+            raise
+        entry.file = file
+        entry.stats = stats
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_delta_cache():
+    """Return the process-wide DeltaCache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = DeltaCache()
+        return _default_cache
+
+# Example usage:
+# signature = parse_signature(remote_signature_output)
+# for chunk in generate_delta('release.tar', signature):
+#     channel.sendall(chunk)
+# for chunk in get_delta_cache().delta('release.tar', signature).chunks():
+#     channel.sendall(chunk)
@@ -0,0 +1,120 @@
+# digest_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+DEFAULT_DIGEST_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'deploymate', 'digests.json')
+
+# Bytes read per iteration when hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+def file_sha256(file_path):
+    """Return the hex SHA-256 digest of a local file."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class LocalDigestCache:
+    """SHA-256 digests of local files, persisted between runs.
+
+    Entries are keyed by absolute path and stored with the file's size and
+    mtime; a file is only re-hashed when either of them changes. Threads
+    asking for a file that another thread is hashing wait for its result.
+    """
+
+    def __init__(self, cache_path=DEFAULT_DIGEST_CACHE_PATH):
+        self.cache_path = cache_path
+        self._entries = None
+        self._lock = threading.Lock()
+        # (path, size, mtime_ns) -> Future of the digest being computed
+        self._hashing = {}
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r') as file:
+                self._entries = json.load(file)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temporary_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, 'w') as file:
+                json.dump(self._entries, file)
+            os.replace(temporary_path, self.cache_path)
+        except OSError as e:
+            logger.warning("Could not write digest cache %s: %s", self.cache_path, e)
+
+    def _digest(self, absolute_path):
+        """Return (digest, hashed), hashing the file unless it is cached or already being hashed."""
+        stat = os.stat(absolute_path)
+        key = (absolute_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(absolute_path)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                return entry['sha256'], False
+            future = self._hashing.get(key)
+            hashing = future is None
+            if hashing:
+                future = self._hashing[key] = Future()
+        if not hashing:
+            return future.result(), False
+
+        try:
+            sha256 = file_sha256(absolute_path)
+        except BaseException as e:
+            with self._lock:
+                del self._hashing[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._entries[absolute_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+            del self._hashing[key]
+        future.set_result(sha256)
+        return sha256, True
+
+    def digest(self, file_path):
+        """Return the SHA-256 digest of a local file, hashing it only if it changed."""
+        sha256, hashed = self._digest(os.path.abspath(file_path))
+        if hashed:
+            with self._lock:
+                self._save()
+        return sha256
+
+    def digests(self, file_paths):
+        """Return {path: SHA-256 digest} for several local files, writing the cache at most once."""
+        results = {}
+        changed = False
+        for file_path in file_paths:
+            results[file_path], hashed = self._digest(os.path.abspath(file_path))
+            changed = changed or hashed
+        if changed:
+            with self._lock:
+                self._save()
+        return results
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_digest_cache():
+    """Return the process-wide LocalDigestCache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LocalDigestCache()
+        return _default_cache
+
+# Example usage:
+# digest = get_digest_cache().digest('deploymate/config/files_to_upload/app.tar.gz')
+# digests = get_digest_cache().digests(['a.conf', 'b.conf'])
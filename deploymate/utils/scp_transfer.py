@@ -1,6 +1,12 @@
 from scp import SCPClient, SCPException
 import logging
 import os
+import shlex
+from deploymate import tracing
+from deploymate.utils.delta_transfer import (DeltaStats, DeltaTooLargeError, DeltaTransferError,
+                                             REMOTE_PATCH_SCRIPT, REMOTE_SIGNATURE_SCRIPT, choose_block_size,
+                                             get_delta_cache, parse_signature)
+from deploymate.utils.digest_cache import get_digest_cache
 
 class SCPTransferError(Exception):
     """Custom exception for SCP transfer errors."""
@@ -13,18 +19,152 @@ class SCPTransfer:
         self.ssh_client = ssh_client
         self.logger = logging.getLogger(__name__)
 
+    def upload_files(self, local_paths, remote_dir):
+        """Upload several files into a remote directory over one SCP session.
+
+        Files are streamed back to back through a single ``scp -t`` channel.
+        Since SCP names remote files after their local basename, files sharing
+        a basename go to numbered subdirectories of ``remote_dir``, which must
+        already exist; one extra session is used per such subdirectory.
+
+        Returns:
+            dict: The remote path each local path was uploaded to.
+        """
+        groups = []
+        for local_path in local_paths:
+            if not os.path.isfile(local_path):
+                raise SCPTransferError(f"Local file does not exist: {local_path}")
+            basename = os.path.basename(local_path)
+            for group in groups:
+                if basename not in group:
+                    group[basename] = local_path
+                    break
+            else:
+                groups.append({basename: local_path})
+
+        remote_paths = {}
+        try:
+            with tracing.span(f"scp to {remote_dir}", tracing.CATEGORY_TRANSFER, files=len(local_paths),
+                              bytes=sum(os.path.getsize(local_path) for local_path in local_paths)), \
+                    SCPClient(self.ssh_client.get_transport()) as scp:
+                for index, group in enumerate(groups):
+                    group_dir = remote_dir if index == 0 else f"{remote_dir}/{index}"
+                    if index > 0:
+                        self.ssh_client.execute_command(f"mkdir -p {shlex.quote(group_dir)}")
+                    scp.put(list(group.values()), group_dir)
+                    for basename, local_path in group.items():
+                        remote_paths[local_path] = f"{group_dir}/{basename}"
+            self.logger.info("%s files uploaded to %s", len(remote_paths), remote_dir)
+        except SCPException as e:
+            self.logger.error("Failed to upload files via SCP: %s", e)
+            raise SCPTransferError(f"Failed to upload files to {remote_dir}")
+        return remote_paths
+
     def upload_file(self, local_path, remote_path):
         if not os.path.exists(local_path) or not os.path.isfile(local_path):
             raise SCPTransferError(f"Local file does not exist: {local_path}")
 
         try:
-            with SCPClient(self.ssh_client.get_transport()) as scp:
+            with tracing.span(f"scp to {remote_path}", tracing.CATEGORY_TRANSFER, files=1,
+                              bytes=os.path.getsize(local_path)), \
+                    SCPClient(self.ssh_client.get_transport()) as scp:
                 scp.put(local_path, remote_path)
-                self.logger.info(f"File uploaded to {remote_path}")
+                self.logger.info("File uploaded to %s", remote_path)
         except SCPException as e:
-            self.logger.error(f"Failed to upload file via SCP: {e}")
+            self.logger.error("Failed to upload file via SCP: %s", e)
             raise SCPTransferError(f"Failed to upload file to {remote_path}")
 
+    def upload_file_delta(self, local_path, remote_path, use_sudo=False, block_size=None):
+        """Update a remote file by sending only the blocks that differ from the local file.
+
+        The remote copy's block signatures are fetched first; the local file is
+        then encoded as references to those blocks plus the changed bytes and
+        streamed to a remote script that rebuilds the file beside the original,
+        verifies its SHA-256 and renames it into place. Both remote steps need
+        python3 on the host. The delta is shared with other hosts whose copy
+        has the same signature. When there is no remote copy, or the delta
+        would carry more than half the file, the whole file is sent with
+        upload_file instead.
+
+        Args:
+            local_path (str): The local file to send.
+            remote_path (str): The remote file to update.
+            use_sudo (bool): Read and replace the remote file as root.
+            block_size (int): Signature block size; chosen from the file size if not given.
+
+        Returns:
+            DeltaStats: The number of bytes sent and received.
+
+        Raises:
+            SCPTransferError: If the signature or the rebuild fails.
+        """
+        if not os.path.isfile(local_path):
+            raise SCPTransferError(f"Local file does not exist: {local_path}")
+
+        stats = DeltaStats(os.path.getsize(local_path))
+        block_size = block_size or choose_block_size(stats.file_size)
+        sudo = 'sudo ' if use_sudo else ''
+        quoted_path = shlex.quote(remote_path)
+
+        stdout, stderr, exit_code = self.ssh_client.run_command(
+            f"{sudo}python3 -c {shlex.quote(REMOTE_SIGNATURE_SCRIPT)} {quoted_path} {block_size}",
+            max_output_bytes=None)
+        if exit_code != 0:
+            raise SCPTransferError(f"Failed to read block signatures of {remote_path}: {stderr}")
+        stats.signature_bytes = len(stdout)
+        try:
+            signature = parse_signature(stdout)
+        except (DeltaTransferError, ValueError) as e:
+            raise SCPTransferError(f"Invalid block signatures for {remote_path}: {e}")
+
+        if signature is None:
+            self.logger.info("No remote copy of %s, sending the whole file", remote_path)
+            self.upload_file(local_path, remote_path)
+            stats.full_transfer = True
+            return stats
+
+        try:
+            delta = get_delta_cache().delta(local_path, signature)
+        except DeltaTooLargeError as e:
+            self.logger.info("%s, sending the whole file to %s", e, remote_path)
+            self.upload_file(local_path, remote_path)
+            stats.full_transfer = True
+            return stats
+        except OSError as e:
+            raise SCPTransferError(f"Failed to compute delta of {local_path}: {e}")
+        stats.delta_bytes = delta.stats.delta_bytes
+        stats.literal_bytes = delta.stats.literal_bytes
+        stats.matched_blocks = delta.stats.matched_blocks
+
+        expected_digest = get_digest_cache().digest(local_path)
+        command = (f"{sudo}python3 -c {shlex.quote(REMOTE_PATCH_SCRIPT)} {quoted_path} {quoted_path} "
+                   f"{expected_digest}")
+        with tracing.span(f"delta to {remote_path}", tracing.CATEGORY_TRANSFER, files=1) as span:
+            channel = self.ssh_client.get_transport().open_session()
+            try:
+                channel.exec_command(command)
+                try:
+                    for chunk in delta.chunks():
+                        channel.sendall(chunk)
+                    channel.shutdown_write()
+                except OSError as e:
+                    # The remote script exited early; its stderr explains why
+                    self.logger.debug("Delta stream to %s interrupted: %s", remote_path, e)
+                exit_code = channel.recv_exit_status()
+                stderr = channel.makefile_stderr('rb').read().decode('utf-8', errors='replace')
+            finally:
+                channel.close()
+            span.set(bytes=stats.delta_bytes)
+
+        if exit_code != 0:
+            self.logger.error("Failed to rebuild %s from delta: %s", remote_path, stderr)
+            raise SCPTransferError(f"Failed to rebuild {remote_path} from delta")
+        self.logger.info("File %s updated by delta: sent %s of %s bytes (%s blocks reused)", remote_path,
+                         stats.delta_bytes, stats.file_size, stats.matched_blocks)
+        return stats
+
 # Example usage:
 # scp_transfer = SCPTransfer(ssh_client)
 # scp_transfer.upload_file('path/to/local/file.txt', '/remote/path/file.txt')
+# scp_transfer.upload_files(['a.conf', 'b.conf'], '/remote/staging')
+# stats = scp_transfer.upload_file_delta('release.tar', '/opt/app/release.tar', use_sudo=True)
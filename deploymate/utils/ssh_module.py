@@ -1,72 +1,330 @@
 import paramiko
 import logging
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from deploymate import tracing
+from deploymate.log_pipeline import log_context
+from deploymate.utils.scp_transfer import SCPTransfer
+from deploymate.utils.tar_transfer import TarStreamTransfer
+from deploymate.utils.content_transfer import ContentTransfer
+from deploymate.utils.command_output import StreamCapture, CommandResult, DEFAULT_MAX_OUTPUT_BYTES
+from deploymate.utils.apt_state import AptListsState, DEFAULT_APT_FRESHNESS_WINDOW
+from deploymate.utils.agent_client import AgentTransport, AgentError, AgentUnavailableError
+
+# Seconds to wait for the TCP connection and SSH banner before giving up on a host
+DEFAULT_CONNECT_TIMEOUT = 10
+# Seconds to wait for authentication to complete once the handshake is done
+DEFAULT_AUTH_TIMEOUT = 30
+# Maximum number of SSH handshakes in flight at the same time
+DEFAULT_MAX_PARALLEL_CONNECTS = 20
+# Bytes read from a channel per recv call while streaming output
+STREAM_CHUNK_SIZE = 32 * 1024
+
+# Marks run_command arguments that fall back to the connection's setting
+_CONNECTION_DEFAULT = object()
 
 class SSHConnectionError(Exception):
     """Custom exception for SSH connection errors."""
     pass
 
+class CommandStream:
+    """Iterates over the output of a running command as (stream, line) tuples.
+
+    ``stream`` is either 'stdout' or 'stderr'. Output is read from both
+    streams as it arrives, so the remote side never blocks on a full channel
+    window. ``exit_code`` is set once iteration has finished.
+    """
+    def __init__(self, channel, poll_timeout=1.0):
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.exit_code = None
+
+    @staticmethod
+    def _split_lines(stream, pending, data):
+        lines = (pending + data).split(b'\n')
+        for line in lines[:-1]:
+            yield stream, line.decode('utf-8', errors='replace')
+        pending[:] = lines[-1]
+
+    def __iter__(self):
+        channel = self.channel
+        pending = {'stdout': bytearray(), 'stderr': bytearray()}
+        try:
+            while True:
+                read_any = False
+                while channel.recv_ready():
+                    read_any = True
+                    yield from self._split_lines('stdout', pending['stdout'], channel.recv(STREAM_CHUNK_SIZE))
+                while channel.recv_stderr_ready():
+                    read_any = True
+                    yield from self._split_lines('stderr', pending['stderr'], channel.recv_stderr(STREAM_CHUNK_SIZE))
+                if read_any:
+                    continue
+                if channel.eof_received or channel.closed:
+                    # Output may have arrived together with the EOF after the checks above
+                    if channel.recv_ready() or channel.recv_stderr_ready():
+                        continue
+                    break
+                # Wake up as soon as either stream has data or the channel closes
+                select.select([channel], [], [], self.poll_timeout)
+
+            for stream, data in pending.items():
+                if data:
+                    yield stream, bytes(data).decode('utf-8', errors='replace')
+            self.exit_code = channel.recv_exit_status()
+        finally:
+            channel.close()
+
+class PrivateKeyCache:
+    """Loads each private key file once and shares the parsed key between hosts."""
+    def __init__(self):
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key_file):
+        """Return the parsed key for a key file, loading it on first use."""
+        with self._lock:
+            if key_file not in self._keys:
+                try:
+                    self._keys[key_file] = paramiko.PKey.from_path(key_file)
+                except (paramiko.SSHException, OSError) as e:
+                    raise SSHConnectionError(f"Failed to load private key {key_file}: {e}")
+            return self._keys[key_file]
+
 class SSHConnection:
-    """Represents an SSH connection to a single host."""
-    def __init__(self, host, user, password=None, key_file=None, port=22):
+    """Represents an SSH connection to a single host.
+
+    With ``agent_socket``, the SSH session is held by the connection agent
+    (see deploymate.agent) and reused across runs; if no agent is listening,
+    the host is connected to directly.
+    """
+    def __init__(self, host, user, password=None, key_file=None, port=22, pkey=None,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, auth_timeout=DEFAULT_AUTH_TIMEOUT,
+                 max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, output_spill_dir=None,
+                 apt_freshness_window=DEFAULT_APT_FRESHNESS_WINDOW, agent_socket=None):
         self.host = host
         self.user = user
         self.password = password
         self.key_file = key_file
         self.port = port
+        self.pkey = pkey
+        self.connect_timeout = connect_timeout
+        self.auth_timeout = auth_timeout
+        self.max_output_bytes = max_output_bytes
+        self.output_spill_dir = output_spill_dir
+        # HostFacts attached by the executor when fact gathering is enabled
+        self.facts = None
+        # HostTemplates attached by the executor, see deploymate.templates
+        self.templates = None
+        self.apt_state = AptListsState(apt_freshness_window)
+        self.agent_socket = agent_socket
+        self.agent_transport = None
         self.client = None
 
     def connect(self):
         """Establish an SSH connection."""
+        if self.agent_socket and self._connect_through_agent():
+            return
         try:
             self.client = paramiko.SSHClient()
             self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            if self.key_file:
-                self.client.connect(self.host, port=self.port, username=self.user, key_filename=self.key_file)
+            timeouts = {
+                'timeout': self.connect_timeout,
+                'banner_timeout': self.connect_timeout,
+                'auth_timeout': self.auth_timeout,
+            }
+            if self.pkey:
+                self.client.connect(self.host, port=self.port, username=self.user, pkey=self.pkey, **timeouts)
+            elif self.key_file:
+                self.client.connect(self.host, port=self.port, username=self.user, key_filename=self.key_file, **timeouts)
             else:
-                self.client.connect(self.host, port=self.port, username=self.user, password=self.password)
-            logging.info(f"SSH connection established with {self.host}")
-        except paramiko.SSHException as e:
+                self.client.connect(self.host, port=self.port, username=self.user, password=self.password, **timeouts)
+            logging.info("SSH connection established with %s", self.host)
+        except (paramiko.SSHException, OSError) as e:
+            # OSError covers refused connections and socket timeouts
             raise SSHConnectionError(f"Failed to establish SSH connection with {self.host}: {e}")
 
-    def execute_command(self, command):
-        """Execute a command on the SSH server and return stdout, stderr, and exit code."""
-        if not self.client:
+    def _connect_through_agent(self):
+        """Get the session from the connection agent; returns False if no agent is listening."""
+        transport = AgentTransport(self.agent_socket, {
+            'host': self.host, 'port': self.port, 'user': self.user, 'password': self.password,
+            'key_file': self.key_file, 'connect_timeout': self.connect_timeout, 'auth_timeout': self.auth_timeout,
+        })
+        try:
+            reused = transport.connect()
+        except AgentUnavailableError as e:
+            logging.warning("%s; connecting to %s directly", e, self.host)
+            return False
+        except AgentError as e:
+            raise SSHConnectionError(f"Failed to establish SSH connection with {self.host}: {e}")
+        self.agent_transport = transport
+        logging.info("SSH connection with %s %s the connection agent", self.host,
+                     'reused from' if reused else 'opened by')
+        return True
+
+    def stream_command(self, command):
+        """Start a command and return a CommandStream over its output lines."""
+        if not self.client and not self.agent_transport:
             raise SSHConnectionError("SSH client not connected")
 
-        stdin, stdout, stderr = self.client.exec_command(command)
-        exit_code = stdout.channel.recv_exit_status()
-        stdout_data = stdout.read().decode('utf-8').strip()
-        stderr_data = stderr.read().decode('utf-8').strip()
+        try:
+            channel = self.get_transport().open_session()
+            channel.exec_command(command)
+        except (paramiko.SSHException, OSError) as e:
+            raise SSHConnectionError(f"Failed to execute command on {self.host}: {e}")
+        return CommandStream(channel)
+
+    def run_command(self, command, line_callback=None, max_output_bytes=_CONNECTION_DEFAULT,
+                    spill_dir=_CONNECTION_DEFAULT):
+        """Execute a command, streaming its output into bounded captures.
+
+        Args:
+            command (str): The command to run.
+            line_callback (callable): Optional function called with (stream, line)
+                for every line as it arrives.
+            max_output_bytes (int): Per-stream memory budget, or None for no
+                limit; defaults to the connection's ``max_output_bytes``.
+            spill_dir (str): Directory to spill oversized output to; defaults to
+                the connection's ``output_spill_dir``.
+
+        Returns:
+            CommandResult: The exit code and captured stdout/stderr.
+        """
+        if max_output_bytes is _CONNECTION_DEFAULT:
+            max_output_bytes = self.max_output_bytes
+        if spill_dir is _CONNECTION_DEFAULT:
+            spill_dir = self.output_spill_dir
+
+        captures = {
+            'stdout': StreamCapture(max_output_bytes, spill_dir, name='stdout'),
+            'stderr': StreamCapture(max_output_bytes, spill_dir, name='stderr'),
+        }
+        with tracing.span(tracing.command_label(command), tracing.CATEGORY_COMMAND, address=self.host) as span:
+            stream = self.stream_command(command)
+            try:
+                for stream_name, line in stream:
+                    captures[stream_name].add(line)
+                    if line_callback:
+                        line_callback(stream_name, line)
+            finally:
+                for capture in captures.values():
+                    capture.close()
+            span.set(exit_code=stream.exit_code)
+        return CommandResult(command, captures['stdout'], captures['stderr'], stream.exit_code)
+
+    def execute_command(self, command):
+        """Execute a command on the SSH server and return stdout, stderr, and exit code.
+
+        Output is kept in full; use run_command for commands with large output.
+        """
+        stdout_data, stderr_data, exit_code = self.run_command(command, max_output_bytes=None)
         return stdout_data, stderr_data, exit_code
 
+    def upload_file(self, local_path, remote_path):
+        """Copy a local file to the remote host over SCP."""
+        SCPTransfer(self).upload_file(local_path, remote_path)
+
+    def upload_files(self, local_paths, remote_dir):
+        """Copy several local files into a remote directory over one SCP session.
+
+        Returns the remote path of each local file, see SCPTransfer.upload_files.
+        """
+        return SCPTransfer(self).upload_files(local_paths, remote_dir)
+
+    def upload_file_delta(self, local_path, remote_path, use_sudo=False):
+        """Update a remote file with an rsync-style delta, see SCPTransfer.upload_file_delta."""
+        return SCPTransfer(self).upload_file_delta(local_path, remote_path, use_sudo=use_sudo)
+
+    def upload_tree(self, local_dir, remote_dir, delete_missing=False):
+        """Copy a local directory tree as one compressed tar stream, see TarStreamTransfer.upload_tree."""
+        return TarStreamTransfer(self).upload_tree(local_dir, remote_dir, delete_missing=delete_missing)
+
+    def write_content(self, content, remote_paths, mode=None, owner=None):
+        """Stream text into remote files, skipping those already up to date, see ContentTransfer.write_content."""
+        return ContentTransfer(self).write_content(content, remote_paths, mode=mode, owner=owner)
+
     def get_transport(self):
         """Return the transport object of the SSH connection."""
+        if self.agent_transport:
+            return self.agent_transport
         if self.client:
             return self.client.get_transport()
         else:
             raise SSHConnectionError("SSH client not connected or transport not available")
 
     def disconnect(self):
-        """Close the SSH connection."""
+        """Close the SSH connection; a session held by the connection agent stays open."""
+        self.agent_transport = None
         if self.client:
             self.client.close()
-            logging.info(f"SSH connection closed with {self.host}")
+            logging.info("SSH connection closed with %s", self.host)
 
 class SSHConnectionManager:
     """Manages multiple SSH connections."""
-    def __init__(self):
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, auth_timeout=DEFAULT_AUTH_TIMEOUT,
+                 max_parallel_connects=DEFAULT_MAX_PARALLEL_CONNECTS, connection_options=None):
+        self.connection_options = connection_options or {}
+        self.connect_timeout = connect_timeout
+        self.auth_timeout = auth_timeout
+        self.max_parallel_connects = max_parallel_connects
+        self.key_cache = PrivateKeyCache()
         self.connections = {}
+        self.connect_times = {}
+        self.failed_hosts = {}
 
-    def establish_connections(self, hosts):
-        """Establish SSH connections to multiple hosts."""
-        for host_name, host_info in hosts.items():
-            try:
-                connection = SSHConnection(**host_info)
+    def _connect_host(self, host_name, host_info):
+        """Open a connection to one host and record how long the handshake took."""
+        host_info = dict(self.connection_options, **host_info)
+        key_file = host_info.get('key_file')
+        start = time.monotonic()
+        try:
+            with log_context(host_name), tracing.span('connect', tracing.CATEGORY_CONNECT, host=host_name):
+                if key_file and 'pkey' not in host_info:
+                    host_info['pkey'] = self.key_cache.get(key_file)
+                connection = SSHConnection(connect_timeout=self.connect_timeout, auth_timeout=self.auth_timeout,
+                                           **host_info)
                 connection.connect()
-                self.connections[host_name] = connection
-                logging.info(f"Connected to {host_name}")
-            except SSHConnectionError as e:
-                logging.error(f"{e}")
+        except SSHConnectionError as e:
+            self.failed_hosts[host_name] = str(e)
+            logging.error("%s", e)
+            return
+        except Exception as e:
+            # A key that fails to load, or a socket or paramiko error raised outside connect()
+            self.failed_hosts[host_name] = f"Failed to establish SSH connection with {host_name}: {e}"
+            logging.error("Failed to establish SSH connection with %s: %s", host_name, e)
+            return
+        self.connections[host_name] = connection
+        self.connect_times[host_name] = time.monotonic() - start
+        logging.info("Connected to %s in %.2fs", host_name, self.connect_times[host_name])
+
+    def establish_connections(self, hosts):
+        """Establish SSH connections to multiple hosts concurrently.
+
+        At most ``max_parallel_connects`` handshakes run at once. Hosts that
+        cannot be reached within the configured timeouts are recorded in
+        ``failed_hosts`` instead of stalling the others.
+
+        Args:
+            hosts (dict): Mapping of host name to SSHConnection keyword arguments.
+
+        Returns:
+            dict: Handshake duration in seconds for each host that came up.
+        """
+        if hosts:
+            workers = min(self.max_parallel_connects, len(hosts))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(self._connect_host, host_name, host_info): host_name
+                           for host_name, host_info in hosts.items()}
+            for future, host_name in futures.items():
+                error = future.exception()
+                if error is not None:
+                    self.failed_hosts[host_name] = f"Failed to establish SSH connection with {host_name}: {error}"
+                    logging.error("Failed to establish SSH connection with %s: %s", host_name, error)
+
+        logging.info("Connected to %s of %s hosts", len(self.connections), len(hosts))
+        return dict(self.connect_times)
 
     def execute_command_on_all(self, command):
         """Execute a command on all connected hosts."""
@@ -75,7 +333,7 @@ class SSHConnectionManager:
             try:
                 results[host_name] = connection.execute_command(command)
             except SSHConnectionError as e:
-                logging.error(f"Error on {host_name}: {e}")
+                logging.error("Error on %s: %s", host_name, e)
                 results[host_name] = None
         return results
 
@@ -83,7 +341,7 @@ class SSHConnectionManager:
         """Close all established SSH connections."""
         for host_name, connection in self.connections.items():
             connection.disconnect()
-            logging.info(f"Disconnected from {host_name}")
+            logging.info("Disconnected from %s", host_name)
 
 # Example usage:
 # manager = SSHConnectionManager()
@@ -0,0 +1,152 @@
+# tar_transfer.py
+
+import gzip
+import logging
+import os
+import shlex
+import tarfile
+from deploymate import tracing
+
+# Bytes buffered before they are written to the channel
+SEND_BUFFER_SIZE = 256 * 1024
+# gzip level used for the tar stream; higher levels cost more CPU than they save on the wire
+DEFAULT_COMPRESS_LEVEL = 6
+# Longest rm command sent when deleting files that are missing locally
+MAX_DELETE_COMMAND_LENGTH = 64 * 1024
+
+class TarTransferError(Exception):
+    """Custom exception for tar stream transfer errors."""
+    pass
+
+class _ChannelWriter:
+    """Minimal file object that buffers writes and sends them over a channel."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.buffer = bytearray()
+        self.bytes_sent = 0
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= SEND_BUFFER_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.channel.sendall(bytes(self.buffer))
+            self.bytes_sent += len(self.buffer)
+            self.buffer.clear()
+
+def local_tree_entries(local_dir):
+    """Return the relative paths of every directory, file and symlink below ``local_dir``, parents first."""
+    entries = []
+    for root, dir_names, file_names in os.walk(local_dir):
+        dir_names.sort()
+        relative_root = os.path.relpath(root, local_dir)
+        for name in dir_names + sorted(file_names):
+            entries.append(os.path.normpath(os.path.join(relative_root, name)))
+    return entries
+
+class TarStreamTransfer:
+    """Class for uploading directory trees as a single compressed tar stream."""
+
+    def __init__(self, ssh_client):
+        self.ssh_client = ssh_client
+        self.logger = logging.getLogger(__name__)
+
+    def upload_tree(self, local_dir, remote_dir, delete_missing=False, compress_level=DEFAULT_COMPRESS_LEVEL):
+        """Copy a local directory tree into a remote directory in one step.
+
+        The tree is packed into a gzip-compressed tar while it is being sent,
+        so no archive is written on the controller, and the host unpacks it
+        with a single ``sudo tar`` reading from the channel. File modes and
+        symlinks are preserved; files are owned by root on the host.
+
+        Args:
+            local_dir (str): The local directory whose contents are uploaded.
+            remote_dir (str): The remote directory to extract into; created if missing.
+            delete_missing (bool): Also remove remote entries that do not exist locally.
+            compress_level (int): gzip compression level of the stream.
+
+        Returns:
+            dict: 'files' (entries sent), 'bytes_sent' and 'deleted' (remote paths removed).
+
+        Raises:
+            TarTransferError: If the local directory is missing or the extraction fails.
+        """
+        if not os.path.isdir(local_dir):
+            raise TarTransferError(f"Local directory does not exist: {local_dir}")
+
+        entries = local_tree_entries(local_dir)
+        quoted_dir = shlex.quote(remote_dir)
+        command = f"sudo mkdir -p -- {quoted_dir} && sudo tar -xzpf - --no-same-owner -C {quoted_dir}"
+
+        with tracing.span(f"tar to {remote_dir}", tracing.CATEGORY_TRANSFER, files=len(entries)) as span:
+            channel = self.ssh_client.get_transport().open_session()
+            try:
+                channel.exec_command(command)
+                writer = _ChannelWriter(channel)
+                try:
+                    with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=compress_level, mtime=0) as compressed:
+                        with tarfile.open(fileobj=compressed, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                            for entry in entries:
+                                tar.add(os.path.join(local_dir, entry), arcname=entry, recursive=False)
+                    writer.flush()
+                    channel.shutdown_write()
+                except OSError as e:
+                    # tar exited early; its stderr explains why
+                    self.logger.debug("Tar stream to %s interrupted: %s", remote_dir, e)
+                exit_code = channel.recv_exit_status()
+                stderr = channel.makefile_stderr('rb').read().decode('utf-8', errors='replace')
+            finally:
+                channel.close()
+            span.set(bytes=writer.bytes_sent)
+
+        if exit_code != 0:
+            self.logger.error("Failed to extract tree into %s: %s", remote_dir, stderr)
+            raise TarTransferError(f"Failed to upload {local_dir} to {remote_dir}")
+        self.logger.info("Uploaded %s entries from %s to %s (%s bytes compressed)", len(entries), local_dir,
+                         remote_dir, writer.bytes_sent)
+
+        deleted = self.delete_missing(remote_dir, entries) if delete_missing else []
+        return {'files': len(entries), 'bytes_sent': writer.bytes_sent, 'deleted': deleted}
+
+    def delete_missing(self, remote_dir, local_entries):
+        """Remove entries below ``remote_dir`` that are not in ``local_entries``.
+
+        Returns:
+            list: The remote paths that were removed.
+        """
+        stdout, stderr, exit_code = self.ssh_client.run_command(
+            f"sudo find {shlex.quote(remote_dir)} -mindepth 1 -printf '%P\\n'", max_output_bytes=None)
+        if exit_code != 0:
+            raise TarTransferError(f"Failed to list {remote_dir}: {stderr}")
+
+        local = set(local_entries)
+        extraneous = []
+        for entry in sorted(filter(None, stdout.splitlines())):
+            entry = os.path.normpath(entry)
+            # Removing a directory already covers everything below it
+            if entry not in local and not (extraneous and entry.startswith(extraneous[-1] + '/')):
+                extraneous.append(entry)
+
+        remote_paths = [f"{remote_dir.rstrip('/')}/{entry}" for entry in extraneous]
+        batch = []
+        for remote_path in remote_paths + [None]:
+            quoted = shlex.quote(remote_path) if remote_path else ''
+            if batch and (remote_path is None or sum(map(len, batch)) + len(quoted) > MAX_DELETE_COMMAND_LENGTH):
+                _, stderr, exit_code = self.ssh_client.execute_command(f"sudo rm -rf -- {' '.join(batch)}")
+                if exit_code != 0:
+                    raise TarTransferError(f"Failed to delete files missing locally from {remote_dir}: {stderr}")
+                batch = []
+            if remote_path:
+                batch.append(quoted)
+
+        for remote_path in remote_paths:
+            self.logger.info("Deleted %s, which does not exist locally", remote_path)
+        return remote_paths
+
+# Example usage:
+# transfer = TarStreamTransfer(ssh_client)
+# transfer.upload_tree('build/webroot', '/var/www/html', delete_missing=True)
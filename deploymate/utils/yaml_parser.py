@@ -4,6 +4,9 @@ import yaml
 import logging
 import os
 
+# libyaml's loader is several times faster; PyYAML builds without it fall back to the pure-Python one
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 class YAMLParseError(Exception):
     """Custom exception for errors during YAML parsing."""
     pass
@@ -31,12 +34,12 @@ def parse_yaml(file_path: str) -> dict:
 
     try:
         with open(file_path, 'r') as file:
-            return yaml.safe_load(file)
+            return yaml.load(file, Loader=SafeLoader)
     except yaml.YAMLError as e:
-        logging.error(f"YAML parsing error in file {file_path}: {e}")
+        logging.error("YAML parsing error in file %s: %s", file_path, e)
         raise YAMLParseError(f"Error parsing YAML file {file_path}: {e}")
     except Exception as e:
-        logging.error(f"Unexpected error when parsing {file_path}: {e}")
+        logging.error("Unexpected error when parsing %s: %s", file_path, e)
         raise YAMLParseError(f"Unexpected error when parsing {file_path}")
 
 def parse_inventory(inventory_path: str) -> dict: